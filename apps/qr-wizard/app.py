@@ -1,22 +1,37 @@
+import atexit
+import base64
+import contextvars
 import csv
+import functools
 import hashlib
 import io
 import ipaddress
 import json
+import math
 import os
 import re
 import secrets
+import signal
+import sys
+import tempfile
 import threading
+import time
 import zipfile
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+from zoneinfo import ZoneInfo
 
 import qrcode
-import qrcode.image.svg
-from PIL import Image
+from PIL import Image, ImageColor
 from flask import (
     Flask,
     Response,
+    g,
+    has_request_context,
     jsonify,
     make_response,
     redirect,
@@ -25,12 +40,19 @@ from flask import (
     send_file,
     session,
 )
+from werkzeug.datastructures import MultiDict
 from werkzeug.security import check_password_hash
 from flask_sqlalchemy import SQLAlchemy
-from reportlab.lib.pagesizes import letter
+from flask_sqlalchemy.session import Session as FlaskSession
+from reportlab.lib.pagesizes import A3, A4, letter
+from reportlab.lib.units import mm
 from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
-from sqlalchemy import case, func, or_, text
+from sqlalchemy import String, and_, case, cast, create_engine, event, func, literal, null, or_, select, text, union, union_all
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateSchema
+from sqlalchemy.sql.util import find_tables
 from user_agents import parse as parse_user_agent
 
 app = Flask(__name__)
@@ -39,14 +61,52 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["IP_HASH_SALT"] = os.getenv("IP_HASH_SALT", "replace-me")
 app.config["UNIQUE_WINDOW_HOURS"] = int(os.getenv("UNIQUE_WINDOW_HOURS", "24"))
 app.config["DATA_RETENTION_DAYS"] = int(os.getenv("DATA_RETENTION_DAYS", "365"))
+app.config["ATTRIBUTION_WINDOW_HOURS"] = int(os.getenv("ATTRIBUTION_WINDOW_HOURS", "168"))
+app.config["ANALYTICS_TIMEZONE"] = os.getenv("ANALYTICS_TIMEZONE", "Europe/Zurich")
+app.config["ANALYTICS_CACHE_ENABLED"] = os.getenv("ANALYTICS_CACHE_ENABLED", "1").lower() in {"1", "true", "yes", "on"}
+app.config["ANALYTICS_CACHE_TTL_SECONDS"] = int(os.getenv("ANALYTICS_CACHE_TTL_SECONDS", "30"))
+app.config["ANALYTICS_CACHE_MAX_ENTRIES"] = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "512"))
+app.config["JOB_WORKERS"] = int(os.getenv("JOB_WORKERS", "2"))
+app.config["JOB_RESULTS_DIR"] = os.getenv("JOB_RESULTS_DIR", "").strip()
+app.config["JOB_RESULT_RETENTION_HOURS"] = int(os.getenv("JOB_RESULT_RETENTION_HOURS", "24"))
+app.config["JOB_STALE_SECONDS"] = int(os.getenv("JOB_STALE_SECONDS", "600"))
+app.config["EXPIRY_SWEEP_SECONDS"] = int(os.getenv("EXPIRY_SWEEP_SECONDS", "60"))
+app.config["HISTORY_FLUSH_SECONDS"] = float(os.getenv("HISTORY_FLUSH_SECONDS", "2"))
+app.config["HISTORY_COMPACT_DAYS"] = int(os.getenv("HISTORY_COMPACT_DAYS", "90"))
 app.config["PUBLIC_BASE_URL"] = os.getenv("PUBLIC_BASE_URL", "").strip()
 app.config["TRACKING_PARAM"] = os.getenv("TRACKING_PARAM", "qr_tid")
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "a-very-secret-internal-key-12345")
+# Empty: a random key is created in app_state on first use, independent of SECRET_KEY
+app.config["SLUG_KEY"] = os.getenv("SLUG_KEY", "").strip()
+app.config["SLUG_BLOCK_SIZE"] = int(os.getenv("SLUG_BLOCK_SIZE", "100"))
+# Per-workspace database URL with a {workspace} placeholder; empty = one SQLite file per
+# workspace next to the main database (or one schema per workspace on other backends)
+app.config["WORKSPACE_DATABASE_URL"] = os.getenv("WORKSPACE_DATABASE_URL", "").strip()
 # The password provided: asof$dSSDWggt89
 app.config["ADMIN_PASSWORD_HASH"] = os.getenv("ADMIN_PASSWORD_HASH", "scrypt:32768:8:1$6jrKvL9KGbYOoKZG$7896820a48846f40b52b191a2b1391675b2993e3fe6a8dc9885cb9591003f06d9e2b1f475cc674ae57757d09237b84cf3b6efe77f294eae21a2077f55ac86978")
 
 
-db = SQLAlchemy(app)
+DEFAULT_WORKSPACE = "default"
+WORKSPACE_KEY_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+current_workspace = contextvars.ContextVar("current_workspace", default=DEFAULT_WORKSPACE)
+
+
+class WorkspaceSession(FlaskSession):
+    """
+    Sends statements on tenant tables (TENANT_TABLES) to the engine of the
+    current workspace; jobs, app state and the workspace/slug indexes stay on
+    the main database. A session must only ever see one workspace, see
+    use_workspace().
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        workspace = current_workspace.get()
+        if bind is None and workspace != DEFAULT_WORKSPACE and touches_tenant_tables(mapper, clause):
+            return workspace_engines.get(workspace)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={"class_": WorkspaceSession})
 
 
 def now_utc():
@@ -77,6 +137,11 @@ class QRCode(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=now_utc)
     updated_at = db.Column(db.DateTime, nullable=False, default=now_utc, onupdate=now_utc)
     expires_at = db.Column(db.DateTime, nullable=True)
+    # Final /t/<slug> target (destination + UTM + tracking param), kept current on every write
+    redirect_url = db.Column(db.Text, nullable=True)
+
+    # Lets the expiry sweeper range-scan active codes that are due
+    __table_args__ = (db.Index("ix_qr_codes_status_expires_at", "status", "expires_at"),)
 
 
 class ScanEvent(db.Model):
@@ -99,17 +164,31 @@ class ScanEvent(db.Model):
     is_unique = db.Column(db.Boolean, nullable=False, default=False, index=True)
     is_duplicate = db.Column(db.Boolean, nullable=False, default=False, index=True)
     query_payload = db.Column(db.Text, nullable=True)
+    # Integer time buckets filled at ingest (see scan_time_buckets); local_* use ANALYTICS_TIMEZONE
+    epoch_hour = db.Column(db.Integer, nullable=True, index=True)
+    local_date = db.Column(db.Integer, nullable=True, index=True)  # YYYYMMDD
+    local_week = db.Column(db.Integer, nullable=True, index=True)  # ISO YYYYWW
+    local_hour = db.Column(db.SmallInteger, nullable=True)
+    local_dow = db.Column(db.SmallInteger, nullable=True)  # 0 = Sunday
+
+    __table_args__ = (
+        # Serves the time-bounded fingerprint lookups of the attribution join.
+        db.Index("ix_scan_events_fingerprint_scanned_at", "visitor_fingerprint", "scanned_at"),
+    )
 
 
 class QRHistory(db.Model):
     __tablename__ = "qr_history"
 
     id = db.Column(db.Integer, primary_key=True)
-    qr_code_id = db.Column(db.Integer, db.ForeignKey("qr_codes.id"), nullable=False, index=True)
+    qr_code_id = db.Column(db.Integer, db.ForeignKey("qr_codes.id"), nullable=False)
     action = db.Column(db.String(100), nullable=False)
-    details = db.Column(db.Text, nullable=True)
+    details = db.Column(db.Text, nullable=True)  # JSON text, rows written before payload existed
+    payload = db.Column(db.LargeBinary, nullable=True)  # see encode_history
     created_at = db.Column(db.DateTime, nullable=False, default=now_utc)
 
+    __table_args__ = (db.Index("ix_qr_history_qr_code_created", "qr_code_id", "created_at"),)
+
 
 class Goal(db.Model):
     __tablename__ = "goals"
@@ -136,20 +215,348 @@ class ConversionEvent(db.Model):
     occurred_at = db.Column(db.DateTime, nullable=False, default=now_utc, index=True)
 
 
+class ScanAttribution(db.Model):
+    """Derived link from a conversion to the scan that led to it (last touch)."""
+
+    __tablename__ = "scan_attributions"
+
+    id = db.Column(db.Integer, primary_key=True)
+    conversion_event_id = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    scan_event_id = db.Column(db.Integer, nullable=True, index=True)
+    qr_code_id = db.Column(db.Integer, nullable=True, index=True)
+    value = db.Column(db.Float, nullable=True)
+    scanned_at = db.Column(db.DateTime, nullable=True)
+    occurred_at = db.Column(db.DateTime, nullable=False, index=True)
+    lag_seconds = db.Column(db.Integer, nullable=True)
+
+
+class VisitorSketch(db.Model):
+    """Per-QR, per-hour HyperLogLog sketch of non-bot visitor fingerprints."""
+
+    __tablename__ = "visitor_sketches"
+
+    id = db.Column(db.Integer, primary_key=True)
+    qr_code_id = db.Column(db.Integer, db.ForeignKey("qr_codes.id"), nullable=False, index=True)
+    hour = db.Column(db.Integer, nullable=False, index=True)  # hours since the Unix epoch (UTC)
+    registers = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint("qr_code_id", "hour", name="uq_visitor_sketches_qr_hour"),)
+
+
+class AppState(db.Model):
+    """Small shared integer counters (cache generation etc.) visible to every worker."""
+
+    __tablename__ = "app_state"
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """A long-running operation (bulk import, exports, purges) executed by the job runner."""
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: secrets.token_hex(16))
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="queued", index=True)
+    params = db.Column(db.Text, nullable=False, default="{}")
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    message = db.Column(db.String(255), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    result_path = db.Column(db.String(512), nullable=True)
+    result_name = db.Column(db.String(255), nullable=True)
+    result_mimetype = db.Column(db.String(100), nullable=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    workspace = db.Column(db.String(40), nullable=False, default=DEFAULT_WORKSPACE)
+    worker = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_utc, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class Workspace(db.Model):
+    """A tenant with its own database for QR codes, scans, conversions and their history."""
+
+    __tablename__ = "workspaces"
+
+    key = db.Column(db.String(40), primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_utc)
+
+
+class SlugRoute(db.Model):
+    """Global slug -> workspace index, so public routes know which tenant database to ask."""
+
+    __tablename__ = "slug_routes"
+
+    slug = db.Column(db.String(32), primary_key=True)
+    workspace = db.Column(db.String(40), nullable=False, index=True)
+
+
+# Tables that live in each workspace's database (the default workspace uses the main one)
+TENANT_TABLES = [
+    QRCode.__table__,
+    ScanEvent.__table__,
+    QRHistory.__table__,
+    Goal.__table__,
+    ConversionEvent.__table__,
+    ScanAttribution.__table__,
+    VisitorSketch.__table__,
+]
+
+
+def touches_tenant_tables(mapper=None, clause=None):
+    if mapper is not None:
+        return sa_inspect(mapper).local_table in TENANT_TABLES
+    if clause is not None:
+        return any(table in TENANT_TABLES for table in find_tables(clause, include_crud=True))
+    return False
+
+
+def database_dir():
+    """Directory of the main SQLite database (temp dir for other backends); default home of local data."""
+    url = db.engine.url
+    database = url.database if url.get_backend_name() == "sqlite" else None
+    if database and database != ":memory:":
+        return os.path.dirname(os.path.abspath(database))
+    return tempfile.gettempdir()
+
+
+class WorkspaceEngines:
+    """
+    Engine-per-tenant registry. Engines are opened on first use and the tenant
+    tables created in them, so a new workspace needs no migration step. Each
+    workspace gets a database of its own (WORKSPACE_DATABASE_URL, a SQLite file
+    under <data dir>/workspaces, or a schema of the main database on other
+    backends), so one tenant's writes and heavy queries never lock another's.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = {}
+        self._pid = os.getpid()
+
+    def get(self, key):
+        if key == DEFAULT_WORKSPACE:
+            return db.engine
+        with self._lock:
+            if self._pid != os.getpid():
+                # Pooled connections must not cross a fork
+                for engine in self._engines.values():
+                    engine.dispose(close=False)
+                self._engines, self._pid = {}, os.getpid()
+            engine = self._engines.get(key)
+            if engine is None:
+                engine = self._engines[key] = self._open(key)
+        return engine
+
+    def known(self, key):
+        return key == DEFAULT_WORKSPACE or key in self._engines
+
+    def _open(self, key):
+        template = app.config["WORKSPACE_DATABASE_URL"]
+        schema = None
+        if template:
+            engine = create_engine(template.format(workspace=key))
+        elif db.engine.url.get_backend_name() == "sqlite":
+            directory = os.path.join(database_dir(), "workspaces")
+            os.makedirs(directory, exist_ok=True)
+            engine = create_engine(f"sqlite:///{os.path.join(directory, key)}.db")
+        else:
+            schema = f"ws_{key}"
+            with db.engine.begin() as conn:
+                conn.execute(CreateSchema(schema, if_not_exists=True))
+            engine = db.engine.execution_options(schema_translate_map={None: schema})
+        migrate_tenant_tables(engine, schema)
+        return engine
+
+
+workspace_engines = WorkspaceEngines()
+
+
+def workspace_keys():
+    return [DEFAULT_WORKSPACE] + [row[0] for row in db.session.query(Workspace.key).order_by(Workspace.key).all()]
+
+
+@contextmanager
+def use_workspace(key):
+    """
+    Run a block against one workspace's data, on a fresh session (an identity
+    map must never mix rows of two tenant databases).
+    """
+    db.session.remove()
+    token = current_workspace.set(key)
+    try:
+        yield
+    finally:
+        db.session.remove()
+        current_workspace.reset(token)
+
+
+def workspace_for_slug(slug):
+    """
+    Workspace holding a slug. Codes of the default workspace have no route; a
+    slug found in neither is looked up in the workspace databases and its
+    route repaired (a commit that failed between the two databases).
+    """
+    route = db.session.get(SlugRoute, slug)
+    if route:
+        return route.workspace
+    if db.session.query(QRCode.id).filter_by(slug=slug).first():
+        return DEFAULT_WORKSPACE
+    for workspace in workspace_keys()[1:]:
+        with workspace_engines.get(workspace).connect() as conn:
+            if conn.execute(select(QRCode.id).where(QRCode.slug == slug)).first():
+                add_slug_routes(workspace, [slug])
+                return workspace
+    return DEFAULT_WORKSPACE
+
+
+def add_slug_routes(workspace, slugs):
+    """Insert routes, skipping slugs that already have one."""
+    with db.engine.begin() as conn:
+        existing = {row[0] for row in conn.execute(select(SlugRoute.slug).where(SlugRoute.slug.in_(slugs)))}
+        rows = [{"slug": slug, "workspace": workspace} for slug in slugs if slug not in existing]
+        if rows:
+            conn.execute(SlugRoute.__table__.insert(), rows)
+
+
+def drop_unbacked_routes(workspace, slugs):
+    """Delete routes of `workspace` whose code is not (or no longer) in its database."""
+    with workspace_engines.get(workspace).connect() as conn:
+        present = {row[0] for row in conn.execute(select(QRCode.slug).where(QRCode.slug.in_(slugs)))}
+    missing = set(slugs) - present
+    if missing:
+        with db.engine.begin() as conn:
+            conn.execute(SlugRoute.__table__.delete().where(SlugRoute.slug.in_(missing), SlugRoute.workspace == workspace))
+    return len(missing)
+
+
+def repair_slug_routes(workspace, batch_size=1000):
+    """Make slug_routes match a workspace's codes: add missing routes, drop routes without a code."""
+    with workspace_engines.get(workspace).connect() as conn:
+        slugs = [row[0] for row in conn.execute(select(QRCode.slug))]
+    for start in range(0, len(slugs), batch_size):
+        add_slug_routes(workspace, slugs[start : start + batch_size])
+    with db.engine.connect() as conn:
+        routed = [row[0] for row in conn.execute(select(SlugRoute.slug).where(SlugRoute.workspace == workspace))]
+    for start in range(0, len(routed), batch_size):
+        drop_unbacked_routes(workspace, routed[start : start + batch_size])
+
+
+analytics_tz = ZoneInfo(app.config["ANALYTICS_TIMEZONE"])
+
+
+def epoch_hour(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() // 3600)
+
+
+def hour_start(hour):
+    return datetime(1970, 1, 1) + timedelta(hours=hour)
+
+
+def scan_time_buckets(scanned_at):
+    """Integer bucket columns for a naive UTC timestamp."""
+    local = scanned_at.replace(tzinfo=timezone.utc).astimezone(analytics_tz)
+    iso_year, iso_week, _ = local.isocalendar()
+    return {
+        "epoch_hour": epoch_hour(scanned_at),
+        "local_date": local.year * 10000 + local.month * 100 + local.day,
+        "local_week": iso_year * 100 + iso_week,
+        "local_hour": local.hour,
+        "local_dow": (local.weekday() + 1) % 7,
+    }
+
+
+def backfill_scan_buckets(rebuild=False, batch_size=5000):
+    """Fill bucket columns for scans stored before they existed (or all, on rebuild)."""
+    updated = 0
+    last_id = 0
+    while True:
+        query = db.session.query(ScanEvent.id, ScanEvent.scanned_at).filter(ScanEvent.id > last_id)
+        if not rebuild:
+            query = query.filter(ScanEvent.epoch_hour.is_(None))
+        batch = query.order_by(ScanEvent.id.asc()).limit(batch_size).all()
+        if not batch:
+            return updated
+        db.session.execute(
+            ScanEvent.__table__.update().where(ScanEvent.id == db.bindparam("scan_id")),
+            [{"scan_id": row.id, **scan_time_buckets(row.scanned_at)} for row in batch],
+        )
+        db.session.commit()
+        updated += len(batch)
+        last_id = batch[-1].id
+
+
+def migrate_tenant_tables(engine, schema=None):
+    """
+    Bring the tenant tables of one database (the main one or a workspace's)
+    up to date: columns added after they were created, then missing tables
+    and indexes.
+    """
+    inspector = sa_inspect(engine)
+    prefix = f"{schema}." if schema else ""
+
+    def add_column(table, column, ddl_type):
+        print(f"Migrating: Adding {column} to {prefix}{table}")
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {prefix}{table} ADD COLUMN {column} {ddl_type}"))
+
+    if inspector.has_table("qr_codes", schema=schema):
+        columns = [c["name"] for c in inspector.get_columns("qr_codes", schema=schema)]
+        if "expires_at" not in columns:
+            add_column("qr_codes", "expires_at", "DATETIME")
+        if "redirect_url" not in columns:
+            add_column("qr_codes", "redirect_url", "TEXT")
+
+    if inspector.has_table("qr_history", schema=schema):
+        columns = [c["name"] for c in inspector.get_columns("qr_history", schema=schema)]
+        if "payload" not in columns:
+            add_column("qr_history", "payload", db.LargeBinary().compile(dialect=engine.dialect))
+
+    if inspector.has_table("scan_events", schema=schema):
+        columns = [c["name"] for c in inspector.get_columns("scan_events", schema=schema)]
+        for column in ["epoch_hour", "local_date", "local_week", "local_hour", "local_dow"]:
+            if column not in columns:
+                add_column("scan_events", column, "INTEGER")
+
+    db.metadata.create_all(engine, tables=TENANT_TABLES)
+    # create_all() does not add new indexes to tables that already exist
+    for table in TENANT_TABLES:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+
 def migrate_db():
     with app.app_context():
-        # Check if expires_at exists
-        from sqlalchemy import inspect
-        inspector = inspect(db.engine)
-        columns = [c["name"] for c in inspector.get_columns("qr_codes")]
-        if "expires_at" not in columns:
-            print("Migrating: Adding expires_at to qr_codes")
-            with db.engine.begin() as conn:
-                conn.execute(text('ALTER TABLE qr_codes ADD COLUMN expires_at DATETIME'))
-        
+        migrate_tenant_tables(db.engine)
+
+        inspector = sa_inspect(db.engine)
+        if inspector.has_table("jobs"):
+            columns = [c["name"] for c in inspector.get_columns("jobs")]
+            if "workspace" not in columns:
+                print("Migrating: Adding workspace to jobs")
+                with db.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE jobs ADD COLUMN workspace VARCHAR(40) NOT NULL DEFAULT '{DEFAULT_WORKSPACE}'"))
+
         # Also check for other tables if needed
         db.create_all()
 
+        # Opening a workspace engine migrates its database (WorkspaceEngines._open)
+        for workspace in workspace_keys():
+            with use_workspace(workspace):
+                workspace_engines.get(workspace)
+                backfilled = backfill_scan_buckets()
+                if backfilled:
+                    print(f"Migrating: Filled time buckets for {backfilled} scans in workspace {workspace}")
+            if workspace != DEFAULT_WORKSPACE:
+                repair_slug_routes(workspace)
+
 
 # Call migration
 try:
@@ -200,6 +607,59 @@ class GeoResolver:
 geo_resolver = GeoResolver()
 
 
+HLL_PRECISION = 11  # 2048 registers, ~2.3% standard error
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter with 2**precision one-byte registers. Sketches
+    with the same precision merge losslessly (register-wise max), so an estimate
+    for any union of QR codes and hours comes from merging the stored sketches.
+    """
+
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+
+    @staticmethod
+    def hash_value(value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def add(self, value):
+        """Add a value; returns True when the sketch changed."""
+        hashed = self.hash_value(value)
+        index = hashed >> (64 - self.precision)
+        remainder = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        # Hourly sketches are mostly empty registers, which compress very well
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data, precision=HLL_PRECISION):
+        return cls(precision, zlib.decompress(data))
+
+
 BOT_KEYWORDS = {
     "bot",
     "spider",
@@ -218,6 +678,9 @@ def get_public_base_url():
     configured = app.config.get("PUBLIC_BASE_URL")
     if configured:
         return configured.rstrip("/")
+    if not has_request_context():
+        # Background jobs use the URL of the request that submitted them
+        return g.get("job_base_url", "")
     return request.url_root.rstrip("/")
 
 
@@ -239,12 +702,132 @@ def pick_text(payload, key, max_len=255):
     return trimmed[:max_len]
 
 
-def generate_slug(length=7):
-    alphabet = "23456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
-    while True:
-        slug = "".join(secrets.choice(alphabet) for _ in range(length))
-        if not QRCode.query.filter_by(slug=slug).first():
-            return slug
+SLUG_ALPHABET = "23456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+SLUG_LENGTH = 7
+SLUG_SPACE = len(SLUG_ALPHABET) ** SLUG_LENGTH
+SLUG_HALF_BITS = ((SLUG_SPACE - 1).bit_length() + 1) // 2
+SLUG_ROUNDS = 6
+SLUG_COUNTER_KEY = "slug_counter"
+SLUG_KEY_STATE_KEYS = [f"slug_key_{index}" for index in range(4)]
+
+
+def reserve_counter_block(key, count):
+    """
+    Reserve `count` values of a shared app_state counter in its own
+    transaction and return the first one. Runs on a separate connection so it
+    never commits the caller's session.
+    """
+    table = AppState.__table__
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                updated = conn.execute(table.update().where(table.c.key == key).values(value=table.c.value + count)).rowcount
+                if not updated:
+                    conn.execute(table.insert().values(key=key, value=count))
+                end = conn.execute(select(table.c.value).where(table.c.key == key)).scalar_one()
+            return end - count
+        except IntegrityError:
+            # Another worker created the counter concurrently; retry as an update
+            continue
+    raise RuntimeError(f"Could not reserve values from counter {key}")
+
+
+def stored_slug_key():
+    """
+    The slug permutation key kept in app_state, created at random by the first
+    worker that needs it. Rotating SECRET_KEY therefore never changes it.
+    """
+    table = AppState.__table__
+    query = select(table.c.key, table.c.value).where(table.c.key.in_(SLUG_KEY_STATE_KEYS))
+    with db.engine.connect() as conn:
+        words = dict(conn.execute(query).all())
+    if len(words) < len(SLUG_KEY_STATE_KEYS):
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert(), [{"key": key, "value": secrets.randbits(63)} for key in SLUG_KEY_STATE_KEYS])
+        except IntegrityError:
+            pass  # another worker stored it first
+        with db.engine.connect() as conn:
+            words = dict(conn.execute(query).all())
+    return hashlib.sha256(b"".join(words[key].to_bytes(8, "big") for key in SLUG_KEY_STATE_KEYS)).digest()
+
+
+class SlugAllocator:
+    """
+    Hands out slugs from blocks of a shared counter. Each counter value goes
+    through a keyed Feistel permutation of [0, 57**7) and is written in the
+    slug alphabet, so slugs are unique by construction but not sequential.
+    A block costs one counter update plus one query that skips slugs already
+    taken in any workspace (legacy random slugs, or a changed key).
+    """
+
+    def __init__(self, key, block_size):
+        # Without a configured key the stored one is loaded on the first refill
+        self._key = hashlib.sha256(key.encode("utf-8")).digest() if key else None
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._ready = []
+        self._pid = os.getpid()
+
+    def _round(self, index, half):
+        digest = hashlib.blake2b(half.to_bytes(8, "big"), key=self._key, digest_size=8, person=bytes([index]) * 16).digest()
+        return int.from_bytes(digest, "big") & ((1 << SLUG_HALF_BITS) - 1)
+
+    def permute(self, value):
+        mask = (1 << SLUG_HALF_BITS) - 1
+        while True:
+            left, right = value >> SLUG_HALF_BITS, value & mask
+            for index in range(SLUG_ROUNDS):
+                left, right = right, left ^ self._round(index, right)
+            value = (left << SLUG_HALF_BITS) | right
+            # Cycle-walk until the value falls back inside the slug space
+            if value < SLUG_SPACE:
+                return value
+
+    @staticmethod
+    def encode(value):
+        chars = []
+        for _ in range(SLUG_LENGTH):
+            value, digit = divmod(value, len(SLUG_ALPHABET))
+            chars.append(SLUG_ALPHABET[digit])
+        return "".join(reversed(chars))
+
+    def _refill(self, count):
+        if self._key is None:
+            self._key = stored_slug_key()
+        start = reserve_counter_block(SLUG_COUNTER_KEY, count)
+        if start + count > SLUG_SPACE:
+            raise RuntimeError("Slug space exhausted")
+        slugs = [self.encode(self.permute(value)) for value in range(start, start + count)]
+        for offset in range(0, len(slugs), BULK_CHUNK_SIZE):
+            chunk = slugs[offset:offset + BULK_CHUNK_SIZE]
+            # Codes of other workspaces live in their own databases, but every one
+            # of their slugs is routed from slug_routes on the main database
+            taken_query = union(
+                select(QRCode.slug).where(QRCode.slug.in_(chunk)),
+                select(SlugRoute.slug).where(SlugRoute.slug.in_(chunk)),
+            )
+            with db.engine.connect() as conn:
+                taken = set(conn.execute(taken_query).scalars())
+            self._ready.extend(slug for slug in chunk if slug not in taken)
+
+    def allocate(self, count=1):
+        """Return `count` unused slugs; callers doing bulk work should ask for all of them at once."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Never share a reserved block with the process we were forked from
+                self._ready, self._pid = [], os.getpid()
+            while len(self._ready) < count:
+                self._refill(max(self._block_size, count - len(self._ready)))
+            slugs, self._ready = self._ready[:count], self._ready[count:]
+        return slugs
+
+
+slug_allocator = SlugAllocator(app.config["SLUG_KEY"], app.config["SLUG_BLOCK_SIZE"])
+
+
+def generate_slug():
+    return slug_allocator.allocate(1)[0]
 
 
 def tracking_url(slug):
@@ -368,6 +951,87 @@ def append_tracking_param(url, slug):
     return urlunparse((parsed.scheme, parsed.netloc, parsed.path, parsed.params, updated_query, parsed.fragment))
 
 
+def build_redirect_url(qr_code):
+    return append_tracking_param(apply_utm(qr_code.destination_url, qr_code), qr_code.slug)
+
+
+@event.listens_for(QRCode, "before_insert")
+@event.listens_for(QRCode, "before_update")
+def set_redirect_url(mapper, connection, qr_code):
+    qr_code.redirect_url = build_redirect_url(qr_code)
+
+
+@event.listens_for(db.session, "before_flush")
+def route_new_slugs(session, flush_context, instances):
+    """Index codes created in a workspace other than the default one in slug_routes."""
+    workspace = current_workspace.get()
+    if workspace == DEFAULT_WORKSPACE:
+        return
+    for obj in list(session.new):
+        if isinstance(obj, QRCode):
+            session.add(SlugRoute(slug=obj.slug, workspace=workspace))
+            session.info.setdefault("new_slug_routes", set()).add((workspace, obj.slug))
+
+
+@event.listens_for(db.session, "after_commit")
+def forget_new_slugs(session):
+    session.info.pop("new_slug_routes", None)
+
+
+@event.listens_for(db.session, "after_rollback")
+def compensate_new_slugs(session):
+    """
+    Routes (main database) and codes (workspace database) commit separately;
+    if the commit failed halfway, remove routes whose code never landed.
+    Codes left without a route are repaired on lookup (workspace_for_slug).
+    """
+    pending = session.info.pop("new_slug_routes", None)
+    if not pending:
+        return
+    by_workspace = defaultdict(list)
+    for workspace, slug in pending:
+        by_workspace[workspace].append(slug)
+    for workspace, slugs in by_workspace.items():
+        try:
+            drop_unbacked_routes(workspace, slugs)
+        except Exception as e:
+            print(f"Could not clean up slug routes in workspace {workspace}: {e}")
+
+
+REDIRECT_CONFIG_KEY = "redirect_url_config"
+
+
+def redirect_config_checksum():
+    return zlib.crc32(app.config["TRACKING_PARAM"].encode("utf-8"))
+
+
+def backfill_redirect_urls(ids=None, rebuild=False, batch_size=1000):
+    """
+    Store redirect_url for codes written outside the ORM unit of work: rows
+    from before the column existed, set-based bulk updates (`ids`), or all rows
+    when `rebuild` (e.g. after TRACKING_PARAM changed).
+    """
+    query = QRCode.query.order_by(QRCode.id)
+    if ids is not None:
+        query = query.filter(QRCode.id.in_(ids))
+    elif not rebuild:
+        query = query.filter(QRCode.redirect_url.is_(None))
+
+    updated = 0
+    last_id = 0
+    while True:
+        batch = query.filter(QRCode.id > last_id).limit(batch_size).all()
+        if not batch:
+            break
+        db.session.execute(
+            db.update(QRCode),
+            [{"id": qr.id, "redirect_url": build_redirect_url(qr)} for qr in batch],
+        )
+        updated += len(batch)
+        last_id = batch[-1].id
+    return updated
+
+
 def qr_to_dict(qr_code, scan_count=None):
     res = {
         "id": qr_code.id,
@@ -375,6 +1039,7 @@ def qr_to_dict(qr_code, scan_count=None):
         "tracking_url": f"{app.config['PUBLIC_BASE_URL'].rstrip('/') if app.config['PUBLIC_BASE_URL'] else ''}/t/{qr_code.slug}" if app.config["PUBLIC_BASE_URL"] else None,
         "name": qr_code.name,
         "destination_url": qr_code.destination_url,
+        "redirect_url": qr_code.redirect_url,
         "campaign": qr_code.campaign,
         "channel": qr_code.channel,
         "location": qr_code.location,
@@ -405,14 +1070,324 @@ def qr_to_dict(qr_code, scan_count=None):
     return res
 
 
-def save_history(qr_code_id, action, details=None):
-    entry = QRHistory(qr_code_id=qr_code_id, action=action, details=details)
-    db.session.add(entry)
+def encode_history(value):
+    """Compact JSON, raw-deflated when that is smaller. The first byte tags the encoding."""
+    raw = json.dumps(value, separators=(",", ":"), default=str).encode("utf-8")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    packed = compressor.compress(raw) + compressor.flush()
+    return b"z" + packed if len(packed) < len(raw) else b"j" + raw
+
+
+def decode_history(payload):
+    data = payload[1:]
+    if payload[:1] == b"z":
+        data = zlib.decompress(data, -15)
+    return json.loads(data)
+
+
+def history_value(details):
+    """History details are passed as dicts; older callers and rows use JSON strings."""
+    if isinstance(details, str):
+        try:
+            return json.loads(details)
+        except ValueError:
+            return details
+    return details
+
+
+def row_history_value(row):
+    return decode_history(row.payload) if row.payload else history_value(row.details)
+
+
+class HistoryLog:
+    """
+    Write-behind buffer for qr_history. Entries are queued once the transaction
+    that produced them commits and are inserted in batches by a background
+    thread (every HISTORY_FLUSH_SECONDS, or as soon as max_batch are pending).
+    The queue is also flushed at exit (SIGTERM included), so only a process
+    that is killed outright (SIGKILL, OOM killer) loses history: at most the
+    entries of its last HISTORY_FLUSH_SECONDS. Set it to 0 to write on commit.
+    """
+
+    max_batch = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []
+        self._pid = None
+
+    def append(self, entries, workspace=DEFAULT_WORKSPACE):
+        with self._lock:
+            self._entries.extend((workspace, entry) for entry in entries)
+            pending = len(self._entries)
+        if app.config["HISTORY_FLUSH_SECONDS"] <= 0 or app.testing or pending >= self.max_batch:
+            self.flush()
+        else:
+            self._ensure_started()
+
+    def flush(self):
+        with self._lock:
+            pending, self._entries = self._entries, []
+        if not pending:
+            return 0
+        by_workspace = defaultdict(list)
+        for workspace, entry in pending:
+            by_workspace[workspace].append(entry)
+        written, failed, error = 0, [], None
+        with app.app_context():
+            for workspace, entries in by_workspace.items():
+                try:
+                    written += self._write(workspace_engines.get(workspace), entries)
+                except Exception as e:
+                    failed.extend((workspace, entry) for entry in entries)
+                    error = e
+        if failed:
+            with self._lock:
+                self._entries[:0] = failed
+            raise error
+        return written
+
+    @staticmethod
+    def _write(engine, entries):
+        insert = QRHistory.__table__.insert()
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert, entries)
+        except IntegrityError:
+            # Some codes were deleted (by another worker) before their entries were written
+            with engine.begin() as conn:
+                qr_ids = {entry["qr_code_id"] for entry in entries}
+                existing = set(conn.execute(select(QRCode.id).where(QRCode.id.in_(qr_ids))).scalars())
+                entries = [entry for entry in entries if entry["qr_code_id"] in existing]
+                if entries:
+                    conn.execute(insert, entries)
+        return len(entries)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="history-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(app.config["HISTORY_FLUSH_SECONDS"])
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception("History flush failed")
+
+
+history_log = HistoryLog()
+atexit.register(history_log.flush)
+
+
+def save_history(qr_code, action, details=None):
+    """
+    Record a history entry for a QRCode (or QR code id). It is written by the
+    history log after the current transaction commits, and dropped on rollback.
+    """
+    save_history_bulk([qr_code], action, details)
+
+
+def save_history_bulk(qr_codes, action, details=None):
+    session = db.session()
+    if not session.in_transaction():
+        session.begin()  # so a rollback is guaranteed to discard the entries
+    now = now_utc()
+    session.info.setdefault("qr_history", []).extend((qr_code, action, details, now) for qr_code in qr_codes)
+
+
+@event.listens_for(db.session, "after_commit")
+def queue_committed_history(session):
+    pending = session.info.pop("qr_history", None)
+    if not pending:
+        return
+    entries = []
+    for target, action, details, created_at in pending:
+        identity = (target,) if isinstance(target, int) else sa_inspect(target).identity
+        if identity is None:
+            continue
+        value = history_value(details)
+        entries.append(
+            {
+                "qr_code_id": identity[0],
+                "action": action,
+                "details": None,
+                "payload": encode_history(value) if value is not None else None,
+                "created_at": created_at,
+            }
+        )
+    history_log.append(entries, current_workspace.get())
+
+
+@event.listens_for(db.session, "after_soft_rollback")
+def drop_rolled_back_history(session, previous_transaction):
+    session.info.pop("qr_history", None)
+
+
+def history_entries(qr_code_id, limit=200):
+    """Newest-first history of one code, with compacted rows expanded."""
+    history_log.flush()
+    rows = (
+        QRHistory.query.filter_by(qr_code_id=qr_code_id)
+        .order_by(QRHistory.created_at.desc(), QRHistory.id.desc())
+        .limit(limit)
+        .all()
+    )
+    entries = []
+    for row in rows:
+        value = row_history_value(row)
+        if row.action == "compacted":
+            entries.extend(
+                {"id": row.id, "action": action, "details": details, "created_at": created_at}
+                for created_at, action, details in reversed(value)
+            )
+        else:
+            # Rows from before payload existed keep their details text as stored
+            details = value if row.payload else row.details
+            entries.append({"id": row.id, "action": row.action, "details": details, "created_at": row.created_at.isoformat()})
+        if len(entries) >= limit:
+            break
+    return entries[:limit]
+
+
+def compact_history(older_than_days=None, batch_size=200):
+    """
+    Fold each code's history entries older than the cutoff into one
+    "compacted" row holding the encoded list of entries. Returns the number of
+    rows folded.
+    """
+    days = app.config["HISTORY_COMPACT_DAYS"] if older_than_days is None else older_than_days
+    cutoff = now_utc() - timedelta(days=days)
+    history_log.flush()
+
+    candidates = [
+        row[0]
+        for row in db.session.query(QRHistory.qr_code_id)
+        .filter(QRHistory.created_at < cutoff)
+        .group_by(QRHistory.qr_code_id)
+        .having(func.count(QRHistory.id) > 1)
+        .all()
+    ]
+    folded = 0
+    for chunk in id_chunks(candidates, batch_size):
+        old_rows = QRHistory.query.filter(QRHistory.qr_code_id.in_(chunk), QRHistory.created_at < cutoff)
+        by_qr = defaultdict(list)
+        for row in old_rows.order_by(QRHistory.created_at, QRHistory.id).all():
+            by_qr[row.qr_code_id].append(row)
+
+        compacted = []
+        for qr_id, rows in by_qr.items():
+            entries = []
+            for row in rows:
+                value = row_history_value(row)
+                if row.action == "compacted":
+                    entries.extend(value)
+                else:
+                    entries.append([row.created_at.isoformat(), row.action, value])
+            compacted.append(
+                {
+                    "qr_code_id": qr_id,
+                    "action": "compacted",
+                    "details": None,
+                    "payload": encode_history(entries),
+                    "created_at": rows[-1].created_at,
+                }
+            )
+            folded += len(rows)
+
+        old_rows.delete(synchronize_session=False)
+        db.session.execute(QRHistory.__table__.insert(), compacted)
+        db.session.commit()
+    return folded
+
+
+BULK_CHUNK_SIZE = 500  # keeps IN lists well below SQLite's bound-parameter limit
+
+
+def id_chunks(ids, size=BULK_CHUNK_SIZE):
+    ids = sorted({int(qr_id) for qr_id in ids})
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def expire_due_codes(batch_size=500, now=None):
+    """Archive active codes whose expires_at has passed, in batches, with an "expired" history row each."""
+    now = now or now_utc()
+    details = {"status": "archived"}
+    expired = 0
+    while True:
+        due = [
+            row[0]
+            for row in db.session.query(QRCode.id)
+            .filter(QRCode.status == "active", QRCode.expires_at <= now)
+            .order_by(QRCode.expires_at)
+            .limit(batch_size)
+            .all()
+        ]
+        if not due:
+            break
+        # A concurrent sweep may have archived some of them first: history and
+        # the count only cover the rows this UPDATE changed
+        table = QRCode.__table__
+        archive = (
+            table.update()
+            .where(table.c.id.in_(due), table.c.status == "active")
+            .values(status="archived", updated_at=now)
+        )
+        if db.session.get_bind(mapper=QRCode.__mapper__).dialect.update_returning:
+            changed = list(db.session.execute(archive.returning(table.c.id)).scalars())
+        else:
+            db.session.execute(archive)
+            changed = [row[0] for row in db.session.query(QRCode.id).filter(QRCode.id.in_(due), QRCode.updated_at == now)]
+        save_history_bulk(changed, "expired", details)
+        db.session.commit()
+        expired += len(changed)
+    if expired:
+        invalidate_analytics_cache()
+    return expired
+
+
+def delete_qr_codes(ids):
+    """
+    Delete QR codes and every row that references them, one DELETE ... IN per
+    table and chunk. Returns the number of deleted rows per table.
+    """
+    counts = defaultdict(int)
+    history_log.flush()  # so no queued entry is written after its code is gone
+    for chunk in id_chunks(ids):
+        conversion_ids = db.session.query(ConversionEvent.id).filter(ConversionEvent.qr_code_id.in_(chunk))
+        counts["attributions"] += ScanAttribution.query.filter(
+            or_(ScanAttribution.qr_code_id.in_(chunk), ScanAttribution.conversion_event_id.in_(conversion_ids))
+        ).delete(synchronize_session=False)
+        for key, model in (
+            ("sketches", VisitorSketch),
+            ("scans", ScanEvent),
+            ("conversions", ConversionEvent),
+            ("history", QRHistory),
+            ("goals", Goal),
+        ):
+            counts[key] += model.query.filter(model.qr_code_id.in_(chunk)).delete(synchronize_session=False)
+        if current_workspace.get() != DEFAULT_WORKSPACE:
+            slugs = db.session.query(QRCode.slug).filter(QRCode.id.in_(chunk))
+            counts["slug_routes"] += SlugRoute.query.filter(SlugRoute.slug.in_([row[0] for row in slugs])).delete(
+                synchronize_session=False
+            )
+        counts["qr_codes"] += QRCode.query.filter(QRCode.id.in_(chunk)).delete(synchronize_session=False)
+    db.session.commit()
+    if counts["qr_codes"]:
+        invalidate_analytics_cache()
+    return dict(counts)
 
 
-def filters_from_request():
-    start_raw = request.args.get("start")
-    end_raw = request.args.get("end")
+def filters_from_request(args=None):
+    args = request.args if args is None else args
+    start_raw = args.get("start")
+    end_raw = args.get("end")
     parsed_start = None
     parsed_end = None
 
@@ -430,12 +1405,12 @@ def filters_from_request():
     return {
         "start": parsed_start,
         "end": parsed_end,
-        "campaign": request.args.get("campaign"),
-        "channel": request.args.get("channel"),
-        "location": request.args.get("location"),
-        "owner": request.args.get("owner"),
-        "status": request.args.get("status"),
-        "qr_code_id": request.args.get("qr_code_id", type=int),
+        "campaign": args.get("campaign"),
+        "channel": args.get("channel"),
+        "location": args.get("location"),
+        "owner": args.get("owner"),
+        "status": args.get("status"),
+        "qr_code_id": args.get("qr_code_id", type=int),
     }
 
 
@@ -473,14 +1448,45 @@ def apply_conversion_filters(query, filters):
     return query
 
 
+def apply_attribution_filters(query, filters):
+    query = query.join(QRCode, QRCode.id == ScanAttribution.qr_code_id)
+
+    if filters.get("start"):
+        query = query.filter(ScanAttribution.occurred_at >= filters["start"])
+    if filters.get("end"):
+        query = query.filter(ScanAttribution.occurred_at <= filters["end"])
+    for field in ["campaign", "channel", "location", "owner", "status"]:
+        value = filters.get(field)
+        if value:
+            query = query.filter(getattr(QRCode, field) == value)
+    if filters.get("qr_code_id"):
+        query = query.filter(ScanAttribution.qr_code_id == filters["qr_code_id"])
+
+    return query
+
+
 def time_bucket_expr(granularity):
     if granularity == "hour":
-        return func.strftime("%Y-%m-%d %H:00", ScanEvent.scanned_at)
+        return ScanEvent.epoch_hour
+    if granularity == "week":
+        return ScanEvent.local_week
+    if granularity == "month":
+        return ScanEvent.local_date // 100
+    return ScanEvent.local_date
+
+
+def bucket_label(value, granularity):
+    """Render an integer bucket from time_bucket_expr() as a local-time label."""
+    if value is None:
+        return None
+    value = int(value)
+    if granularity == "hour":
+        return datetime.fromtimestamp(value * 3600, analytics_tz).strftime("%Y-%m-%d %H:00")
     if granularity == "week":
-        return func.strftime("%Y-W%W", ScanEvent.scanned_at)
+        return f"{value // 100:04d}-W{value % 100:02d}"
     if granularity == "month":
-        return func.strftime("%Y-%m", ScanEvent.scanned_at)
-    return func.strftime("%Y-%m-%d", ScanEvent.scanned_at)
+        return f"{value // 100:04d}-{value % 100:02d}"
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
 
 
 def breakdown_expr(field):
@@ -505,63 +1511,392 @@ def breakdown_expr(field):
     if field == "referrer":
         return ScanEvent.referrer
     if field == "hour_of_day":
-        return func.strftime("%H", ScanEvent.scanned_at)
+        return ScanEvent.local_hour
     if field == "day_of_week":
-        return func.strftime("%w", ScanEvent.scanned_at)
+        return ScanEvent.local_dow
     return QRCode.campaign
 
 
-def build_qr_image(data, fmt, size_px=400):
-    # Error correction H for robustness
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=10, # box_size=10 with SvgPathImage produces 1-unit coordinates
-        border=0,
+HLL_BREAKDOWN_FIELDS = {"campaign", "channel", "location"}
+
+
+def unique_mode_from_request():
+    mode = (request.args.get("unique_mode") or "flag").lower()
+    return mode if mode in {"flag", "hll"} else None
+
+
+def merged_sketches(filters, key_func=None, group_column=None):
+    """
+    Merge stored visitor sketches matching the filters. Results are grouped by
+    key_func(hour) and/or group_column; without either a single sketch is returned
+    under the key None. Time filters are applied at hour granularity.
+    """
+    query = db.session.query(VisitorSketch.hour, VisitorSketch.registers).join(
+        QRCode, QRCode.id == VisitorSketch.qr_code_id
     )
+    if group_column is not None:
+        query = query.add_columns(group_column)
+    if filters.get("start"):
+        query = query.filter(VisitorSketch.hour >= epoch_hour(filters["start"]))
+    if filters.get("end"):
+        query = query.filter(VisitorSketch.hour <= epoch_hour(filters["end"]))
+    for field in ["campaign", "channel", "location", "owner", "status"]:
+        value = filters.get(field)
+        if value:
+            query = query.filter(getattr(QRCode, field) == value)
+    if filters.get("qr_code_id"):
+        query = query.filter(VisitorSketch.qr_code_id == filters["qr_code_id"])
+
+    merged = {}
+    for row in query.yield_per(1000):
+        if group_column is not None:
+            key = row[2]
+        else:
+            key = key_func(row.hour) if key_func else None
+        sketch = HyperLogLog.from_bytes(row.registers)
+        if key in merged:
+            merged[key].merge(sketch)
+        else:
+            merged[key] = sketch
+    return merged
+
+
+def hour_bucket_label(hour, granularity):
+    """Label of the time_bucket_expr() bucket an epoch hour falls into."""
+    if granularity == "hour":
+        return bucket_label(hour, granularity)
+    buckets = scan_time_buckets(hour_start(hour))
+    if granularity == "week":
+        return bucket_label(buckets["local_week"], granularity)
+    if granularity == "month":
+        return bucket_label(buckets["local_date"] // 100, granularity)
+    return bucket_label(buckets["local_date"], granularity)
+
+
+def rebuild_visitor_sketches(batch_size=5000):
+    """Recompute all visitor sketches from raw scans (backfill / repair)."""
+    VisitorSketch.query.delete()
+    sketches = {}
+    rows = (
+        db.session.query(ScanEvent.qr_code_id, ScanEvent.scanned_at, ScanEvent.visitor_fingerprint)
+        .filter(ScanEvent.is_bot.is_(False))
+        .filter(ScanEvent.visitor_fingerprint.isnot(None))
+        .yield_per(batch_size)
+    )
+    for row in rows:
+        key = (row.qr_code_id, epoch_hour(row.scanned_at))
+        sketches.setdefault(key, HyperLogLog()).add(row.visitor_fingerprint)
+    db.session.add_all(
+        VisitorSketch(qr_code_id=qr_id, hour=hour, registers=sketch.to_bytes())
+        for (qr_id, hour), sketch in sketches.items()
+    )
+    db.session.commit()
+    invalidate_analytics_cache()
+    return len(sketches)
+
+
+DAY_NAMES = {
+    "0": "Sunday",
+    "1": "Monday",
+    "2": "Tuesday",
+    "3": "Wednesday",
+    "4": "Thursday",
+    "5": "Friday",
+    "6": "Saturday",
+}
+
+
+def breakdown_label(field, label):
+    if field == "day_of_week" and label is not None:
+        label = DAY_NAMES.get(str(label), str(label))
+    if field == "hour_of_day" and label is not None:
+        label = f"{int(label):02d}:00"
+    return label or "(unknown)"
+
+
+def summary_payload(total_scans, unique_scans, bot_scans, conversions, attributed_conversions, unique_mode):
+    conversion_rate = 0.0
+    attributed_conversion_rate = 0.0
+    if unique_scans:
+        conversion_rate = round((conversions / unique_scans) * 100, 2)
+        attributed_conversion_rate = round((attributed_conversions / unique_scans) * 100, 2)
+
+    if unique_mode == "hll":
+        unique_definition = "Unique = estimated distinct non-bot visitors in the selected range (HyperLogLog, ~2% error)."
+    else:
+        unique_definition = f"Unique = first non-bot scan per visitor fingerprint within {app.config['UNIQUE_WINDOW_HOURS']}h."
+
+    return {
+        "total_scans": total_scans,
+        "unique_scans": unique_scans,
+        "bot_scans": bot_scans,
+        "conversions": conversions,
+        "conversion_rate": conversion_rate,
+        "attributed_conversions": attributed_conversions,
+        "attributed_conversion_rate": attributed_conversion_rate,
+        "geo_accuracy_note": "Geo is IP-based and approximate; city-level resolution may be imprecise or unavailable.",
+        "unique_mode": unique_mode,
+        "unique_definition": unique_definition,
+    }
+
+
+# Matrices take 10-30 KB each at ERROR_CORRECT_H; keep about one thumbnail page (at most 200 codes)
+QR_MATRIX_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=QR_MATRIX_CACHE_SIZE)
+def qr_matrix(data):
+    """Module matrix (rows of booleans, no quiet zone) for the encoded data."""
+    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_H, border=0)
     qr.add_data(data)
     qr.make(fit=True)
+    return tuple(tuple(bool(module) for module in row) for row in qr.modules)
+
+
+def matrix_image(matrix, size_px):
+    """Black-on-white 1-bit PIL image of a module matrix scaled to size_px."""
+    count = len(matrix)
+    img = Image.new("1", (count, count), 1)
+    img.putdata([0 if module else 1 for row in matrix for module in row])
+    return img.resize((size_px, size_px), Image.Resampling.NEAREST)
+
+
+def build_thumbnail_sprite(entries, size_px):
+    """
+    Render (id, data) entries into one PNG sprite sheet laid out row-major.
+    Returns the sheet as a data URL plus each code's cell and pixel offset.
+    """
+    columns = max(1, min(len(entries), 10))
+    rows = max(1, -(-len(entries) // columns))
+    sheet = Image.new("1", (columns * size_px, rows * size_px), 1)
+    items = []
+    for index, (qr_id, data) in enumerate(entries):
+        column, row = index % columns, index // columns
+        sheet.paste(matrix_image(qr_matrix(data), size_px), (column * size_px, row * size_px))
+        items.append({"id": qr_id, "column": column, "row": row, "x": column * size_px, "y": row * size_px})
+
+    buffer = io.BytesIO()
+    sheet.save(buffer, format="PNG", optimize=True)
+    return {
+        "format": "sprite",
+        "size": size_px,
+        "columns": columns,
+        "rows": rows,
+        "sprite": "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii"),
+        "items": items,
+    }
+
+
+def with_quiet_zone(matrix, border):
+    if not border:
+        return matrix
+    blank = (False,) * (len(matrix) + 2 * border)
+    pad = (False,) * border
+    return (blank,) * border + tuple(pad + row + pad for row in matrix) + (blank,) * border
+
+
+def matrix_runs(matrix):
+    """Yield (x, y, length) for every horizontal run of dark modules."""
+    for y, row in enumerate(matrix):
+        x = 0
+        width = len(row)
+        while x < width:
+            if row[x]:
+                start = x
+                while x < width and row[x]:
+                    x += 1
+                yield start, y, x - start
+            else:
+                x += 1
+
+
+def build_svg(matrix, size_px, fill_color="#000000", back_color="#ffffff", quiet_zone=0):
+    """
+    SVG document (bytes) with one path per code: each horizontal run of dark
+    modules becomes a single rectangle in module units, and the viewBox maps
+    modules to size_px so the output scales without resampling.
+    """
+    count = len(matrix) + 2 * quiet_zone
+    path = "".join(
+        f"M{x + quiet_zone} {y + quiet_zone}h{length}v1h-{length}z" for x, y, length in matrix_runs(matrix)
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size_px}" height="{size_px}" '
+        f'viewBox="0 0 {count} {count}" shape-rendering="crispEdges">'
+        f'<rect width="{count}" height="{count}" fill="{back_color}"/>'
+        f'<path fill="{fill_color}" d="{path}"/></svg>'
+    ).encode("ascii")
+
+
+def qr_color(value, default):
+    """Validate a CSS hex or named color; raises ValueError for anything else."""
+    if not value:
+        return default
+    value = str(value).strip()
+    if re.fullmatch(r"[0-9a-fA-F]{3}|[0-9a-fA-F]{6}", value):
+        value = f"#{value}"
+    if not re.fullmatch(r"#(?:[0-9a-fA-F]{3}){1,2}|[a-zA-Z]{3,20}", value):
+        raise ValueError(f"Invalid color: {value}")
+    ImageColor.getrgb(value)
+    return value
+
+
+def qr_style_from(source):
+    """Rendering options (fg, bg, quiet_zone) from request args or a JSON payload."""
+    try:
+        quiet_zone = int(source.get("quiet_zone") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("quiet_zone must be an integer")
+    if not 0 <= quiet_zone <= 10:
+        raise ValueError("quiet_zone must be between 0 and 10")
+    return {
+        "fill_color": qr_color(source.get("fg"), "#000000"),
+        "back_color": qr_color(source.get("bg"), "#ffffff"),
+        "quiet_zone": quiet_zone,
+    }
+
+
+def build_qr_image(data, fmt, size_px=400, fill_color="#000000", back_color="#ffffff", quiet_zone=0):
+    # Error correction H for robustness; the module matrix is cached per encoded URL
+    matrix = qr_matrix(data)
 
     if fmt == "png":
-        img_obj = qr.make_image(fill_color="black", back_color="white")
-        # PilImage wrapper has the actual PIL image in _img
-        pil_img = img_obj._img
-        
+        padded = with_quiet_zone(matrix, quiet_zone)
+        count = len(padded)
+        img = Image.new("P", (count, count), 0)
+        img.putpalette(ImageColor.getrgb(back_color)[:3] + ImageColor.getrgb(fill_color)[:3])
+        img.putdata([1 if module else 0 for row in padded for module in row])
+
         # Use NEAREST resampling to keep QR edges perfectly sharp
-        resampling = getattr(Image, 'Resampling', Image).NEAREST
-        if hasattr(Image, 'Resampling'):
-            resampling = Image.Resampling.NEAREST
-        
-        pil_img = pil_img.resize((size_px, size_px), resampling)
-        
+        img = img.resize((size_px, size_px), Image.Resampling.NEAREST)
+
         buffer = io.BytesIO()
-        pil_img.save(buffer, format="PNG")
+        img.save(buffer, format="PNG")
         buffer.seek(0)
         return buffer, "image/png", "png"
 
     if fmt == "svg":
-        factory = qrcode.image.svg.SvgPathImage
-        img = qr.make_image(image_factory=factory) 
-        buffer = io.BytesIO()
-        img.save(buffer)
-        svg_data = buffer.getvalue().decode("utf-8")
-        
-        # Extract module count for a perfect viewBox
-        modules_count = len(qr.modules)
-        
-        # Completely rebuild the svg tag to ensure no extra whitespace/units
-        # Added a white background rect for consistency.
-        svg_head = f'<svg width="{size_px}" height="{size_px}" viewBox="0 0 {modules_count} {modules_count}" xmlns="http://www.w3.org/2000/svg">'
-        svg_bg = f'<rect width="{modules_count}" height="{modules_count}" fill="white"/>'
-        svg_data = re.sub(r'<svg[^>]*>', f'{svg_head}{svg_bg}', svg_data, count=1)
-        
-        final_buffer = io.BytesIO(svg_data.encode("utf-8"))
-        return final_buffer, "image/svg+xml", "svg"
-
+        svg_data = build_svg(matrix, size_px, fill_color=fill_color, back_color=back_color, quiet_zone=quiet_zone)
+        return io.BytesIO(svg_data), "image/svg+xml", "svg"
 
     raise ValueError("Unsupported format")
 
 
+PDF_PAGE_SIZES = {"a4": A4, "a3": A3, "letter": letter}
+PDF_LABEL_FIELDS = ("name", "slug", "campaign")
+
+
+def pdf_sheet_options(source):
+    """Validated layout options for write_qr_pdf from a JSON payload."""
+    page_size = (source.get("page_size") or "a4").lower()
+    if page_size not in PDF_PAGE_SIZES:
+        raise ValueError(f"page_size must be one of: {', '.join(PDF_PAGE_SIZES)}")
+    try:
+        columns = int(source.get("columns") or 4)
+        rows = int(source.get("rows") or 6)
+        margin_mm = float(source.get("margin_mm", 10))
+        bleed_mm = float(source.get("bleed_mm", 0))
+        quiet_zone = int(source.get("quiet_zone", 2))
+    except (TypeError, ValueError):
+        raise ValueError("columns, rows, margin_mm, bleed_mm and quiet_zone must be numbers")
+    if not (1 <= columns <= 30 and 1 <= rows <= 40):
+        raise ValueError("Grid must be between 1x1 and 30x40")
+    if not (0 <= margin_mm <= 50 and 0 <= bleed_mm <= 10 and 0 <= quiet_zone <= 10):
+        raise ValueError("margin_mm must be 0-50, bleed_mm 0-10 and quiet_zone 0-10")
+    labels = source.get("labels", ["name", "slug"])
+    if isinstance(labels, str):
+        labels = [part.strip() for part in labels.split(",") if part.strip()]
+    if not isinstance(labels, list) or not all(isinstance(label, str) for label in labels):
+        raise ValueError("labels must be a list of field names")
+    if any(label not in PDF_LABEL_FIELDS for label in labels):
+        raise ValueError(f"labels may contain: {', '.join(PDF_LABEL_FIELDS)}")
+    return {
+        "page_size": PDF_PAGE_SIZES[page_size],
+        "columns": columns,
+        "rows": rows,
+        "margin": margin_mm * mm,
+        "bleed": bleed_mm * mm,
+        "quiet_zone": quiet_zone,
+        "labels": labels,
+        "fill_color": qr_color(source.get("fg"), "#000000"),
+    }
+
+
+def draw_crop_marks(pdf, bleed, trim_width, trim_height):
+    """Hairline trim marks in the bleed area, stopping just short of each trim corner."""
+    gap = bleed * 0.25
+    page_width, page_height = trim_width + 2 * bleed, trim_height + 2 * bleed
+    pdf.setLineWidth(0.25)
+    for y in (bleed, bleed + trim_height):
+        pdf.line(0, y, bleed - gap, y)
+        pdf.line(page_width - bleed + gap, y, page_width, y)
+    for x in (bleed, bleed + trim_width):
+        pdf.line(x, 0, x, bleed - gap)
+        pdf.line(x, page_height - bleed + gap, x, page_height)
+
+
+def write_qr_pdf(qr_codes, fileobj, options, progress=None):
+    """
+    Lay out QR codes on print sheets as vector paths built from the module
+    matrix, with optional name/slug/campaign labels under each code. Codes are
+    consumed from the iterable one page at a time, so callers can stream rows
+    from the database.
+    """
+    trim_width, trim_height = options["page_size"]
+    bleed = options["bleed"]
+    margin = options["margin"]
+    columns, rows = options["columns"], options["rows"]
+    per_page = columns * rows
+
+    pdf = canvas.Canvas(fileobj, pagesize=(trim_width + 2 * bleed, trim_height + 2 * bleed), pageCompression=1)
+    pdf.setTitle("QR codes")
+
+    cell_width = (trim_width - 2 * margin) / columns
+    cell_height = (trim_height - 2 * margin) / rows
+    font_size = max(4.0, min(8.0, cell_height * 0.07))
+    label_height = len(options["labels"]) * font_size * 1.25
+    code_size = max(min(cell_width, cell_height - label_height) * 0.9, 1)
+
+    codes = iter(qr_codes)
+    drawn = 0
+    while True:
+        page = [qr for _, qr in zip(range(per_page), codes)]
+        if not page:
+            break
+        if bleed:
+            draw_crop_marks(pdf, bleed, trim_width, trim_height)
+        pdf.setFillColor(options["fill_color"])
+        for index, qr in enumerate(page):
+            column, row = index % columns, index // columns
+            cell_left = bleed + margin + column * cell_width
+            cell_top = bleed + trim_height - margin - row * cell_height
+
+            matrix = with_quiet_zone(qr_matrix(tracking_url(qr.slug)), options["quiet_zone"])
+            module = code_size / len(matrix)
+            left = cell_left + (cell_width - code_size) / 2
+            top = cell_top - (cell_height - label_height - code_size) / 2
+            path = pdf.beginPath()
+            for x, y, length in matrix_runs(matrix):
+                path.rect(left + x * module, top - (y + 1) * module, length * module, module)
+            pdf.drawPath(path, stroke=0, fill=1)
+
+            pdf.setFont("Helvetica", font_size)
+            baseline = top - code_size - font_size * 1.1
+            for field in options["labels"]:
+                value = getattr(qr, field) or ""
+                while value and pdf.stringWidth(value, "Helvetica", font_size) > cell_width * 0.95:
+                    value = value[:-1]
+                if value:
+                    pdf.drawCentredString(cell_left + cell_width / 2, baseline, value)
+                baseline -= font_size * 1.25
+        pdf.showPage()
+        drawn += len(page)
+        if progress:
+            progress(drawn)
+    pdf.save()
+    return drawn
+
+
 def status_value(raw):
     value = (raw or "active").strip().lower()
     if value not in {"active", "paused", "archived"}:
@@ -571,12 +1906,568 @@ def status_value(raw):
 
 def purge_old_data(days):
     cutoff = now_utc() - timedelta(days=days)
+    ScanAttribution.query.filter(ScanAttribution.occurred_at < cutoff).delete()
+    VisitorSketch.query.filter(VisitorSketch.hour < epoch_hour(cutoff)).delete()
     deleted_scans = ScanEvent.query.filter(ScanEvent.scanned_at < cutoff).delete()
     deleted_conversions = ConversionEvent.query.filter(ConversionEvent.occurred_at < cutoff).delete()
     db.session.commit()
+    invalidate_analytics_cache()
     return deleted_scans, deleted_conversions
 
 
+def attribute_conversions(conversions):
+    """
+    Attribute conversions to the last non-bot scan of the same visitor fingerprint
+    within ATTRIBUTION_WINDOW_HOURS before the conversion. Conversions that carry an
+    explicit scan_event_id are linked to that scan directly. Every conversion gets
+    exactly one ScanAttribution row (scan_event_id is NULL when nothing matched), so
+    a conversion is never evaluated twice.
+    """
+    window = timedelta(hours=app.config["ATTRIBUTION_WINDOW_HOURS"])
+    scan_columns = (ScanEvent.id, ScanEvent.qr_code_id, ScanEvent.visitor_fingerprint, ScanEvent.scanned_at)
+
+    explicit_ids = {c.scan_event_id for c in conversions if c.scan_event_id}
+    explicit = {}
+    if explicit_ids:
+        rows = db.session.query(*scan_columns).filter(ScanEvent.id.in_(explicit_ids)).all()
+        explicit = {row.id: row for row in rows}
+
+    by_fingerprint = [c for c in conversions if not c.scan_event_id and c.visitor_fingerprint]
+    candidates = defaultdict(list)
+    if by_fingerprint:
+        # One indexed, time-bounded range scan covers the whole batch
+        rows = (
+            db.session.query(*scan_columns)
+            .filter(ScanEvent.visitor_fingerprint.in_({c.visitor_fingerprint for c in by_fingerprint}))
+            .filter(ScanEvent.scanned_at >= min(c.occurred_at for c in by_fingerprint) - window)
+            .filter(ScanEvent.scanned_at <= max(c.occurred_at for c in by_fingerprint))
+            .filter(ScanEvent.is_bot.is_(False))
+            .order_by(ScanEvent.scanned_at.asc())
+            .all()
+        )
+        for row in rows:
+            candidates[row.visitor_fingerprint].append(row)
+    scan_times = {fp: [row.scanned_at for row in rows] for fp, rows in candidates.items()}
+
+    for conversion in conversions:
+        scan = None
+        if conversion.scan_event_id:
+            scan = explicit.get(conversion.scan_event_id)
+        elif conversion.visitor_fingerprint in candidates:
+            rows = candidates[conversion.visitor_fingerprint]
+            idx = bisect_right(scan_times[conversion.visitor_fingerprint], conversion.occurred_at) - 1
+            if idx >= 0 and rows[idx].scanned_at >= conversion.occurred_at - window:
+                scan = rows[idx]
+
+        db.session.add(
+            ScanAttribution(
+                conversion_event_id=conversion.id,
+                scan_event_id=scan.id if scan else None,
+                qr_code_id=scan.qr_code_id if scan else None,
+                value=conversion.value,
+                scanned_at=scan.scanned_at if scan else None,
+                occurred_at=conversion.occurred_at,
+                lag_seconds=int((conversion.occurred_at - scan.scanned_at).total_seconds()) if scan else None,
+            )
+        )
+
+
+def refresh_attributions(batch_size=500):
+    """Attribute every conversion that has no attribution row yet, in batches."""
+    processed = 0
+    while True:
+        batch = (
+            ConversionEvent.query.outerjoin(
+                ScanAttribution, ScanAttribution.conversion_event_id == ConversionEvent.id
+            )
+            .filter(ScanAttribution.id.is_(None))
+            .order_by(ConversionEvent.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            if processed:
+                invalidate_analytics_cache()
+            return processed
+        attribute_conversions(batch)
+        db.session.commit()
+        processed += len(batch)
+
+
+def read_state(key, default=0):
+    row = db.session.get(AppState, key)
+    return row.value if row else default
+
+
+def bump_state(key, amount=1):
+    """Atomically add `amount` to a shared counter and return the new value."""
+    for _ in range(2):
+        updated = db.session.execute(
+            AppState.__table__.update().where(AppState.key == key).values(value=AppState.value + amount)
+        ).rowcount
+        if not updated:
+            db.session.add(AppState(key=key, value=amount))
+        try:
+            db.session.flush()
+            value = db.session.execute(db.select(AppState.value).where(AppState.key == key)).scalar_one()
+            db.session.commit()
+            return value
+        except IntegrityError:
+            # Another worker inserted the counter concurrently; retry as an update
+            db.session.rollback()
+    raise RuntimeError(f"Could not update app state counter {key}")
+
+
+class ResponseCache:
+    """
+    In-process LRU cache for JSON analytics payloads. Every entry records the
+    shared cache generation it was computed under; bumping the generation (on QR
+    metadata writes, purges, backfills) invalidates entries in all workers.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                entry_generation, expires_at, payload = entry
+                if entry_generation == generation and (expires_at is None or expires_at > time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, generation, payload, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (generation, expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+analytics_cache = ResponseCache(max_entries=app.config["ANALYTICS_CACHE_MAX_ENTRIES"])
+# Rendered library previews; slugs never change, so entries need no invalidation
+thumbnail_cache = ResponseCache(max_entries=64)
+
+CACHE_GENERATION_KEY = "analytics_cache_generation"
+
+
+def invalidate_analytics_cache():
+    analytics_cache.clear()
+    bump_state(CACHE_GENERATION_KEY)
+
+
+def analytics_cache_key(endpoint, filters):
+    normalized = tuple(
+        (name, value.isoformat() if isinstance(value, datetime) else value)
+        for name, value in sorted(filters.items())
+        if value not in (None, "")
+    )
+    params = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k not in filters))
+    return (current_workspace.get(), endpoint, normalized, params)
+
+
+def analytics_cache_ttl(filters):
+    """Closed historical ranges never change; anything touching "now" expires quickly."""
+    end = filters.get("end")
+    if end is None:
+        return app.config["ANALYTICS_CACHE_TTL_SECONDS"]
+    if end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    # Hourly visitor sketches keep changing until the end hour is over
+    if end + timedelta(hours=1) >= now_utc():
+        return app.config["ANALYTICS_CACHE_TTL_SECONDS"]
+    return None
+
+
+def cached_analytics(endpoint, metadata_only=False):
+    """Cache successful JSON responses of an analytics view. metadata_only views
+    depend on QR metadata alone and are kept until the next invalidation."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not app.config["ANALYTICS_CACHE_ENABLED"]:
+                return view(*args, **kwargs)
+
+            filters = filters_from_request()
+            key = analytics_cache_key(endpoint, filters)
+            generation = read_state(CACHE_GENERATION_KEY)
+            payload = analytics_cache.get(key, generation)
+            if payload is not None:
+                return jsonify(payload)
+
+            response = view(*args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                ttl = None if metadata_only else analytics_cache_ttl(filters)
+                analytics_cache.set(key, generation, response.get_json(), ttl)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+JOB_HANDLERS = {}
+JOB_FINISHED_STATUSES = {"succeeded", "failed", "cancelled"}
+JOB_POLL_SECONDS = 5
+JOB_MAINTENANCE_SECONDS = 600
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job_handler(kind):
+    """Register a function(ctx, params) -> result dict as the handler for a job kind."""
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+def job_results_dir():
+    path = app.config["JOB_RESULTS_DIR"] or os.path.join(database_dir(), "job_results")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class JobContext:
+    """
+    Passed to job handlers. progress() commits the session, so call it between
+    complete units of work; it raises JobCancelled once a cancel was requested.
+    Handlers whose work is committed as it goes keep partial_result up to date,
+    so a cancelled or failed job still reports what it already wrote.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.params = json.loads(job.params or "{}")
+        self.result_path = None
+        self.result_name = None
+        self.result_mimetype = None
+        self.partial_result = None
+        self._last_report = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < 1.0:
+            return
+        self._last_report = now
+        values = {"progress": done, "heartbeat_at": now_utc()}
+        if total is not None:
+            values["total"] = total
+        if message is not None:
+            values["message"] = message[:255]
+        Job.query.filter_by(id=self.job_id).update(values, synchronize_session=False)
+        db.session.commit()
+        if db.session.query(Job.cancel_requested).filter_by(id=self.job_id).scalar():
+            raise JobCancelled()
+
+    def open_result(self, download_name, mimetype, mode="wb"):
+        """Open the job's result file for writing; it only becomes visible if the job succeeds."""
+        self.result_name = download_name
+        self.result_mimetype = mimetype
+        self.result_path = os.path.join(job_results_dir(), f"{self.job_id}{os.path.splitext(download_name)[1]}")
+        if "b" in mode:
+            return open(f"{self.result_path}.part", mode)
+        return open(f"{self.result_path}.part", mode, encoding="utf-8", newline="")
+
+
+def job_worker_name():
+    return f"{os.getpid()}/{threading.current_thread().name}"
+
+
+def claim_job(job_id):
+    now = now_utc()
+    claimed = Job.query.filter_by(id=job_id, status="queued").update(
+        {"status": "running", "started_at": now, "heartbeat_at": now, "worker": job_worker_name()},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return claimed == 1
+
+
+def claim_next_job():
+    candidates = db.session.query(Job.id).filter(Job.status == "queued").order_by(Job.created_at).limit(5).all()
+    for (job_id,) in candidates:
+        if claim_job(job_id):
+            return job_id
+    return None
+
+
+def run_job(job_id):
+    job = db.session.get(Job, job_id)
+    ctx = JobContext(job)
+    kind, workspace = job.kind, job.workspace
+    handler = JOB_HANDLERS.get(kind)
+    g.job_base_url = ctx.params.get("base_url", "")
+    status, message, result = "succeeded", None, None
+    with use_workspace(workspace):
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {kind}")
+            result = handler(ctx, ctx.params)
+            db.session.commit()
+        except JobCancelled:
+            db.session.rollback()
+            status, message, result = "cancelled", "Cancelled", ctx.partial_result
+        except Exception as e:
+            db.session.rollback()
+            app.logger.exception("Job %s (%s) failed", job_id, kind)
+            status, message, result = "failed", str(e)[:255], ctx.partial_result
+
+    if ctx.result_path:
+        if status == "succeeded":
+            os.replace(f"{ctx.result_path}.part", ctx.result_path)
+        else:
+            if os.path.exists(f"{ctx.result_path}.part"):
+                os.remove(f"{ctx.result_path}.part")
+            ctx.result_path = None
+
+    values = {
+        "status": status,
+        "message": message,
+        "result": json.dumps(result) if result is not None else None,
+        "result_path": ctx.result_path,
+        "result_name": ctx.result_name if ctx.result_path else None,
+        "result_mimetype": ctx.result_mimetype if ctx.result_path else None,
+        "finished_at": now_utc(),
+    }
+    if status == "succeeded":
+        values["progress"] = func.coalesce(Job.total, Job.progress)
+    Job.query.filter_by(id=job_id).update(values, synchronize_session=False)
+    db.session.commit()
+    return status
+
+
+def fail_stale_jobs():
+    """Fail running jobs whose worker stopped reporting (process restarted or killed)."""
+    cutoff = now_utc() - timedelta(seconds=app.config["JOB_STALE_SECONDS"])
+    stale = Job.query.filter(Job.status == "running", Job.heartbeat_at < cutoff).update(
+        {"status": "failed", "message": "Worker stopped before the job finished", "finished_at": now_utc()},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return stale
+
+
+def purge_job_results(hours=None):
+    """Delete finished jobs and their result files once they are older than the retention window."""
+    hours = app.config["JOB_RESULT_RETENTION_HOURS"] if hours is None else hours
+    cutoff = now_utc() - timedelta(hours=hours)
+    expired = Job.query.filter(Job.status.in_(JOB_FINISHED_STATUSES), Job.finished_at < cutoff).all()
+    for job in expired:
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+    if expired:
+        Job.query.filter(Job.id.in_([job.id for job in expired])).delete(synchronize_session=False)
+        db.session.commit()
+
+    # Uploads and partial results left behind by crashed workers
+    directory = job_results_dir()
+    cutoff_ts = time.time() - hours * 3600
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith((".part", ".input")) and os.path.getmtime(path) < cutoff_ts:
+            os.remove(path)
+    return len(expired)
+
+
+class JobRunner:
+    """Per-process pool of worker threads that claim queued jobs from the jobs table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._next_run = {}
+
+    def ensure_started(self):
+        # Started lazily so each gunicorn worker gets its own threads after the fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for index in range(app.config["JOB_WORKERS"]):
+                threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True).start()
+
+    def wake(self):
+        self.ensure_started()
+        self._wake.set()
+
+    def _due_tasks(self):
+        with self._lock:
+            now = time.monotonic()
+            due = []
+            for name, interval, func in PERIODIC_TASKS:
+                seconds = app.config[interval] if isinstance(interval, str) else interval
+                if seconds > 0 and now >= self._next_run.get(name, 0.0):
+                    self._next_run[name] = now + seconds
+                    due.append((name, seconds, func))
+            return due
+
+    def _work(self):
+        while True:
+            ran = False
+            try:
+                with app.app_context():
+                    for name, seconds, func in self._due_tasks():
+                        if claim_schedule_slot(name, seconds):
+                            func()
+                    job_id = claim_next_job()
+                    if job_id:
+                        run_job(job_id)
+                        ran = True
+            except Exception:
+                app.logger.exception("Job worker error")
+            if not ran:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+
+
+job_runner = JobRunner()
+PERIODIC_TASKS = []
+
+
+def periodic_task(interval):
+    """
+    Run the decorated function from the job runner every `interval` seconds
+    (a number or an app.config key), in one process at a time.
+    """
+
+    def decorator(func):
+        PERIODIC_TASKS.append((func.__name__, interval, func))
+        return func
+
+    return decorator
+
+
+def claim_schedule_slot(name, interval):
+    """Take the shared lease for one run of a periodic task; False if another worker ran it recently."""
+    key = f"schedule:{name}"
+    if db.session.get(AppState, key) is None:
+        try:
+            db.session.add(AppState(key=key, value=0))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+    now = int(time.time())
+    claimed = AppState.query.filter(AppState.key == key, AppState.value <= now - interval).update(
+        {"value": now}, synchronize_session=False
+    )
+    db.session.commit()
+    return claimed == 1
+
+
+@periodic_task(JOB_MAINTENANCE_SECONDS)
+def job_maintenance():
+    fail_stale_jobs()
+    purge_job_results()
+
+
+@periodic_task(86400)
+def history_compaction():
+    for workspace in workspace_keys():
+        with use_workspace(workspace):
+            compact_history()
+
+
+@periodic_task("EXPIRY_SWEEP_SECONDS")
+def expiry_sweep():
+    for workspace in workspace_keys():
+        with use_workspace(workspace):
+            expired = expire_due_codes()
+        if expired:
+            app.logger.info("Archived %s expired QR codes in workspace %s", expired, workspace)
+
+
+def submit_job(kind, params, job_id=None):
+    params = {**params, "base_url": get_public_base_url()}
+    job_id = job_id or secrets.token_hex(16)
+    db.session.add(Job(id=job_id, kind=kind, params=json.dumps(params), workspace=current_workspace.get()))
+    db.session.commit()
+    if app.config["JOB_WORKERS"] <= 0:
+        # No worker threads configured: run in the submitting request
+        if claim_job(job_id):
+            run_job(job_id)
+    else:
+        job_runner.wake()
+    return db.session.get(Job, job_id)
+
+
+def job_to_dict(job):
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "workspace": job.workspace,
+        "status": job.status,
+        "progress": job.progress,
+        "total": job.total,
+        "percent": round(100 * job.progress / job.total, 1) if job.total else None,
+        "message": job.message,
+        "cancel_requested": job.cancel_requested,
+        "result": json.loads(job.result) if job.result else None,
+        "result_url": f"/api/jobs/{job.id}/result" if job.result_path else None,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def job_accepted(job):
+    response = jsonify({"job": job_to_dict(job)})
+    response.status_code = 202
+    response.headers["Location"] = f"/api/jobs/{job.id}"
+    return response
+
+
+def wants_async(payload=None):
+    if payload is not None and "async" in payload:
+        return to_bool(payload.get("async"), False)
+    return to_bool(request.args.get("async") or request.form.get("async"), False)
+
+
+@app.before_request
+def start_job_runner():
+    if app.config["JOB_WORKERS"] > 0 and not app.testing:
+        job_runner.ensure_started()
+
+
 @app.before_request
 def require_auth():
     # Public routes that dont need login
@@ -591,6 +2482,27 @@ def require_auth():
         # Alternatively, we could redirect, but showing an overlay is smoother for a SPA-like app
         pass
 
+@app.before_request
+def select_workspace():
+    """Scope API requests to the workspace named by X-Workspace, ?workspace= or the UI selection."""
+    if request.path.startswith(("/t/", "/static/")) or request.path == "/goal.gif":
+        return  # public routes find the workspace through the slug
+    key = request.headers.get("X-Workspace") or request.args.get("workspace")
+    if not key:
+        key = session.get("workspace") or DEFAULT_WORKSPACE
+        if not workspace_engines.known(key) and db.session.get(Workspace, key) is None:
+            session.pop("workspace", None)
+            key = DEFAULT_WORKSPACE
+    elif not workspace_engines.known(key) and db.session.get(Workspace, key) is None:
+        return jsonify({"error": f"Unknown workspace: {key}"}), 404
+    current_workspace.set(key)
+
+
+@app.teardown_request
+def reset_workspace(exc):
+    current_workspace.set(DEFAULT_WORKSPACE)
+
+
 @app.route("/")
 def index():
     return render_template("index.html")
@@ -664,28 +2576,17 @@ def create_qr_code():
         new_goal = Goal(qr_code_id=qr.id, name=goal_name, target_url=goal_target or None, active=True)
         db.session.add(new_goal)
 
-    save_history(qr.id, "created", json.dumps({"destination_url": destination_url}))
+    save_history(qr, "created", {"destination_url": destination_url})
     db.session.commit()
+    invalidate_analytics_cache()
 
     data = qr_to_dict(qr)
     data["tracking_url"] = tracking_url(qr.slug)
     return jsonify(data), 201
 
 
-@app.route("/api/qrcodes/bulk", methods=["POST"])
-def bulk_create_qr_codes():
-    if "file" not in request.files:
-        return jsonify({"error": "Please upload a CSV file under the 'file' field"}), 400
-
-    upload = request.files["file"]
-    try:
-        content = upload.stream.read().decode("utf-8-sig")
-    except Exception:
-        return jsonify({"error": "Could not read CSV file as UTF-8"}), 400
-
-    if not content.strip():
-        return jsonify({"error": "CSV file is empty"}), 400
-
+def parse_bulk_csv(content):
+    """Parse an uploaded CSV into row dicts; returns (rows, has_header) or raises ValueError."""
     # Auto-detect dialect (delimiter)
     try:
         dialect = csv.Sniffer().sniff(content[:2048], delimiters=";,|\t")
@@ -729,12 +2630,25 @@ def bulk_create_qr_codes():
                 if row:
                     rows_to_process.append({"destination_url": row[0], "url": row[0]})
     except Exception as e:
-         return jsonify({"error": f"Failed to parse CSV: {str(e)}"}), 400
+        raise ValueError(f"Failed to parse CSV: {str(e)}")
 
+    return rows_to_process, has_header
+
+
+def create_codes_from_rows(rows_to_process, has_header, progress=None):
     created = []
+    committed_ids = []
     errors = []
+    # One allocation for the whole file, before this transaction writes anything
+    slugs = iter(slug_allocator.allocate(len(rows_to_process)))
 
-    for idx, row in enumerate(rows_to_process, start=2 if has_header else 1):
+    for done, (idx, row) in enumerate(enumerate(rows_to_process, start=2 if has_header else 1), start=1):
+        if progress and done % 200 == 0:
+            db.session.flush()
+            batch_ids = [qr.id for qr in created[len(committed_ids):]]
+            db.session.commit()
+            committed_ids.extend(batch_ids)
+            progress(done, committed_ids)
         # Flexible key lookup
         raw_destination = row.get("destination_url") or row.get("url") or row.get("link") or row.get("target")
         destination_url = (raw_destination or "").strip()
@@ -748,7 +2662,7 @@ def bulk_create_qr_codes():
 
         # Extract other fields if they exist (mostly for header-based CSVs)
         qr = QRCode(
-            slug=generate_slug(),
+            slug=next(slugs),
             destination_url=destination_url,
             name=pick_text(row, "name"),
             campaign=pick_text(row, "campaign"),
@@ -767,29 +2681,81 @@ def bulk_create_qr_codes():
             dynamic=True,
         )
         db.session.add(qr)
-        db.session.flush()
-        save_history(qr.id, "created_bulk", json.dumps({"row": idx}))
+        save_history(qr, "created_bulk", {"row": idx})
         created.append(qr)
 
-    db.session.commit()
+    db.session.commit()
+    if created:
+        invalidate_analytics_cache()
+    return created, errors
+
+
+def bulk_create_payload(created, errors):
+    return {
+        "created": [
+            {
+                "id": qr.id,
+                "slug": qr.slug,
+                "name": qr.name,
+                "destination_url": qr.destination_url,
+                "tracking_url": tracking_url(qr.slug),
+            }
+            for qr in created
+        ],
+        "created_ids": [qr.id for qr in created],
+        "created_count": len(created),
+        "errors": errors,
+    }
+
+
+@job_handler("bulk_create")
+def bulk_create_job(ctx, params):
+    try:
+        with open(params["input_path"], encoding="utf-8") as fh:
+            content = fh.read()
+    finally:
+        if os.path.exists(params["input_path"]):
+            os.remove(params["input_path"])
+    rows, has_header = parse_bulk_csv(content)
+    ctx.progress(0, len(rows), force=True)
+
+    def progress(done, committed_ids):
+        # Batches stay committed if the job is cancelled or fails later on
+        ctx.partial_result = {"created_ids": committed_ids, "created_count": len(committed_ids), "errors": []}
+        ctx.progress(done, len(rows))
+
+    created, errors = create_codes_from_rows(rows, has_header, progress=progress)
+    return bulk_create_payload(created, errors)
+
+
+@app.route("/api/qrcodes/bulk", methods=["POST"])
+def bulk_create_qr_codes():
+    if "file" not in request.files:
+        return jsonify({"error": "Please upload a CSV file under the 'file' field"}), 400
+
+    upload = request.files["file"]
+    try:
+        content = upload.stream.read().decode("utf-8-sig")
+    except Exception:
+        return jsonify({"error": "Could not read CSV file as UTF-8"}), 400
+
+    if not content.strip():
+        return jsonify({"error": "CSV file is empty"}), 400
 
-    return jsonify(
-        {
-            "created": [
-                {
-                    "id": qr.id,
-                    "slug": qr.slug,
-                    "name": qr.name,
-                    "destination_url": qr.destination_url,
-                    "tracking_url": tracking_url(qr.slug),
-                }
-                for qr in created
-            ],
-            "created_ids": [qr.id for qr in created],
-            "created_count": len(created),
-            "errors": errors,
-        }
-    )
+    if wants_async():
+        job_id = secrets.token_hex(16)
+        input_path = os.path.join(job_results_dir(), f"{job_id}.input")
+        with open(input_path, "w", encoding="utf-8") as fh:
+            fh.write(content)
+        return job_accepted(submit_job("bulk_create", {"input_path": input_path}, job_id=job_id))
+
+    try:
+        rows_to_process, has_header = parse_bulk_csv(content)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    created, errors = create_codes_from_rows(rows_to_process, has_header)
+    return jsonify(bulk_create_payload(created, errors))
 
 
 @app.route("/api/qrcodes", methods=["GET"])
@@ -874,57 +2840,52 @@ def update_qr_code(qr_code_id):
         return jsonify(data)
 
     if request.method == "DELETE":
-        ScanEvent.query.filter_by(qr_code_id=qr.id).delete()
-        ConversionEvent.query.filter_by(qr_code_id=qr.id).delete()
-        QRHistory.query.filter_by(qr_code_id=qr.id).delete()
-        Goal.query.filter_by(qr_code_id=qr.id).delete()
-        db.session.delete(qr)
-        db.session.commit()
+        delete_qr_codes([qr.id])
         return jsonify({"success": True})
 
     payload = request.get_json(silent=True) or {}
 
+    # History stores a diff: only fields whose value actually changes
     changes = {}
 
+    def apply(field, value):
+        if getattr(qr, field) != value:
+            setattr(qr, field, value)
+            changes[field] = value.isoformat() if isinstance(value, datetime) else value
+
     for field in ["name", "campaign", "channel", "location", "asset", "owner", "notes"]:
         if field in payload:
             new_value = payload[field]
-            setattr(qr, field, new_value.strip() if isinstance(new_value, str) else new_value)
-            changes[field] = getattr(qr, field)
+            apply(field, new_value.strip() if isinstance(new_value, str) else new_value)
 
     if "destination_url" in payload:
         destination_url = (payload.get("destination_url") or "").strip()
         if not valid_url(destination_url):
             return jsonify({"error": "Invalid destination_url"}), 400
-        qr.destination_url = destination_url
-        changes["destination_url"] = destination_url
+        apply("destination_url", destination_url)
 
     if "expires_at" in payload:
         expires_at_raw = payload.get("expires_at")
+        expires_at = None
         if expires_at_raw:
             try:
-                qr.expires_at = datetime.fromisoformat(expires_at_raw.replace("Z", "+00:00"))
+                expires_at = datetime.fromisoformat(expires_at_raw.replace("Z", "+00:00"))
             except ValueError:
                 return jsonify({"error": "Invalid date format for expires_at"}), 400
-        else:
-            qr.expires_at = None
-        changes["expires_at"] = qr.expires_at.isoformat() if qr.expires_at else None
+        apply("expires_at", expires_at)
 
-    # Status value is handled after expiration check in tracked_redirect, 
+    # Expired codes are archived by the expiry sweeper,
     # but let's allow manual status change too.
     if "status" in payload:
-        qr.status = status_value(payload.get("status"))
-        changes["status"] = qr.status
+        apply("status", status_value(payload.get("status")))
 
     if "auto_append_utm" in payload:
-        qr.auto_append_utm = to_bool(payload.get("auto_append_utm"), qr.auto_append_utm)
-        changes["auto_append_utm"] = qr.auto_append_utm
+        apply("auto_append_utm", to_bool(payload.get("auto_append_utm"), qr.auto_append_utm))
 
     for field in ["utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content"]:
         if field in payload:
             value = payload.get(field)
-            setattr(qr, field, value.strip() if isinstance(value, str) else value)
-            changes[field] = getattr(qr, field)
+            apply(field, value.strip() if isinstance(value, str) else value)
 
     # Goal Management
     goal_name = (payload.get("goal_name") or "").strip()
@@ -950,14 +2911,150 @@ def update_qr_code(qr_code_id):
 
     db.session.add(qr)
     if changes:
-        save_history(qr.id, "updated", json.dumps(changes))
+        save_history(qr, "updated", changes)
     db.session.commit()
+    if changes:
+        invalidate_analytics_cache()
 
     data = qr_to_dict(qr)
     data["tracking_url"] = tracking_url(qr.slug)
     return jsonify(data)
 
 
+BULK_ACTIONS = {"delete", "update", "download_zip", "download_pdf"}
+BULK_UPDATE_FIELDS = ["campaign", "channel", "location", "owner", "status", "auto_append_utm", "expires_at"]
+
+
+def bulk_update_values(data):
+    """Normalize the fields of a bulk update payload; empty values leave the field untouched."""
+    values = {}
+    for field in BULK_UPDATE_FIELDS:
+        val = data.get(field)
+        if not val:
+            continue
+        if field == "auto_append_utm":
+            val = to_bool(val, None)
+            if val is None:
+                continue
+        elif field == "status":
+            val = status_value(val)
+        elif field == "expires_at":
+            try:
+                val = datetime.fromisoformat(val.replace("Z", "+00:00"))
+            except (AttributeError, ValueError):
+                continue
+        values[field] = val
+    return values
+
+
+def update_qr_codes(ids, data):
+    """
+    Apply the same field values to many QR codes with one UPDATE ... IN per
+    chunk. Only codes where a value actually changes are updated and get a
+    history row. Returns the number of updated codes.
+    """
+    values = bulk_update_values(data)
+    if not values:
+        return 0
+
+    differs = or_(*(getattr(QRCode, field).is_distinct_from(val) for field, val in values.items()))
+    details = {field: val.isoformat() if isinstance(val, datetime) else val for field, val in values.items()}
+    now = now_utc()
+    updated = 0
+    for chunk in id_chunks(ids):
+        changed = [row[0] for row in db.session.query(QRCode.id).filter(QRCode.id.in_(chunk), differs).all()]
+        if not changed:
+            continue
+        updated += QRCode.query.filter(QRCode.id.in_(changed)).update(
+            {**values, "updated_at": now}, synchronize_session=False
+        )
+        save_history_bulk(changed, "updated_bulk", details)
+        if "auto_append_utm" in values:
+            backfill_redirect_urls(ids=changed)
+    db.session.commit()
+    if updated:
+        invalidate_analytics_cache()
+    return updated
+
+
+def write_qr_zip(qrs, fileobj, fmt, size_px, style, progress=None):
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as zf:
+        for done, qr in enumerate(qrs, start=1):
+            data = tracking_url(qr.slug)
+            try:
+                img_buffer, _, ext = build_qr_image(data, fmt, size_px=size_px, **style)
+                # filename: slug_name.ext
+                safe_name = "".join(c for c in (qr.name or "") if c.isalnum() or c in " -_").strip()
+                fname = f"{qr.slug}_{safe_name}.{ext}" if safe_name else f"{qr.slug}.{ext}"
+                zf.writestr(fname, img_buffer.getvalue())
+            except Exception as e:
+                print(f"Error generating {qr.slug}: {e}")
+            if progress:
+                progress(done)
+
+
+def bulk_export_options(payload):
+    """Validate the export part of a bulk action payload; raises ValueError."""
+    action = payload.get("action")
+    if action == "download_zip":
+        fmt = (payload.get("format") or "png").lower()
+        if fmt not in {"png", "svg"}:
+            raise ValueError("Invalid format")
+        return {"fmt": fmt, "size_px": payload.get("size", 400), "style": qr_style_from(payload)}
+    if action == "download_pdf":
+        return pdf_sheet_options(payload)
+    return None
+
+
+def count_codes(ids):
+    return sum(QRCode.query.filter(QRCode.id.in_(chunk)).count() for chunk in id_chunks(ids))
+
+
+def iter_codes_in_order(ids, batch_size=BULK_CHUNK_SIZE):
+    """
+    Codes for `ids` in request order, loaded one batch at a time and detached
+    once yielded, so an export never holds every row in memory.
+    """
+    ids = list(dict.fromkeys(int(qr_id) for qr_id in ids))
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        found = {qr.id: qr for qr in QRCode.query.filter(QRCode.id.in_(chunk)).all()}
+        for qr_id in chunk:
+            if qr_id in found:
+                yield found[qr_id]
+        for qr in found.values():
+            db.session.expunge(qr)
+
+
+@job_handler("bulk_action")
+def bulk_action_job(ctx, params):
+    action = params.get("action")
+    if action == "delete":
+        deleted = delete_qr_codes(params.get("ids") or [])
+        return {"count": deleted.get("qr_codes", 0), "deleted": deleted}
+    if action == "update":
+        return {"count": update_qr_codes(params.get("ids") or [], params.get("data", {}))}
+
+    ids = params.get("ids") or []
+    total = count_codes(ids)
+    qrs = iter_codes_in_order(ids)
+    options = bulk_export_options(params)
+    ctx.progress(0, total, force=True)
+
+    def report(done):
+        ctx.progress(done, total)
+
+    if action == "download_zip":
+        with ctx.open_result(f"qrcodes_{options['fmt']}.zip", "application/zip") as fh:
+            write_qr_zip(qrs, fh, options["fmt"], options["size_px"], options["style"], progress=report)
+        return {"count": total}
+    if action == "download_pdf":
+        with ctx.open_result("qrcodes_sheet.pdf", "application/pdf") as fh:
+            write_qr_pdf(qrs, fh, options, progress=report)
+        return {"count": total}
+    raise ValueError("Invalid action")
+
+
 @app.route("/api/qrcodes/bulk_action", methods=["POST"])
 def bulk_actions():
     payload = request.get_json(silent=True) or {}
@@ -966,77 +3063,60 @@ def bulk_actions():
 
     if not ids:
         return jsonify({"error": "No IDs provided"}), 400
+    try:
+        ids = [int(qr_id) for qr_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids must be integers"}), 400
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": "Invalid action"}), 400
+    try:
+        options = bulk_export_options(payload)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    qrs = QRCode.query.filter(QRCode.id.in_(ids)).all()
-    if not qrs:
-        return jsonify({"error": "No valid QR codes found"}), 404
+    if wants_async(payload):
+        params = {key: value for key, value in payload.items() if key != "async"}
+        return job_accepted(submit_job("bulk_action", {**params, "ids": ids}))
 
     if action == "delete":
-        for qr in qrs:
-            ScanEvent.query.filter_by(qr_code_id=qr.id).delete()
-            ConversionEvent.query.filter_by(qr_code_id=qr.id).delete()
-            QRHistory.query.filter_by(qr_code_id=qr.id).delete()
-            Goal.query.filter_by(qr_code_id=qr.id).delete()
-            db.session.delete(qr)
-        db.session.commit()
-        return jsonify({"success": True, "count": len(qrs)})
-
-    elif action == "update":
-        data = payload.get("data", {})
-        count = 0
-        for qr in qrs:
-            updated = False
-            for field in ["campaign", "channel", "location", "owner", "status", "auto_append_utm", "expires_at"]:
-                if field in data and data[field]: # Only update if value provided
-                     # Bool check
-                    val = data[field]
-                    if field == "auto_append_utm":
-                         val = to_bool(val, qr.auto_append_utm)
-                    elif field == "status":
-                         val = status_value(val)
-                    elif field == "expires_at":
-                        try:
-                            val = datetime.fromisoformat(val.replace("Z", "+00:00"))
-                        except ValueError:
-                            continue
-                    
-                    if getattr(qr, field) != val:
-                        setattr(qr, field, val)
-                        updated = True
-            if updated:
-                count += 1
-                db.session.add(qr)
-        db.session.commit()
+        deleted = delete_qr_codes(ids)
+        if not deleted.get("qr_codes"):
+            return jsonify({"error": "No valid QR codes found"}), 404
+        return jsonify({"success": True, "count": deleted["qr_codes"], "deleted": deleted})
+
+    if action == "update":
+        count = update_qr_codes(ids, payload.get("data", {}))
+        if not count and not any(
+            db.session.query(QRCode.id).filter(QRCode.id.in_(chunk)).first() for chunk in id_chunks(ids)
+        ):
+            return jsonify({"error": "No valid QR codes found"}), 404
         return jsonify({"success": True, "count": count})
 
-    elif action == "download_zip":
-        fmt = (payload.get("format") or "png").lower()
-        size_px = payload.get("size", 400)
-        if fmt not in {"png", "svg"}:
-            return jsonify({"error": "Invalid format"}), 400
+    if not count_codes(ids):
+        return jsonify({"error": "No valid QR codes found"}), 404
+    qrs = iter_codes_in_order(ids)
 
+    if action == "download_zip":
         zip_buffer = io.BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zf:
-            for qr in qrs:
-                data = tracking_url(qr.slug)
-                try:
-                    img_buffer, _, ext = build_qr_image(data, fmt, size_px=size_px)
-                    # filename: slug_name.ext
-                    safe_name = "".join(c for c in (qr.name or "") if c.isalnum() or c in " -_").strip()
-                    fname = f"{qr.slug}_{safe_name}.{ext}" if safe_name else f"{qr.slug}.{ext}"
-                    zf.writestr(fname, img_buffer.getvalue())
-                except Exception as e:
-                    print(f"Error generating {qr.slug}: {e}")
-        
+        write_qr_zip(qrs, zip_buffer, options["fmt"], options["size_px"], options["style"])
         zip_buffer.seek(0)
         return send_file(
             zip_buffer,
             mimetype="application/zip",
             as_attachment=True,
-            download_name=f"qrcodes_{fmt}.zip"
+            download_name=f"qrcodes_{options['fmt']}.zip"
         )
 
-    return jsonify({"error": "Invalid action"}), 400
+    # download_pdf: spool to disk instead of building the whole document in a BytesIO
+    pdf_file = tempfile.TemporaryFile()
+    write_qr_pdf(qrs, pdf_file, options)
+    pdf_file.seek(0)
+    return send_file(
+        pdf_file,
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name="qrcodes_sheet.pdf",
+    )
 
 
 @app.route("/api/qrcodes/<int:qr_code_id>/history", methods=["GET"])
@@ -1044,24 +3124,61 @@ def qr_history(qr_code_id):
     qr = db.session.get(QRCode, qr_code_id)
     if not qr:
         return jsonify({"error": "QR Code not found"}), 404
-    history_rows = (
-        QRHistory.query.filter_by(qr_code_id=qr_code_id)
-        .order_by(QRHistory.created_at.desc())
-        .limit(200)
-        .all()
-    )
 
-    return jsonify(
-        [
-            {
-                "id": row.id,
-                "action": row.action,
-                "details": row.details,
-                "created_at": row.created_at.isoformat(),
-            }
-            for row in history_rows
-        ]
-    )
+    entries = history_entries(qr_code_id)
+    for entry in entries:
+        # The API returns details as JSON text; legacy rows already hold text
+        if entry["details"] is not None and not isinstance(entry["details"], str):
+            entry["details"] = json.dumps(entry["details"])
+    return jsonify(entries)
+
+
+@app.route("/api/qrcodes/thumbnails")
+def qr_thumbnails():
+    """Previews for a page of QR codes in one request (PNG sprite sheet or inline SVGs)."""
+    try:
+        ids = [int(part) for part in (request.args.get("ids") or "").split(",") if part.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+    if not ids:
+        return jsonify({"error": "No IDs provided"}), 400
+    if len(ids) > 200:
+        return jsonify({"error": "At most 200 IDs per request"}), 400
+    fmt = (request.args.get("format") or "sprite").lower()
+    if fmt not in {"sprite", "svg"}:
+        return jsonify({"error": "format must be sprite or svg"}), 400
+    size_px = min(max(request.args.get("size", 100, type=int), 16), 400)
+
+    slugs = dict(db.session.query(QRCode.id, QRCode.slug).filter(QRCode.id.in_(ids)).all())
+    entries = tuple((qr_id, tracking_url(slugs[qr_id])) for qr_id in dict.fromkeys(ids) if qr_id in slugs)
+
+    key = (fmt, size_px, entries)
+    generation = 0  # slugs never change, so thumbnail entries are never invalidated
+    # The ETag only depends on the key, so revalidations are answered without rendering
+    etag = hashlib.sha1(repr((generation, key)).encode("utf-8")).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        payload = thumbnail_cache.get(key, generation)
+        if payload is None:
+            if fmt == "sprite":
+                payload = build_thumbnail_sprite(entries, size_px)
+            else:
+                payload = {
+                    "format": "svg",
+                    "size": size_px,
+                    "items": [
+                        {"id": qr_id, "svg": build_qr_image(data, "svg", size_px=size_px)[0].getvalue().decode("utf-8")}
+                        for qr_id, data in entries
+                    ],
+                }
+            thumbnail_cache.set(key, generation, payload)
+        response = jsonify(payload)
+
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 3600
+    return response
 
 
 @app.route("/api/qrcodes/<int:qr_code_id>/download")
@@ -1075,8 +3192,12 @@ def download_qr_code(qr_code_id):
 
     if fmt not in {"png", "svg"}:
         return jsonify({"error": "format must be png or svg"}), 400
+    try:
+        style = qr_style_from(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    buffer, mime_type, ext = build_qr_image(data, fmt, size_px=size_px)
+    buffer, mime_type, ext = build_qr_image(data, fmt, size_px=size_px, **style)
     
     # Better naming: QR_Slug_Name.ext
     safe_name = "".join(c for c in (qr.name or "") if c.isalnum() or c in " -_").strip().replace(" ", "_")
@@ -1094,6 +3215,40 @@ def download_qr_code(qr_code_id):
     )
 
 
+def record_visitor_sketch(qr_id, visitor_fp, scanned_at, attempts=5):
+    """
+    Fold a visitor fingerprint into the QR's sketch for the scan hour. The
+    write is a compare-and-swap on the registers read, so concurrent workers
+    re-read and re-merge instead of overwriting each other's visitors.
+    """
+    hour = epoch_hour(scanned_at)
+    table = VisitorSketch.__table__
+    for _ in range(attempts):
+        row = db.session.query(VisitorSketch.id, VisitorSketch.registers).filter_by(qr_code_id=qr_id, hour=hour).first()
+        sketch = HyperLogLog.from_bytes(row.registers) if row else HyperLogLog()
+        if not sketch.add(visitor_fp):
+            db.session.rollback()
+            return  # repeat visitors usually leave the registers untouched
+        try:
+            if row:
+                swapped = db.session.execute(
+                    table.update()
+                    .where(table.c.id == row.id, table.c.registers == row.registers)
+                    .values(registers=sketch.to_bytes())
+                ).rowcount
+            else:
+                db.session.execute(table.insert().values(qr_code_id=qr_id, hour=hour, registers=sketch.to_bytes()))
+                swapped = 1
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created the hour's row first; merge into theirs
+            db.session.rollback()
+            continue
+        if swapped:
+            return
+    print(f"Visitor sketch for QR {qr_id} hour {hour} stayed contended; fingerprint not counted")
+
+
 def log_scan_sync(qr_id, raw_ip, ua, referrer, query_payload):
     """
     Synchronous logging to avoid threading issues on some server setups.
@@ -1103,11 +3258,12 @@ def log_scan_sync(qr_id, raw_ip, ua, referrer, query_payload):
         visitor_fp = visitor_fingerprint_from(ip_h, ua)
         bot = is_bot_user_agent(ua)
 
+        scanned_at = now_utc()
         unique = False
         duplicate = False
         if not bot and visitor_fp:
             window = app.config["UNIQUE_WINDOW_HOURS"]
-            window_start = now_utc() - timedelta(hours=window)
+            window_start = scanned_at - timedelta(hours=window)
             
             prior = (
                 ScanEvent.query.filter_by(qr_code_id=qr_id, visitor_fingerprint=visitor_fp, is_bot=False)
@@ -1123,6 +3279,8 @@ def log_scan_sync(qr_id, raw_ip, ua, referrer, query_payload):
 
         scan_event = ScanEvent(
             qr_code_id=qr_id,
+            scanned_at=scanned_at,
+            **scan_time_buckets(scanned_at),
             ip_hash=ip_h,
             visitor_fingerprint=visitor_fp,
             country=geo["country"],
@@ -1141,22 +3299,25 @@ def log_scan_sync(qr_id, raw_ip, ua, referrer, query_payload):
 
         db.session.add(scan_event)
         db.session.commit()
+        if not bot and visitor_fp:
+            record_visitor_sketch(qr_id, visitor_fp, scanned_at)
     except Exception as e:
         print(f"Error logging scan for QR {qr_id}: {e}")
 
 
 @app.route("/t/<slug>")
 def tracked_redirect(slug):
+    current_workspace.set(workspace_for_slug(slug))
     # Fetch QR code - fast query on indexed slug
     qr = QRCode.query.filter_by(slug=slug).first_or_404()
-    
-    # Check status
-    if qr.status == "active" and qr.expires_at and qr.expires_at < now_utc():
-        qr.status = "archived"
-        db.session.commit()
 
-    if qr.status != "active":
-        return render_template("error.html", message=f"This QR Code is currently {qr.status}."), 410
+    # Read-only status check: the expiry sweeper archives due codes in the background
+    status = qr.status
+    if status == "active" and qr.expires_at and qr.expires_at < now_utc():
+        status = "archived"
+
+    if status != "active":
+        return render_template("error.html", message=f"This QR Code is currently {status}."), 410
 
     # Log synchronously to prevent server errors with threading
     log_scan_sync(
@@ -1167,10 +3328,8 @@ def tracked_redirect(slug):
         json.dumps(request.args.to_dict(flat=False))
     )
 
-    # Calculate destination immediately
-    destination = qr.destination_url
-    destination = apply_utm(destination, qr)
-    destination = append_tracking_param(destination, qr.slug)
+    # Precomputed on write; only rows that were never backfilled need the URL work here
+    destination = qr.redirect_url or build_redirect_url(qr)
 
     return redirect(destination, code=302)
 
@@ -1294,6 +3453,8 @@ def create_conversion():
     )
 
     db.session.add(conversion)
+    db.session.flush()
+    attribute_conversions([conversion])
     db.session.commit()
 
     return (
@@ -1312,40 +3473,46 @@ def create_conversion():
 
 
 @app.route("/api/analytics/summary")
+@cached_analytics("summary")
 def analytics_summary():
     filters = filters_from_request()
+    unique_mode = unique_mode_from_request()
+    if not unique_mode:
+        return jsonify({"error": "unique_mode must be flag or hll"}), 400
 
     scan_query = apply_scan_filters(ScanEvent.query, filters).filter(ScanEvent.is_bot.is_(False))
     total_scans = scan_query.count()
-    unique_scans = scan_query.filter(ScanEvent.is_unique.is_(True)).count()
+    if unique_mode == "hll":
+        sketch = merged_sketches(filters).get(None)
+        unique_scans = sketch.count() if sketch else 0
+    else:
+        unique_scans = scan_query.filter(ScanEvent.is_unique.is_(True)).count()
     bot_scans = apply_scan_filters(ScanEvent.query, filters).filter(ScanEvent.is_bot.is_(True)).count()
 
     conversion_query = apply_conversion_filters(ConversionEvent.query, filters)
     conversions = conversion_query.count()
 
-    conversion_rate = 0.0
-    if unique_scans:
-        conversion_rate = round((conversions / unique_scans) * 100, 2)
+    attributed_conversions = (
+        apply_attribution_filters(ScanAttribution.query, filters)
+        .filter(ScanAttribution.scan_event_id.isnot(None))
+        .count()
+    )
 
     return jsonify(
-        {
-            "total_scans": total_scans,
-            "unique_scans": unique_scans,
-            "bot_scans": bot_scans,
-            "conversions": conversions,
-            "conversion_rate": conversion_rate,
-            "geo_accuracy_note": "Geo is IP-based and approximate; city-level resolution may be imprecise or unavailable.",
-            "unique_definition": f"Unique = first non-bot scan per visitor fingerprint within {app.config['UNIQUE_WINDOW_HOURS']}h.",
-        }
+        summary_payload(total_scans, unique_scans, bot_scans, conversions, attributed_conversions, unique_mode)
     )
 
 
 @app.route("/api/analytics/timeseries")
+@cached_analytics("timeseries")
 def analytics_timeseries():
     filters = filters_from_request()
     granularity = (request.args.get("granularity") or "day").lower()
     if granularity not in {"hour", "day", "week", "month"}:
         return jsonify({"error": "granularity must be hour, day, week, or month"}), 400
+    unique_mode = unique_mode_from_request()
+    if not unique_mode:
+        return jsonify({"error": "unique_mode must be flag or hll"}), 400
 
     bucket = time_bucket_expr(granularity)
 
@@ -1362,19 +3529,23 @@ def analytics_timeseries():
         .all()
     )
 
-    return jsonify(
-        [
-            {
-                "bucket": row.bucket,
-                "total_scans": int(row.total_scans or 0),
-                "unique_scans": int(row.unique_scans or 0),
-            }
-            for row in rows
-        ]
-    )
+    sketches = {}
+    if unique_mode == "hll":
+        sketches = merged_sketches(filters, key_func=lambda hour: hour_bucket_label(hour, granularity))
+
+    payload = []
+    for row in rows:
+        label = bucket_label(row.bucket, granularity)
+        unique_scans = int(row.unique_scans or 0)
+        if unique_mode == "hll":
+            unique_scans = sketches[label].count() if label in sketches else 0
+        payload.append({"bucket": label, "total_scans": int(row.total_scans or 0), "unique_scans": unique_scans})
+
+    return jsonify(payload)
 
 
 @app.route("/api/analytics/top")
+@cached_analytics("top")
 def analytics_top_qr_codes():
     filters = filters_from_request()
     limit = min(max(request.args.get("limit", 10, type=int), 1), 100)
@@ -1416,10 +3587,16 @@ def analytics_top_qr_codes():
 
 
 @app.route("/api/analytics/breakdown")
+@cached_analytics("breakdown")
 def analytics_breakdown():
     filters = filters_from_request()
     field = (request.args.get("field") or "campaign").lower()
     limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    unique_mode = unique_mode_from_request()
+    if not unique_mode:
+        return jsonify({"error": "unique_mode must be flag or hll"}), 400
+    if unique_mode == "hll" and field not in HLL_BREAKDOWN_FIELDS:
+        return jsonify({"error": f"unique_mode=hll supports fields: {', '.join(sorted(HLL_BREAKDOWN_FIELDS))}"}), 400
 
     expr = breakdown_expr(field)
 
@@ -1437,65 +3614,334 @@ def analytics_breakdown():
         .all()
     )
 
-    day_names = {
-        "0": "Sunday",
-        "1": "Monday",
-        "2": "Tuesday",
-        "3": "Wednesday",
-        "4": "Thursday",
-        "5": "Friday",
-        "6": "Saturday",
-    }
+    sketches = merged_sketches(filters, group_column=expr) if unique_mode == "hll" else {}
 
     payload = []
     for row in rows:
         label = row.label
-        if field == "day_of_week" and label is not None:
-            label = day_names.get(str(label), str(label))
-        if field == "hour_of_day" and label is not None:
-            label = f"{label}:00"
+        unique_scans = int(row.unique_scans or 0)
+        if unique_mode == "hll":
+            unique_scans = sketches[label].count() if label in sketches else 0
         payload.append(
             {
-                "label": label or "(unknown)",
+                "label": breakdown_label(field, label),
                 "total_scans": int(row.total_scans or 0),
-                "unique_scans": int(row.unique_scans or 0),
+                "unique_scans": unique_scans,
             }
         )
 
     return jsonify(payload)
 
 
-@app.route("/api/export/scans.csv")
-def export_scans_csv():
+@app.route("/api/analytics/dashboard")
+@cached_analytics("dashboard")
+def analytics_dashboard():
+    """
+    Summary, timeseries, top codes, breakdown and filter options in one payload.
+    All scan aggregates read from a single filtered CTE and are combined with the
+    conversion counts and option lists into one UNION ALL statement, so a dashboard
+    refresh costs one database round-trip.
+    """
     filters = filters_from_request()
-    rows = (
+    granularity = (request.args.get("granularity") or "day").lower()
+    if granularity not in {"hour", "day", "week", "month"}:
+        return jsonify({"error": "granularity must be hour, day, week, or month"}), 400
+    field = (request.args.get("field") or "campaign").lower()
+    top_limit = min(max(request.args.get("top_limit", 10, type=int), 1), 100)
+    breakdown_limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+    unique_mode = unique_mode_from_request()
+    if not unique_mode:
+        return jsonify({"error": "unique_mode must be flag or hll"}), 400
+    if unique_mode == "hll" and field not in HLL_BREAKDOWN_FIELDS:
+        return jsonify({"error": f"unique_mode=hll supports fields: {', '.join(sorted(HLL_BREAKDOWN_FIELDS))}"}), 400
+
+    scans = (
         apply_scan_filters(ScanEvent.query, filters)
         .with_entities(
-            ScanEvent.id,
-            ScanEvent.scanned_at,
-            QRCode.slug,
-            QRCode.name,
-            QRCode.campaign,
-            QRCode.channel,
-            QRCode.location,
-            QRCode.owner,
-            ScanEvent.country,
-            ScanEvent.region,
-            ScanEvent.city,
-            ScanEvent.os,
-            ScanEvent.browser,
-            ScanEvent.device_type,
-            ScanEvent.referrer,
-            ScanEvent.is_bot,
-            ScanEvent.is_unique,
-            ScanEvent.is_duplicate,
+            ScanEvent.id.label("id"),
+            ScanEvent.qr_code_id.label("qr_code_id"),
+            ScanEvent.is_bot.label("is_bot"),
+            ScanEvent.is_unique.label("is_unique"),
+            time_bucket_expr(granularity).label("bucket"),
+            breakdown_expr(field).label("label"),
+        )
+        .cte("filtered_scans")
+    )
+    human = scans.c.is_bot.is_(False)
+    total = func.sum(case((human, 1), else_=0))
+    unique = func.sum(case((human & scans.c.is_unique.is_(True), 1), else_=0))
+    no_int = null()
+    no_text = cast(null(), String)
+
+    def row(kind, ref=no_int, label=no_text, name=no_text, campaign=no_text, channel=no_text, location=no_text,
+            total_scans=no_int, unique_scans=no_int, bot_scans=no_int):
+        return [
+            literal(kind).label("kind"),
+            ref.label("ref"),
+            cast(label, String).label("label"),
+            name.label("name"),
+            campaign.label("campaign"),
+            channel.label("channel"),
+            location.label("location"),
+            total_scans.label("total_scans"),
+            unique_scans.label("unique_scans"),
+            bot_scans.label("bot_scans"),
+        ]
+
+    summary = db.select(
+        *row("summary", total_scans=total, unique_scans=unique, bot_scans=func.sum(case((human, 0), else_=1)))
+    ).select_from(scans)
+    conversions = db.select(
+        *row(
+            "conversions",
+            total_scans=apply_conversion_filters(ConversionEvent.query, filters)
+            .with_entities(func.count(ConversionEvent.id))
+            .scalar_subquery(),
+            unique_scans=apply_attribution_filters(ScanAttribution.query, filters)
+            .filter(ScanAttribution.scan_event_id.isnot(None))
+            .with_entities(func.count(ScanAttribution.id))
+            .scalar_subquery(),
+        )
+    )
+    series = (
+        db.select(*row("timeseries", label=scans.c.bucket, total_scans=total, unique_scans=unique))
+        .where(human)
+        .group_by(scans.c.bucket)
+    )
+    top_counts = (
+        db.select(scans.c.qr_code_id, total.label("total_scans"), unique.label("unique_scans"))
+        .where(human)
+        .group_by(scans.c.qr_code_id)
+        .order_by(total.desc())
+        .limit(top_limit)
+        .subquery()
+    )
+    top = db.select(
+        *row(
+            "top",
+            ref=QRCode.id,
+            label=QRCode.slug,
+            name=QRCode.name,
+            campaign=QRCode.campaign,
+            channel=QRCode.channel,
+            location=QRCode.location,
+            total_scans=top_counts.c.total_scans,
+            unique_scans=top_counts.c.unique_scans,
+        )
+    ).join_from(top_counts, QRCode, QRCode.id == top_counts.c.qr_code_id)
+    breakdown_counts = (
+        db.select(scans.c.label, total.label("total_scans"), unique.label("unique_scans"))
+        .where(human)
+        .group_by(scans.c.label)
+        .order_by(total.desc())
+        .limit(breakdown_limit)
+        .subquery()
+    )
+    breakdown = db.select(
+        *row(
+            "breakdown",
+            label=breakdown_counts.c.label,
+            total_scans=breakdown_counts.c.total_scans,
+            unique_scans=breakdown_counts.c.unique_scans,
+        )
+    )
+    options = [
+        db.select(*row(f"option:{name}", label=getattr(QRCode, name))).where(getattr(QRCode, name).isnot(None)).distinct()
+        for name in ["campaign", "channel", "location", "owner"]
+    ]
+
+    rows = db.session.execute(union_all(summary, conversions, series, top, breakdown, *options)).all()
+
+    payload = {
+        "summary": None,
+        "timeseries": [],
+        "top": [],
+        "breakdown": [],
+        "options": {"campaigns": [], "channels": [], "locations": [], "owners": []},
+    }
+    counts = {}
+    for item in rows:
+        if item.kind in {"summary", "conversions"}:
+            counts[item.kind] = item
+        elif item.kind == "timeseries":
+            payload["timeseries"].append(
+                {
+                    "bucket": int(item.label) if item.label is not None else None,
+                    "total_scans": int(item.total_scans or 0),
+                    "unique_scans": int(item.unique_scans or 0),
+                }
+            )
+        elif item.kind == "top":
+            payload["top"].append(
+                {
+                    "qr_code_id": item.ref,
+                    "slug": item.label,
+                    "name": item.name,
+                    "campaign": item.campaign,
+                    "channel": item.channel,
+                    "location": item.location,
+                    "total_scans": int(item.total_scans or 0),
+                    "unique_scans": int(item.unique_scans or 0),
+                }
+            )
+        elif item.kind == "breakdown":
+            payload["breakdown"].append(
+                {"label": item.label, "total_scans": int(item.total_scans or 0), "unique_scans": int(item.unique_scans or 0)}
+            )
+        elif item.label:
+            payload["options"][f"{item.kind.split(':', 1)[1]}s"].append(item.label)
+
+    payload["timeseries"].sort(key=lambda entry: (entry["bucket"] is None, entry["bucket"] or 0))
+    for entry in payload["timeseries"]:
+        entry["bucket"] = bucket_label(entry["bucket"], granularity)
+
+    total_scans = int(counts["summary"].total_scans or 0)
+    unique_scans = int(counts["summary"].unique_scans or 0)
+    if unique_mode == "hll":
+        sketch = merged_sketches(filters).get(None)
+        unique_scans = sketch.count() if sketch else 0
+        series_sketches = merged_sketches(filters, key_func=lambda hour: hour_bucket_label(hour, granularity))
+        for entry in payload["timeseries"]:
+            entry["unique_scans"] = series_sketches[entry["bucket"]].count() if entry["bucket"] in series_sketches else 0
+        breakdown_sketches = merged_sketches(filters, group_column=breakdown_expr(field))
+        for entry in payload["breakdown"]:
+            entry["unique_scans"] = breakdown_sketches[entry["label"]].count() if entry["label"] in breakdown_sketches else 0
+
+    payload["summary"] = summary_payload(
+        total_scans,
+        unique_scans,
+        int(counts["summary"].bot_scans or 0),
+        int(counts["conversions"].total_scans or 0),
+        int(counts["conversions"].unique_scans or 0),
+        unique_mode,
+    )
+    payload["top"].sort(key=lambda entry: entry["total_scans"], reverse=True)
+    payload["breakdown"].sort(key=lambda entry: entry["total_scans"], reverse=True)
+    for entry in payload["breakdown"]:
+        entry["label"] = breakdown_label(field, entry["label"])
+    for values in payload["options"].values():
+        values.sort()
+
+    return jsonify(payload)
+
+
+@app.route("/api/analytics/funnel")
+@cached_analytics("funnel")
+def analytics_funnel():
+    filters = filters_from_request()
+    group_by = (request.args.get("group_by") or "qr").lower()
+    if group_by not in {"qr", "campaign"}:
+        return jsonify({"error": "group_by must be qr or campaign"}), 400
+
+    if group_by == "qr":
+        group_columns = [QRCode.id, QRCode.slug, QRCode.name, QRCode.campaign]
+    else:
+        group_columns = [QRCode.campaign]
+
+    scan_rows = (
+        apply_scan_filters(ScanEvent.query, filters)
+        .with_entities(
+            *group_columns,
+            func.count(ScanEvent.id).label("total_scans"),
+            func.sum(case((ScanEvent.is_unique.is_(True), 1), else_=0)).label("unique_scans"),
+        )
+        .filter(ScanEvent.is_bot.is_(False))
+        .group_by(*group_columns)
+        .all()
+    )
+    conversion_rows = (
+        apply_attribution_filters(ScanAttribution.query, filters)
+        .with_entities(
+            *group_columns,
+            func.count(ScanAttribution.id).label("conversions"),
+            func.sum(ScanAttribution.value).label("value"),
+            func.avg(ScanAttribution.lag_seconds).label("avg_lag_seconds"),
         )
-        .order_by(ScanEvent.scanned_at.desc())
+        .group_by(*group_columns)
         .all()
     )
 
-    output = io.StringIO()
-    writer = csv.writer(output)
+    funnel = {}
+    for row in scan_rows:
+        funnel[tuple(row[: len(group_columns)])] = {
+            "total_scans": int(row.total_scans or 0),
+            "unique_scans": int(row.unique_scans or 0),
+        }
+    for row in conversion_rows:
+        entry = funnel.setdefault(tuple(row[: len(group_columns)]), {"total_scans": 0, "unique_scans": 0})
+        entry["conversions"] = int(row.conversions or 0)
+        entry["conversion_value"] = float(row.value or 0)
+        if row.avg_lag_seconds is not None:
+            entry["avg_hours_to_convert"] = round(float(row.avg_lag_seconds) / 3600, 2)
+
+    payload = []
+    for key, entry in funnel.items():
+        item = {"campaign": key[-1] or "(unknown)"} if group_by == "campaign" else {
+            "qr_code_id": key[0],
+            "slug": key[1],
+            "name": key[2],
+            "campaign": key[3],
+        }
+        conversions = entry.get("conversions", 0)
+        item.update(
+            {
+                "total_scans": entry["total_scans"],
+                "unique_scans": entry["unique_scans"],
+                "conversions": conversions,
+                "conversion_value": entry.get("conversion_value", 0.0),
+                "conversion_rate": round((conversions / entry["unique_scans"]) * 100, 2) if entry["unique_scans"] else 0.0,
+                "avg_hours_to_convert": entry.get("avg_hours_to_convert"),
+            }
+        )
+        payload.append(item)
+    payload.sort(key=lambda item: (item["conversions"], item["unique_scans"]), reverse=True)
+
+    unattributed = ScanAttribution.query.filter(ScanAttribution.scan_event_id.is_(None))
+    if filters.get("start"):
+        unattributed = unattributed.filter(ScanAttribution.occurred_at >= filters["start"])
+    if filters.get("end"):
+        unattributed = unattributed.filter(ScanAttribution.occurred_at <= filters["end"])
+
+    return jsonify(
+        {
+            "group_by": group_by,
+            "attribution_window_hours": app.config["ATTRIBUTION_WINDOW_HOURS"],
+            "unattributed_conversions": unattributed.count(),
+            "rows": payload,
+        }
+    )
+
+
+SCAN_EXPORT_BATCH_SIZE = 2000
+
+
+def write_scans_csv(filters, fileobj, progress=None):
+    """
+    Write the filtered scan export as CSV, newest first. Rows are read in
+    keyset-paginated batches so exports never hold the full result set.
+    """
+    query = apply_scan_filters(ScanEvent.query, filters).with_entities(
+        ScanEvent.id,
+        ScanEvent.scanned_at,
+        QRCode.slug,
+        QRCode.name,
+        QRCode.campaign,
+        QRCode.channel,
+        QRCode.location,
+        QRCode.owner,
+        ScanEvent.country,
+        ScanEvent.region,
+        ScanEvent.city,
+        ScanEvent.os,
+        ScanEvent.browser,
+        ScanEvent.device_type,
+        ScanEvent.referrer,
+        ScanEvent.is_bot,
+        ScanEvent.is_unique,
+        ScanEvent.is_duplicate,
+    )
+
+    writer = csv.writer(fileobj)
     writer.writerow(
         [
             "scan_id",
@@ -1519,29 +3965,68 @@ def export_scans_csv():
         ]
     )
 
-    for row in rows:
-        writer.writerow(
-            [
-                row.id,
-                row.scanned_at.isoformat(),
-                row.slug,
-                row.name,
-                row.campaign,
-                row.channel,
-                row.location,
-                row.owner,
-                row.country,
-                row.region,
-                row.city,
-                row.os,
-                row.browser,
-                row.device_type,
-                row.referrer,
-                row.is_bot,
-                row.is_unique,
-                row.is_duplicate,
-            ]
-        )
+    written = 0
+    last = None
+    while True:
+        batch = query
+        if last is not None:
+            batch = batch.filter(
+                or_(
+                    ScanEvent.scanned_at < last.scanned_at,
+                    and_(ScanEvent.scanned_at == last.scanned_at, ScanEvent.id < last.id),
+                )
+            )
+        rows = batch.order_by(ScanEvent.scanned_at.desc(), ScanEvent.id.desc()).limit(SCAN_EXPORT_BATCH_SIZE).all()
+        if not rows:
+            break
+        for row in rows:
+            writer.writerow(
+                [
+                    row.id,
+                    row.scanned_at.isoformat(),
+                    row.slug,
+                    row.name,
+                    row.campaign,
+                    row.channel,
+                    row.location,
+                    row.owner,
+                    row.country,
+                    row.region,
+                    row.city,
+                    row.os,
+                    row.browser,
+                    row.device_type,
+                    row.referrer,
+                    row.is_bot,
+                    row.is_unique,
+                    row.is_duplicate,
+                ]
+            )
+        written += len(rows)
+        last = rows[-1]
+        if progress:
+            progress(written)
+    return written
+
+
+@job_handler("export_scans_csv")
+def export_scans_job(ctx, params):
+    filters = filters_from_request(MultiDict(params.get("filters") or {}))
+    total = apply_scan_filters(ScanEvent.query, filters).count()
+    ctx.progress(0, total, force=True)
+    with ctx.open_result("scans_export.csv", "text/csv", mode="w") as fh:
+        written = write_scans_csv(filters, fh, progress=lambda done: ctx.progress(done, total))
+    return {"rows": written}
+
+
+@app.route("/api/export/scans.csv")
+def export_scans_csv():
+    if wants_async():
+        args = {key: value for key, value in request.args.items() if key != "async"}
+        return job_accepted(submit_job("export_scans_csv", {"filters": args}))
+
+    output = io.StringIO()
+    write_scans_csv(filters_from_request(), output)
 
     response = make_response(output.getvalue())
     response.headers["Content-Type"] = "text/csv"
@@ -1612,6 +4097,7 @@ def export_qrcodes_csv():
 
 
 @app.route("/api/analytics/options")
+@cached_analytics("options", metadata_only=True)
 def analytics_options():
     campaigns = [row[0] for row in db.session.query(QRCode.campaign).distinct().all() if row[0]]
     channels = [row[0] for row in db.session.query(QRCode.channel).distinct().all() if row[0]]
@@ -1642,9 +4128,33 @@ def library_stats():
     return jsonify(summary)
 
 
+@job_handler("retention_purge")
+def retention_purge_job(ctx, params):
+    retention_days = int(params.get("days") or app.config["DATA_RETENTION_DAYS"])
+    deleted_scans, deleted_conversions = purge_old_data(retention_days)
+    return {
+        "retention_days": retention_days,
+        "deleted_scans": deleted_scans,
+        "deleted_conversions": deleted_conversions,
+        "deleted_jobs": purge_job_results(),
+    }
+
+
+@job_handler("history_compact")
+def history_compact_job(ctx, params):
+    return {"folded_rows": compact_history(params.get("days"))}
+
+
+@job_handler("expiry_sweep")
+def expiry_sweep_job(ctx, params):
+    return {"expired": expire_due_codes()}
+
+
 @app.route("/api/retention/run", methods=["POST"])
 def run_retention():
     days = request.get_json(silent=True) or {}
+    if wants_async(days):
+        return job_accepted(submit_job("retention_purge", {"days": days.get("days")}))
     retention_days = int(days.get("days") or app.config["DATA_RETENTION_DAYS"])
     deleted_scans, deleted_conversions = purge_old_data(retention_days)
     return jsonify(
@@ -1656,11 +4166,128 @@ def run_retention():
     )
 
 
+@app.route("/api/attribution/run", methods=["POST"])
+def run_attribution():
+    processed = refresh_attributions()
+    return jsonify({"processed_conversions": processed})
+
+
+@app.route("/api/jobs", methods=["GET", "POST"])
+def jobs_collection():
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        kind = payload.get("kind")
+        params = payload.get("params") or {}
+        if kind not in JOB_HANDLERS or kind == "bulk_create":
+            return jsonify({"error": f"kind must be one of: {', '.join(sorted(set(JOB_HANDLERS) - {'bulk_create'}))}"}), 400
+        if kind == "bulk_action":
+            if not params.get("ids") or params.get("action") not in BULK_ACTIONS:
+                return jsonify({"error": "bulk_action needs ids and a valid action"}), 400
+            try:
+                bulk_export_options(params)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        return job_accepted(submit_job(kind, params))
+
+    limit = min(max(request.args.get("limit", 50, type=int), 1), 200)
+    query = Job.query.filter(Job.workspace == current_workspace.get())
+    if request.args.get("status"):
+        query = query.filter(Job.status == request.args["status"])
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    return jsonify({"jobs": [job_to_dict(job) for job in jobs]})
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET", "DELETE"])
+def job_detail(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or job.workspace != current_workspace.get():
+        return jsonify({"error": "Job not found"}), 404
+
+    if request.method == "DELETE":
+        # Queued jobs are cancelled immediately; running ones stop at their next progress report
+        cancelled = Job.query.filter_by(id=job_id, status="queued").update(
+            {"status": "cancelled", "message": "Cancelled", "cancel_requested": True, "finished_at": now_utc()},
+            synchronize_session=False,
+        )
+        if not cancelled and job.status == "running":
+            Job.query.filter_by(id=job_id).update({"cancel_requested": True}, synchronize_session=False)
+        db.session.commit()
+        job = db.session.get(Job, job_id)
+
+    return jsonify({"job": job_to_dict(job)})
+
+
+@app.route("/api/jobs/<job_id>/result")
+def job_result(job_id):
+    job = db.session.get(Job, job_id)
+    if not job or job.workspace != current_workspace.get():
+        return jsonify({"error": "Job not found"}), 404
+    if job.status != "succeeded":
+        return jsonify({"error": f"Job is {job.status}", "job": job_to_dict(job)}), 409
+    if not job.result_path:
+        return jsonify(json.loads(job.result) if job.result else {})
+    if not os.path.exists(job.result_path):
+        return jsonify({"error": "Result file has expired"}), 410
+    return send_file(job.result_path, mimetype=job.result_mimetype, as_attachment=True, download_name=job.result_name)
+
+
+def workspace_to_dict(workspace):
+    return {"key": workspace.key, "name": workspace.name, "created_at": workspace.created_at.isoformat()}
+
+
+@app.route("/api/workspaces", methods=["GET", "POST"])
+def workspaces_collection():
+    if request.method == "POST":
+        payload = request.get_json(silent=True) or {}
+        key = (payload.get("key") or "").strip().lower()
+        if not WORKSPACE_KEY_RE.match(key) or key == DEFAULT_WORKSPACE:
+            return jsonify({"error": "key must be 1-40 lowercase letters, digits, '-' or '_' (and not 'default')"}), 400
+        workspace = Workspace(key=key, name=pick_text(payload, "name") or key)
+        db.session.add(workspace)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": f"Workspace {key} already exists"}), 409
+        workspace_engines.get(key)  # creates the workspace database
+        return jsonify(workspace_to_dict(workspace)), 201
+
+    workspaces = [{"key": DEFAULT_WORKSPACE, "name": "Default", "created_at": None}]
+    workspaces.extend(workspace_to_dict(row) for row in Workspace.query.order_by(Workspace.key).all())
+    return jsonify({"current": current_workspace.get(), "workspaces": workspaces})
+
+
+@app.route("/api/workspaces/current", methods=["PUT"])
+def select_current_workspace():
+    """Remember the workspace for this browser session (API clients can send X-Workspace instead)."""
+    key = ((request.get_json(silent=True) or {}).get("key") or "").strip()
+    if key != DEFAULT_WORKSPACE and db.session.get(Workspace, key) is None:
+        return jsonify({"error": f"Unknown workspace: {key}"}), 404
+    session["workspace"] = key
+    return jsonify({"current": key})
+
+
+@app.route("/api/admin/cache", methods=["GET", "DELETE"])
+def analytics_cache_admin():
+    if request.method == "DELETE":
+        invalidate_analytics_cache()
+    stats = analytics_cache.stats()
+    stats.update(
+        {
+            "enabled": app.config["ANALYTICS_CACHE_ENABLED"],
+            "generation": read_state(CACHE_GENERATION_KEY),
+            "open_range_ttl_seconds": app.config["ANALYTICS_CACHE_TTL_SECONDS"],
+        }
+    )
+    return jsonify(stats)
+
+
 @app.route("/goal.gif")
 def conversion_pixel():
     slug = request.args.get("slug")
     event_name = request.args.get("event_name", "goal")
     if slug:
+        current_workspace.set(workspace_for_slug(slug))
         qr = QRCode.query.filter_by(slug=slug).first()
         if qr:
             ip_h = ip_hash(client_ip())
@@ -1671,6 +4298,8 @@ def conversion_pixel():
                 visitor_fingerprint=visitor_fp,
             )
             db.session.add(conversion)
+            db.session.flush()
+            attribute_conversions([conversion])
             db.session.commit()
 
     pixel = b"\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02\x44\x01\x00\x3b"
@@ -1681,6 +4310,21 @@ def init_db():
     with app.app_context():
         db.create_all()
 
+        checksum = redirect_config_checksum()
+        rebuild = read_state(REDIRECT_CONFIG_KEY, checksum) != checksum
+        filled = backfill_redirect_urls(rebuild=rebuild)
+        db.session.commit()
+        if rebuild:
+            # Workspace databases were created with the column, so they only need the rebuild
+            for workspace in workspace_keys()[1:]:
+                with use_workspace(workspace):
+                    filled += backfill_redirect_urls(rebuild=True)
+                    db.session.commit()
+        if filled:
+            print(f"Migrating: Computed redirect URLs for {filled} QR codes")
+        db.session.merge(AppState(key=REDIRECT_CONFIG_KEY, value=checksum))
+        db.session.commit()
+
 
 init_db()
 
@@ -1692,14 +4336,53 @@ if __name__ == "__main__":
     parser.add_argument("--host", default="0.0.0.0")
     parser.add_argument("--port", type=int, default=5000)
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument("--workspace", default=DEFAULT_WORKSPACE, help="Workspace the maintenance commands below act on")
     parser.add_argument("--purge", action="store_true", help="Purge old scan/conversion data and exit")
     parser.add_argument("--days", type=int, default=None, help="Retention window for --purge")
+    parser.add_argument("--compact-history", action="store_true", help="Fold old QR history entries into compacted rows and exit")
+    parser.add_argument("--expire", action="store_true", help="Archive QR codes whose expiry date has passed and exit")
+    parser.add_argument("--purge-jobs", action="store_true", help="Delete expired job results and fail stale jobs, then exit")
+    parser.add_argument("--attribute", action="store_true", help="Attribute pending conversions to scans and exit")
+    parser.add_argument("--rebuild-sketches", action="store_true", help="Rebuild visitor HyperLogLog sketches and exit")
+    parser.add_argument(
+        "--rebuild-buckets", action="store_true", help="Recompute scan time buckets (after changing ANALYTICS_TIMEZONE) and exit"
+    )
     args = parser.parse_args()
+    with app.app_context():
+        if args.workspace not in workspace_keys():
+            parser.error(f"unknown workspace: {args.workspace}")
+    current_workspace.set(args.workspace)
 
-    if args.purge:
+    if args.rebuild_buckets:
+        with app.app_context():
+            updated = backfill_scan_buckets(rebuild=True)
+            invalidate_analytics_cache()
+            print(f"Rebuilt time buckets for scans={updated}")
+    elif args.rebuild_sketches:
+        with app.app_context():
+            rebuilt = rebuild_visitor_sketches()
+            print(f"Rebuilt visitor sketches={rebuilt}")
+    elif args.compact_history:
+        with app.app_context():
+            print(f"Compacted history rows={compact_history()}")
+    elif args.expire:
+        with app.app_context():
+            print(f"Archived expired codes={expire_due_codes()}")
+    elif args.purge_jobs:
+        with app.app_context():
+            stale = fail_stale_jobs()
+            purged = purge_job_results()
+            print(f"Failed stale jobs={stale}, purged finished jobs={purged}")
+    elif args.attribute:
+        with app.app_context():
+            processed = refresh_attributions()
+            print(f"Attributed conversions={processed}")
+    elif args.purge:
         with app.app_context():
             days = args.days or app.config["DATA_RETENTION_DAYS"]
             deleted_scans, deleted_conversions = purge_old_data(days)
             print(f"Purged scans={deleted_scans}, conversions={deleted_conversions}, days={days}")
     else:
+        # Exit normally on SIGTERM so atexit flushes the history log (gunicorn workers already do)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
         app.run(host=args.host, port=args.port, debug=args.debug)
@@ -0,0 +1,143 @@
+"""
+Bulk update/delete benchmark: set-based update_qr_codes/delete_qr_codes vs
+the former per-code ORM loops of bulk_actions, on a file-backed SQLite DB.
+"executes" counts cursor executions; an executemany (e.g. the ORM flush of
+10k changed objects) counts once.
+
+    python benchmarks/bench_bulk_actions.py --count 10000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+_fd, DB_PATH = tempfile.mkstemp(suffix=".db")
+os.close(_fd)
+os.environ["DATABASE_URL"] = f"sqlite:///{DB_PATH}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime  # noqa: E402
+
+from sqlalchemy import event  # noqa: E402
+
+import app as qr_app  # noqa: E402
+
+db = qr_app.db
+
+
+def legacy_delete(ids):
+    """The delete branch of bulk_actions before the set-based rewrite."""
+    qrs = qr_app.QRCode.query.filter(qr_app.QRCode.id.in_(ids)).all()
+    for qr in qrs:
+        conversion_ids = db.session.query(qr_app.ConversionEvent.id).filter(qr_app.ConversionEvent.qr_code_id == qr.id)
+        qr_app.ScanAttribution.query.filter(
+            qr_app.or_(qr_app.ScanAttribution.qr_code_id == qr.id, qr_app.ScanAttribution.conversion_event_id.in_(conversion_ids))
+        ).delete(synchronize_session=False)
+        qr_app.VisitorSketch.query.filter_by(qr_code_id=qr.id).delete()
+        qr_app.ScanEvent.query.filter_by(qr_code_id=qr.id).delete()
+        qr_app.ConversionEvent.query.filter_by(qr_code_id=qr.id).delete()
+        qr_app.QRHistory.query.filter_by(qr_code_id=qr.id).delete()
+        qr_app.Goal.query.filter_by(qr_code_id=qr.id).delete()
+        db.session.delete(qr)
+    db.session.commit()
+    return len(qrs)
+
+
+def legacy_update(ids, data):
+    """The update branch of bulk_actions before the set-based rewrite (no history rows)."""
+    qrs = qr_app.QRCode.query.filter(qr_app.QRCode.id.in_(ids)).all()
+    count = 0
+    for qr in qrs:
+        updated = False
+        for field, val in data.items():
+            if field == "status":
+                val = qr_app.status_value(val)
+            if getattr(qr, field) != val:
+                setattr(qr, field, val)
+                updated = True
+        if updated:
+            count += 1
+    db.session.commit()
+    return count
+
+
+def seed(count):
+    db.drop_all()
+    db.create_all()
+    now = qr_app.now_utc()
+    db.session.execute(
+        qr_app.QRCode.__table__.insert(),
+        [
+            {
+                "slug": f"b{i:07d}",
+                "destination_url": f"https://example.com/{i}",
+                "campaign": "spring",
+                "status": "active",
+                "auto_append_utm": False,
+                "dynamic": True,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for i in range(count)
+        ],
+    )
+    ids = [row[0] for row in db.session.query(qr_app.QRCode.id).all()]
+    db.session.execute(
+        qr_app.ScanEvent.__table__.insert(),
+        [
+            {
+                "qr_code_id": qr_id,
+                "scanned_at": datetime(2026, 1, 1),
+                "is_bot": False,
+                "is_unique": True,
+                "is_duplicate": False,
+                "ip_hash": "x",
+            }
+            for qr_id in ids
+            for _ in range(2)
+        ],
+    )
+    db.session.commit()
+    return ids
+
+
+def run(label, func, *args):
+    statements = 0
+
+    def count_statement(*_):
+        nonlocal statements
+        statements += 1
+
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    event.remove(db.engine, "before_cursor_execute", count_statement)
+    print(f"{label:<24} {elapsed * 1000:9.0f} ms  {statements:7d} executes  result={result}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=10000)
+    args = parser.parse_args()
+
+    try:
+        with qr_app.app.app_context():
+            data = {"campaign": "summer", "status": "paused"}
+
+            ids = seed(args.count)
+            run("legacy update", legacy_update, ids, data)
+            ids = seed(args.count)
+            run("set-based update", qr_app.update_qr_codes, ids, data)
+
+            ids = seed(args.count)
+            run("legacy delete", legacy_delete, ids)
+            ids = seed(args.count)
+            run("set-based delete", lambda ids: qr_app.delete_qr_codes(ids)["qr_codes"], ids)
+    finally:
+        os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Throughput and size benchmark: native SVG emitter vs the former
+SvgPathImage + regex implementation of build_qr_image.
+
+    python benchmarks/bench_svg.py --count 500
+"""
+import argparse
+import io
+import os
+import re
+import sys
+import time
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import qrcode  # noqa: E402
+import qrcode.image.svg  # noqa: E402
+
+import app as qr_app  # noqa: E402
+
+
+def legacy_svg(data, size_px):
+    """The SVG branch of build_qr_image before the native emitter."""
+    qr = qrcode.QRCode(version=None, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=0)
+    qr.add_data(data)
+    qr.make(fit=True)
+    img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+    buffer = io.BytesIO()
+    img.save(buffer)
+    svg_data = buffer.getvalue().decode("utf-8")
+    modules_count = len(qr.modules)
+    svg_head = f'<svg width="{size_px}" height="{size_px}" viewBox="0 0 {modules_count} {modules_count}" xmlns="http://www.w3.org/2000/svg">'
+    svg_bg = f'<rect width="{modules_count}" height="{modules_count}" fill="white"/>'
+    svg_data = re.sub(r"<svg[^>]*>", f"{svg_head}{svg_bg}", svg_data, count=1)
+    return svg_data.encode("utf-8")
+
+
+def native_svg(data, size_px):
+    return qr_app.build_qr_image(data, "svg", size_px=size_px)[0].getvalue()
+
+
+def run(label, render, urls, size_px):
+    started = time.perf_counter()
+    total_bytes = sum(len(render(url, size_px)) for url in urls)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<28} {len(urls) / elapsed:9.1f} codes/s  {total_bytes / len(urls):9.0f} bytes/code")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--size", type=int, default=400)
+    args = parser.parse_args()
+
+    urls = [f"https://qr.example.com/t/bench{i:05d}" for i in range(args.count)]
+
+    run("legacy (SvgPathImage + re)", legacy_svg, urls, args.size)
+    qr_app.qr_matrix.cache_clear()
+    run("native (cold matrix cache)", native_svg, urls, args.size)
+    run("native (warm matrix cache)", native_svg, urls, args.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -31,6 +31,30 @@ async function api(url, options = {}) {
   return body;
 }
 
+// --- Background Jobs ---
+// Long operations are submitted as jobs (202 + job) and polled until they finish.
+async function waitForJob(job, label) {
+  while (!["succeeded", "failed", "cancelled"].includes(job.status)) {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    job = (await api(`api/jobs/${job.id}`)).job;
+    if (label && job.percent !== null) showToast(`${label}: ${Math.round(job.percent)}%`);
+  }
+  if (job.status !== "succeeded") {
+    const err = new Error(job.message || `Job ${job.status}`);
+    err.job = job;  // cancelled/failed jobs may still report work they committed
+    throw err;
+  }
+  return job;
+}
+
+function downloadJobResult(job) {
+  const a = document.createElement("a");
+  a.href = `api/jobs/${job.id}/result`;
+  document.body.appendChild(a);
+  a.click();
+  a.remove();
+}
+
 // --- UI Components ---
 function showToast(message, type = 'success') {
   const container = document.getElementById('toast-container');
@@ -231,27 +255,22 @@ window.bulkDownload = async (format = "png") => {
   const fmt = format.toLowerCase();
   const size = parseInt(document.getElementById('global-export-size').value) || 400;
 
+  const isPdf = fmt === "pdf";
+
   try {
-    showToast(`Preparing ZIP for ${selected.length} codes...`);
-    const res = await fetch("api/qrcodes/bulk_action", {
+    const label = `Preparing ${isPdf ? "PDF sheet" : "ZIP"} for ${selected.length} codes`;
+    showToast(`${label}...`);
+    const { job } = await api("api/qrcodes/bulk_action", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
-        action: "download_zip",
+        action: isPdf ? "download_pdf" : "download_zip",
         ids: selected,
         format: fmt,
-        size: size
+        size: size,
+        async: true
       })
     });
-    if (!res.ok) throw new Error("Download failed");
-    const blob = await res.blob();
-    const url = window.URL.createObjectURL(blob);
-    const a = document.createElement("a");
-    a.href = url;
-    a.download = `QR_Library_${fmt}.zip`;
-    document.body.appendChild(a);
-    a.click();
-    a.remove();
+    downloadJobResult(await waitForJob(job, label));
     clearSelection();
   } catch (err) {
     showToast(err.message, "error");
@@ -370,10 +389,9 @@ function updateChart(rows) {
   });
 }
 
-// --- Options Loading ---
-async function loadAnalyticsOptions() {
+// --- Options Rendering ---
+function renderAnalyticsOptions(data) {
   try {
-    const data = await api("api/analytics/options");
     const camps = document.getElementById("filter-campaign");
     const chans = document.getElementById("filter-channel");
 
@@ -390,7 +408,7 @@ async function loadAnalyticsOptions() {
     if (currCamp) camps.value = currCamp;
     if (currChan) chans.value = currChan;
   } catch (e) {
-    console.error("Failed to load options", e);
+    console.error("Failed to render options", e);
   }
 }
 
@@ -419,6 +437,7 @@ async function loadLibrary() {
   }
 
   renderLibrary();
+  loadThumbnails();
 
   // Load Library Stats
   const stats = await api("api/library/stats");
@@ -456,7 +475,7 @@ function renderLibrary() {
         <td>
           <div class="qr-identity">
             <div class="qr-preview-small">
-              <img src="api/qrcodes/${item.id}/download?format=png&size=100&preview=1" alt="QR" />
+              <div class="qr-thumb" data-id="${item.id}" role="img" aria-label="QR"></div>
             </div>
             <div class="qr-info">
               <h4>${name}</h4>
@@ -498,9 +517,46 @@ function renderLibrary() {
       </tr>
     `;
   }).join("");
+  applyThumbnails();
   lucide.createIcons();
 }
 
+// --- Library Thumbnails ---
+// The whole page of previews arrives as one sprite sheet instead of one image request per row.
+async function loadThumbnails() {
+  const ids = (window.libraryData || []).map(item => item.id);
+  if (!ids.length) return;
+  try {
+    const data = await api(`api/qrcodes/thumbnails?ids=${ids.join(",")}&size=100`);
+    const sprite = await (await fetch(data.sprite)).blob();
+    if (window.libraryThumbs) URL.revokeObjectURL(window.libraryThumbs.url);
+    window.libraryThumbs = {
+      url: URL.createObjectURL(sprite),
+      columns: data.columns,
+      rows: data.rows,
+      positions: Object.fromEntries(data.items.map(item => [item.id, item])),
+    };
+    applyThumbnails();
+  } catch (e) {
+    console.error("Failed to load thumbnails", e);
+  }
+}
+
+function applyThumbnails() {
+  const thumbs = window.libraryThumbs;
+  if (!thumbs) return;
+  const { columns, rows } = thumbs;
+  document.querySelectorAll(".qr-thumb").forEach(el => {
+    const item = thumbs.positions[el.dataset.id];
+    if (!item) return;
+    const x = columns > 1 ? (item.column / (columns - 1)) * 100 : 0;
+    const y = rows > 1 ? (item.row / (rows - 1)) * 100 : 0;
+    el.style.backgroundImage = `url(${thumbs.url})`;
+    el.style.backgroundSize = `${columns * 100}% ${rows * 100}%`;
+    el.style.backgroundPosition = `${x}% ${y}%`;
+  });
+}
+
 
 // --- Analytics Loading ---
 async function loadAnalytics() {
@@ -516,12 +572,12 @@ async function loadAnalytics() {
   if (fd.get("campaign")) params.set("campaign", fd.get("campaign"));
   if (fd.get("channel")) params.set("channel", fd.get("channel"));
 
-  const [summary, timeseries, top, breakdown] = await Promise.all([
-    api(`api/analytics/summary?${params.toString()}`),
-    api(`api/analytics/timeseries?${params.toString()}`),
-    api(`api/analytics/top?${params.toString()}`),
-    api(`api/analytics/breakdown?${params.toString()}&field=${document.getElementById('breakdown-select').value}`),
-  ]);
+  params.set("field", document.getElementById('breakdown-select').value);
+
+  // One request returns summary, timeseries, top, breakdown and filter options
+  const { summary, timeseries, top, breakdown, options } = await api(`api/analytics/dashboard?${params.toString()}`);
+
+  renderAnalyticsOptions(options);
 
   document.getElementById("summary").innerHTML = [
     metricCard("Total Scans", summary.total_scans),
@@ -574,7 +630,6 @@ function setupHandlers() {
       e.target.reset();
       loadLibrary();
       loadAnalytics();
-      loadAnalyticsOptions(); // Reload options as new campaign might have been added
     } catch (err) {
       showToast(err.message, 'error');
     } finally {
@@ -607,9 +662,11 @@ function setupHandlers() {
     uploadBtn.textContent = "Uploading...";
 
     try {
+      fd.append("async", "1");
       const res = await fetch("api/qrcodes/bulk", { method: "POST", body: fd });
-      const data = await res.json();
-      if (!res.ok) throw new Error(data.error);
+      const body = await res.json();
+      if (!res.ok) throw new Error(body.error);
+      const data = (await waitForJob(body.job, "Importing")).result;
 
       showToast(`Imported ${data.created_count} QR codes!`);
 
@@ -629,7 +686,6 @@ function setupHandlers() {
       labelText.textContent = "Select CSV File";
       await loadLibrary();
       loadAnalytics();
-      loadAnalyticsOptions();
 
       if (data.created_ids && data.created_ids.length > 0) {
         // Select them
@@ -643,6 +699,12 @@ function setupHandlers() {
     } catch (err) {
       showToast(err.message, 'error');
       feedback.innerHTML = `<div class="error-msg">${err.message}</div>`;
+      const partial = err.job && err.job.result;
+      if (partial && partial.created_count) {
+        feedback.innerHTML += `<div class="success-msg">${partial.created_count} codes were imported before the import stopped.</div>`;
+        await loadLibrary();
+        loadAnalytics();
+      }
     } finally {
       uploadBtn.disabled = false;
       uploadBtn.textContent = "Upload Now";
@@ -732,7 +794,6 @@ function setupHandlers() {
       window.closeBulkModal();
       loadLibrary();
       loadAnalytics();
-      loadAnalyticsOptions();
       clearSelection();
     } catch (err) {
       showToast(err.message, "error");
@@ -759,7 +820,6 @@ function setupHandlers() {
       window.closeEditModal();
       loadLibrary();
       loadAnalytics();
-      loadAnalyticsOptions();
     } catch (err) {
       showToast(err.message, 'error');
     } finally {
@@ -793,9 +853,9 @@ function setupHandlers() {
       });
       showToast("Access Granted");
       document.getElementById("login-overlay").classList.remove("active");
+      loadWorkspaces();
       loadLibrary();
       loadAnalytics();
-      loadAnalyticsOptions();
     } catch (err) {
       showToast("Invalid password", "error");
     } finally {
@@ -804,6 +864,27 @@ function setupHandlers() {
   });
 }
 
+// --- Workspaces ---
+// Each workspace has its own codes and analytics; the selection is kept in the server session.
+async function loadWorkspaces() {
+  const select = document.getElementById("workspace-select");
+  const data = await api("api/workspaces");
+  // Names are user input: build the options as text, never as markup
+  select.replaceChildren(...data.workspaces.map(ws => new Option(ws.name, ws.key)));
+  select.value = data.current;
+}
+
+function setupWorkspaceSelect() {
+  document.getElementById("workspace-select").addEventListener("change", async (e) => {
+    try {
+      await api("api/workspaces/current", { method: "PUT", body: JSON.stringify({ key: e.target.value }) });
+      await Promise.all([loadLibrary(), loadAnalytics()]);
+    } catch (err) {
+      showToast(err.message, "error");
+    }
+  });
+}
+
 async function checkAuth() {
   try {
     const status = await api("api/auth_status");
@@ -823,9 +904,10 @@ async function checkAuth() {
 // --- Bootstrap ---
 (async function init() {
   setupHandlers();
+  setupWorkspaceSelect();
   const authed = await checkAuth();
   if (authed) {
-    loadAnalyticsOptions();
+    await loadWorkspaces();
     await Promise.all([loadLibrary(), loadAnalytics()]);
   }
 })();
@@ -24,6 +24,8 @@ def client():
         with app_module.app.app_context():
             app_module.db.drop_all()
             app_module.db.create_all()
+        with test_client.session_transaction() as sess:
+            sess["authenticated"] = True
         yield test_client
 
     if os.path.exists(path):
@@ -121,3 +123,545 @@ def test_conversion_rate(client):
     summary = client.get("/api/analytics/summary").get_json()
     assert summary["conversions"] == 1
     assert summary["conversion_rate"] == 100.0
+
+
+def test_conversion_attributed_to_scan_by_fingerprint(client):
+    create = client.post("/api/qrcodes", json={"destination_url": "https://example.com/shop", "campaign": "summer"})
+    body = create.get_json()
+
+    client.get(f"/t/{body['slug']}", headers={"User-Agent": "Mozilla/5.0 (iPhone)"})
+    client.post(
+        "/api/conversions",
+        json={"qr_code_id": body["id"], "event_name": "purchase", "value": 20},
+        headers={"User-Agent": "Mozilla/5.0 (iPhone)"},
+    )
+    client.post(
+        "/api/conversions",
+        json={"qr_code_id": body["id"], "event_name": "purchase"},
+        headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0)"},
+    )
+
+    summary = client.get("/api/analytics/summary").get_json()
+    assert summary["conversions"] == 2
+    assert summary["attributed_conversions"] == 1
+
+    funnel = client.get("/api/analytics/funnel?group_by=campaign").get_json()
+    assert funnel["unattributed_conversions"] == 1
+    assert funnel["rows"][0]["campaign"] == "summer"
+    assert funnel["rows"][0]["conversions"] == 1
+    assert funnel["rows"][0]["conversion_value"] == 20.0
+
+
+def test_hyperloglog_estimates_and_merges():
+    import app as app_module
+
+    left = app_module.HyperLogLog()
+    right = app_module.HyperLogLog()
+    for i in range(6000):
+        left.add(f"visitor-{i}")
+    for i in range(4000, 10000):
+        right.add(f"visitor-{i}")
+
+    restored = app_module.HyperLogLog.from_bytes(left.to_bytes())
+    assert abs(restored.count() - 6000) < 6000 * 0.06
+    assert abs(restored.merge(right).count() - 10000) < 10000 * 0.06
+
+
+def test_visitor_sketch_merges_concurrent_writes(client, monkeypatch):
+    import app as app_module
+
+    qr = client.post("/api/qrcodes", json={"destination_url": "https://example.com"}).get_json()
+    scanned_at = app_module.now_utc()
+    with client.application.app_context():
+        app_module.record_visitor_sketch(qr["id"], "first", scanned_at)
+
+        # Another worker merges "second" between our read and our write
+        original_add = app_module.HyperLogLog.add
+        raced = []
+
+        def racing_add(sketch, value):
+            if not raced:
+                raced.append(value)
+                with app_module.db.engine.begin() as conn:
+                    row = conn.execute(app_module.VisitorSketch.__table__.select()).one()
+                    theirs = app_module.HyperLogLog.from_bytes(row.registers)
+                    original_add(theirs, "second")
+                    conn.execute(app_module.VisitorSketch.__table__.update().values(registers=theirs.to_bytes()))
+            return original_add(sketch, value)
+
+        monkeypatch.setattr(app_module.HyperLogLog, "add", racing_add)
+        app_module.record_visitor_sketch(qr["id"], "third", scanned_at)
+        monkeypatch.undo()
+
+        row = app_module.VisitorSketch.query.one()
+        assert round(app_module.HyperLogLog.from_bytes(row.registers).count()) == 3
+
+
+def test_unique_mode_hll(client):
+    qr = client.post("/api/qrcodes", json={"destination_url": "https://example.com", "campaign": "autumn"}).get_json()
+    for agent in ["Mozilla/5.0 (iPhone)", "Mozilla/5.0 (Android)", "Mozilla/5.0 (iPhone)"]:
+        client.get(f"/t/{qr['slug']}", headers={"User-Agent": agent})
+
+    summary = client.get("/api/analytics/summary?unique_mode=hll").get_json()
+    assert summary["total_scans"] == 3
+    assert summary["unique_scans"] == 2
+    assert summary["unique_mode"] == "hll"
+
+    series = client.get("/api/analytics/timeseries?granularity=day&unique_mode=hll").get_json()
+    assert series[0]["unique_scans"] == 2
+
+    breakdown = client.get("/api/analytics/breakdown?field=campaign&unique_mode=hll").get_json()
+    assert breakdown == [{"label": "autumn", "total_scans": 3, "unique_scans": 2}]
+
+    assert client.get("/api/analytics/breakdown?field=country&unique_mode=hll").status_code == 400
+
+
+def test_analytics_cache_hits_and_invalidates_on_metadata_change(client):
+    qr = client.post("/api/qrcodes", json={"destination_url": "https://example.com", "campaign": "spring"}).get_json()
+    client.get(f"/t/{qr['slug']}", headers={"User-Agent": "Mozilla/5.0"})
+
+    query = "/api/analytics/breakdown?field=campaign&end=2000-01-01T00:00:00&start=1999-01-01T00:00:00"
+    client.get(query)
+    client.get(query)
+    client.get("/api/analytics/options")
+    client.get("/api/analytics/options")
+    stats = client.get("/api/admin/cache").get_json()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 2
+
+    client.patch(f"/api/qrcodes/{qr['id']}", json={"campaign": "summer"})
+    options = client.get("/api/analytics/options").get_json()
+    assert options["campaigns"] == ["summer"]
+    assert client.get("/api/admin/cache").get_json()["generation"] == 2
+
+
+def test_dashboard_matches_individual_endpoints(client):
+    a = client.post("/api/qrcodes", json={"destination_url": "https://example.com/a", "campaign": "spring", "channel": "print"}).get_json()
+    b = client.post("/api/qrcodes", json={"destination_url": "https://example.com/b", "campaign": "summer"}).get_json()
+    for slug, agent in [(a["slug"], "Mozilla/5.0 (iPhone)"), (a["slug"], "Mozilla/5.0 (Android)"), (b["slug"], "Googlebot")]:
+        client.get(f"/t/{slug}", headers={"User-Agent": agent})
+    client.post("/api/conversions", json={"qr_code_id": a["id"]}, headers={"User-Agent": "Mozilla/5.0 (iPhone)"})
+
+    params = "granularity=day&field=campaign"
+    dashboard = client.get(f"/api/analytics/dashboard?{params}").get_json()
+
+    assert dashboard["summary"] == client.get(f"/api/analytics/summary?{params}").get_json()
+    assert dashboard["timeseries"] == client.get(f"/api/analytics/timeseries?{params}").get_json()
+    assert dashboard["top"] == client.get(f"/api/analytics/top?{params}").get_json()
+    assert dashboard["breakdown"] == client.get(f"/api/analytics/breakdown?{params}").get_json()
+    assert dashboard["options"] == client.get("/api/analytics/options").get_json()
+    assert dashboard["summary"]["bot_scans"] == 1
+    assert dashboard["summary"]["attributed_conversions"] == 1
+
+
+def test_scan_time_buckets_use_local_timezone():
+    from datetime import datetime
+
+    import app as app_module
+
+    # 22:30 UTC in summer is 00:30 the next day in Zurich (UTC+2)
+    buckets = app_module.scan_time_buckets(datetime(2026, 7, 1, 22, 30))
+    assert buckets["local_date"] == 20260702
+    assert buckets["local_hour"] == 0
+    assert buckets["local_dow"] == 4
+    assert app_module.bucket_label(buckets["local_date"], "day") == "2026-07-02"
+    assert app_module.bucket_label(buckets["local_date"] // 100, "month") == "2026-07"
+    assert app_module.bucket_label(buckets["epoch_hour"], "hour") == "2026-07-02 00:00"
+    assert app_module.hour_bucket_label(buckets["epoch_hour"], "week") == "2026-W27"
+
+
+def test_thumbnail_sprite_for_library_page(client, monkeypatch):
+    import app as app_module
+
+    ids = [client.post("/api/qrcodes", json={"destination_url": f"https://example.com/{i}"}).get_json()["id"] for i in range(12)]
+
+    res = client.get(f"/api/qrcodes/thumbnails?ids={','.join(map(str, ids))}&size=50")
+    assert res.status_code == 200
+    body = res.get_json()
+    assert body["columns"] == 10 and body["rows"] == 2
+    assert [item["id"] for item in body["items"]] == ids
+    assert body["items"][11] == {"id": ids[11], "column": 1, "row": 1, "x": 50, "y": 50}
+    assert body["sprite"].startswith("data:image/png;base64,")
+
+    # Revalidation is answered from the ETag alone, even once the render cache lost the entry
+    app_module.thumbnail_cache.clear()
+    monkeypatch.setattr(app_module, "build_thumbnail_sprite", lambda *args: pytest.fail("rendered for a 304"))
+    cached = client.get(f"/api/qrcodes/thumbnails?ids={','.join(map(str, ids))}&size=50", headers={"If-None-Match": res.headers["ETag"]})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == res.headers["ETag"]
+    monkeypatch.undo()
+
+    svg = client.get(f"/api/qrcodes/thumbnails?ids={ids[0]}&format=svg").get_json()
+    assert svg["items"][0]["svg"].rstrip().endswith("</svg>")
+
+
+def test_download_qr_svg_with_colors_and_quiet_zone(client):
+    qr_id = client.post("/api/qrcodes", json={"destination_url": "https://example.com"}).get_json()["id"]
+
+    res = client.get(f"/api/qrcodes/{qr_id}/download?format=svg&size=200&fg=1e293b&bg=white&quiet_zone=4")
+    assert res.status_code == 200
+    assert res.mimetype == "image/svg+xml"
+    svg = res.get_data(as_text=True)
+    assert 'fill="#1e293b"' in svg
+    assert 'fill="white"' in svg
+    assert 'width="200"' in svg
+    assert "M4 4h" in svg  # first dark run starts after the quiet zone
+
+    assert client.get(f"/api/qrcodes/{qr_id}/download?format=svg&fg=url(x)").status_code == 400
+
+
+def test_bulk_download_pdf_sheet(client):
+    ids = [client.post("/api/qrcodes", json={"destination_url": f"https://example.com/{i}", "name": f"Code {i}"}).get_json()["id"] for i in range(5)]
+
+    res = client.post(
+        "/api/qrcodes/bulk_action",
+        json={"action": "download_pdf", "ids": ids, "columns": 2, "rows": 2, "bleed_mm": 3, "labels": ["name", "slug"]},
+    )
+    assert res.status_code == 200
+    assert res.mimetype == "application/pdf"
+    pdf = res.get_data()
+    assert pdf.startswith(b"%PDF")
+    assert b"/Count 2" in pdf  # 5 codes on a 2x2 grid
+
+    bad = client.post("/api/qrcodes/bulk_action", json={"action": "download_pdf", "ids": ids, "page_size": "tabloid"})
+    assert bad.status_code == 400
+    for labels in (5, [1], {"name": True}):
+        bad = client.post("/api/qrcodes/bulk_action", json={"action": "download_pdf", "ids": ids, "labels": labels})
+        assert bad.status_code == 400
+
+
+def test_jobs_run_bulk_import_and_exports(client):
+    client.application.config["JOB_WORKERS"] = 0  # run jobs inline in the submitting request
+
+    csv_content = "destination_url,name\nhttps://example.com/a,A\nnot-a-url,B\n"
+    res = client.post(
+        "/api/qrcodes/bulk?async=1",
+        data={"file": (io.BytesIO(csv_content.encode("utf-8")), "batch.csv")},
+        content_type="multipart/form-data",
+    )
+    assert res.status_code == 202
+    job = res.get_json()["job"]
+    assert res.headers["Location"] == f"/api/jobs/{job['id']}"
+    assert job["status"] == "succeeded"
+    assert job["result"]["created_count"] == 1
+    assert len(job["result"]["errors"]) == 1
+    slug = job["result"]["created"][0]["slug"]
+
+    client.get(f"/t/{slug}", headers={"User-Agent": "Mozilla/5.0"})
+    job = client.get("/api/export/scans.csv?async=1").get_json()["job"]
+    assert job["status"] == "succeeded" and job["result"] == {"rows": 1}
+    export = client.get(job["result_url"])
+    assert export.mimetype == "text/csv"
+    assert slug in export.get_data(as_text=True)
+
+    ids = [client.post("/api/qrcodes", json={"destination_url": "https://example.com"}).get_json()["id"]]
+    job = client.post("/api/qrcodes/bulk_action", json={"action": "download_zip", "ids": ids, "async": True}).get_json()["job"]
+    assert job["progress"] == job["total"] == 1
+    assert client.get(job["result_url"]).get_data().startswith(b"PK")
+
+    listed = client.get("/api/jobs").get_json()["jobs"]
+    assert len(listed) == 3
+    assert client.post("/api/jobs", json={"kind": "bulk_create"}).status_code == 400
+
+
+def test_cancelled_bulk_import_reports_committed_codes(client, monkeypatch):
+    import app as app_module
+
+    client.application.config["JOB_WORKERS"] = 0
+    report = app_module.JobContext.progress
+
+    def cancel_after_first_batch(ctx, done, total=None, **kwargs):
+        report(ctx, done, total, **kwargs)
+        if done >= 200:
+            raise app_module.JobCancelled()
+
+    monkeypatch.setattr(app_module.JobContext, "progress", cancel_after_first_batch)
+    rows = "".join(f"https://example.com/{i},Row {i}\n" for i in range(450))
+    res = client.post(
+        "/api/qrcodes/bulk?async=1",
+        data={"file": (io.BytesIO(("destination_url,name\n" + rows).encode("utf-8")), "batch.csv")},
+        content_type="multipart/form-data",
+    )
+    job = res.get_json()["job"]
+    assert job["status"] == "cancelled"
+    assert job["result"]["created_count"] == 199  # rows before the 200th, committed with its progress report
+    with client.application.app_context():
+        stored = {qr.id for qr in app_module.QRCode.query.all()}
+    assert stored == set(job["result"]["created_ids"])
+
+
+def test_job_queue_claim_and_cancel(client, monkeypatch):
+    import app as app_module
+
+    client.application.config["JOB_WORKERS"] = 1
+    monkeypatch.setattr(app_module.job_runner, "wake", lambda: None)  # keep jobs queued
+
+    queued = client.post("/api/jobs", json={"kind": "retention_purge", "params": {"days": 30}}).get_json()["job"]
+    assert queued["status"] == "queued"
+    cancelled = client.delete(f"/api/jobs/{queued['id']}").get_json()["job"]
+    assert cancelled["status"] == "cancelled"
+    assert client.get(f"/api/jobs/{queued['id']}/result").status_code == 409
+
+    job_id = client.post("/api/jobs", json={"kind": "retention_purge", "params": {"days": 30}}).get_json()["job"]["id"]
+    with client.application.app_context():
+        assert app_module.claim_next_job() == job_id
+        assert app_module.claim_job(job_id) is False
+        assert app_module.run_job(job_id) == "succeeded"
+
+    result = client.get(f"/api/jobs/{job_id}/result").get_json()
+    assert result["retention_days"] == 30
+
+
+def test_bulk_update_and_delete_are_set_based(client):
+    ids = [client.post("/api/qrcodes", json={"destination_url": f"https://example.com/{i}", "campaign": "a"}).get_json()["id"] for i in range(3)]
+    client.patch(f"/api/qrcodes/{ids[0]}", json={"campaign": "b"})
+    slug = client.get(f"/api/qrcodes/{ids[1]}").get_json()["slug"]
+    client.get(f"/t/{slug}", headers={"User-Agent": "Mozilla/5.0"})
+
+    res = client.post("/api/qrcodes/bulk_action", json={"action": "update", "ids": ids, "data": {"campaign": "b", "status": "paused"}})
+    assert res.get_json() == {"success": True, "count": 3}
+    res = client.post("/api/qrcodes/bulk_action", json={"action": "update", "ids": ids, "data": {"campaign": "b"}})
+    assert res.get_json()["count"] == 0  # nothing changed
+    history = client.get(f"/api/qrcodes/{ids[2]}/history").get_json()
+    assert [entry["action"] for entry in history][:1] == ["updated_bulk"]
+
+    res = client.post("/api/qrcodes/bulk_action", json={"action": "delete", "ids": ids + [9999]})
+    body = res.get_json()
+    assert body["count"] == 3
+    assert body["deleted"]["scans"] == 1
+    assert client.get("/api/library/stats").get_json()["total"] == 0
+    assert client.post("/api/qrcodes/bulk_action", json={"action": "delete", "ids": ids}).status_code == 404
+
+
+def test_expiry_sweeper_archives_due_codes(client):
+    import app as app_module
+
+    qr = client.post("/api/qrcodes", json={"destination_url": "https://example.com", "expires_at": "2020-01-01T00:00:00"}).get_json()
+    keep = client.post("/api/qrcodes", json={"destination_url": "https://example.com", "expires_at": "2999-01-01T00:00:00"}).get_json()
+
+    # The redirect refuses the expired code without writing the status change
+    assert client.get(f"/t/{qr['slug']}").status_code == 410
+    assert client.get(f"/api/qrcodes/{qr['id']}").get_json()["status"] == "active"
+
+    with client.application.app_context():
+        assert app_module.expire_due_codes(batch_size=1) == 1
+        assert app_module.expire_due_codes() == 0
+        assert app_module.claim_schedule_slot("expiry_sweep", 60) is True
+        assert app_module.claim_schedule_slot("expiry_sweep", 60) is False
+
+    assert client.get(f"/api/qrcodes/{qr['id']}").get_json()["status"] == "archived"
+    assert client.get(f"/api/qrcodes/{keep['id']}").get_json()["status"] == "active"
+    assert client.get(f"/api/qrcodes/{qr['id']}/history").get_json()[0]["action"] == "expired"
+    assert client.get("/api/library/stats").get_json()["archived"] == 1
+
+
+def test_expiry_sweeper_only_records_codes_it_archived(client):
+    import app as app_module
+    from sqlalchemy import event
+
+    ids = [
+        client.post("/api/qrcodes", json={"destination_url": "https://example.com", "expires_at": "2020-01-01T00:00:00"}).get_json()["id"]
+        for _ in range(2)
+    ]
+    with client.application.app_context():
+        # Another sweep archives the first code between our SELECT and UPDATE
+        raced = []
+
+        def concurrent_sweep(state):
+            if state.is_update and not raced:
+                raced.append(True)
+                with app_module.db.engine.begin() as conn:
+                    conn.execute(app_module.QRCode.__table__.update().where(app_module.QRCode.id == ids[0]).values(status="archived"))
+
+        session = app_module.db.session()
+        event.listen(session, "do_orm_execute", concurrent_sweep)
+        assert app_module.expire_due_codes() == 1
+        event.remove(session, "do_orm_execute", concurrent_sweep)
+
+    assert [entry["action"] for entry in client.get(f"/api/qrcodes/{ids[0]}/history").get_json()] == ["created"]
+    assert client.get(f"/api/qrcodes/{ids[1]}/history").get_json()[0]["action"] == "expired"
+
+
+def test_history_log_diffs_and_compaction(client):
+    import app as app_module
+    from datetime import timedelta
+
+    qr = client.post("/api/qrcodes", json={"destination_url": "https://example.com", "campaign": "spring"}).get_json()
+    client.patch(f"/api/qrcodes/{qr['id']}", json={"campaign": "spring", "channel": "print"})
+    client.patch(f"/api/qrcodes/{qr['id']}", json={"campaign": "spring"})  # no change, no entry
+
+    history = client.get(f"/api/qrcodes/{qr['id']}/history").get_json()
+    assert [entry["action"] for entry in history] == ["updated", "created"]
+    assert history[0]["details"] == '{"channel": "print"}'
+
+    with client.application.app_context():
+        app_module.save_history(qr["id"], "rolled_back", {"x": 1})
+        app_module.db.session.rollback()
+        app_module.db.session.commit()
+
+        old = app_module.now_utc() - timedelta(days=400)
+        app_module.QRHistory.query.update({"created_at": old})
+        app_module.db.session.commit()
+        assert app_module.compact_history(older_than_days=90) == 2
+        assert app_module.QRHistory.query.count() == 1
+        row = app_module.QRHistory.query.one()
+        assert row.action == "compacted" and row.payload[:1] in (b"j", b"z")
+
+    client.patch(f"/api/qrcodes/{qr['id']}", json={"owner": "ops"})
+    history = client.get(f"/api/qrcodes/{qr['id']}/history").get_json()
+    assert [entry["action"] for entry in history] == ["updated", "updated", "created"]
+    assert history[1]["details"] == '{"channel": "print"}'
+
+    with client.application.app_context():
+        # Rows from before payload existed hold their details as text, JSON or not
+        for details in ("moved to print", '{"legacy":  true}'):
+            app_module.db.session.add(app_module.QRHistory(qr_code_id=qr["id"], action="legacy", details=details))
+        app_module.db.session.commit()
+    history = client.get(f"/api/qrcodes/{qr['id']}/history").get_json()
+    assert sorted(entry["details"] for entry in history if entry["action"] == "legacy") == ["moved to print", '{"legacy":  true}']
+
+
+def test_history_encoding_round_trip():
+    import app as app_module
+
+    small = {"row": 2}
+    large = {"notes": "spring campaign " * 40}
+    assert app_module.encode_history(small)[:1] == b"j"
+    assert app_module.encode_history(large)[:1] == b"z"
+    assert app_module.decode_history(app_module.encode_history(large)) == large
+
+
+def test_slug_allocator_blocks_are_unique_across_workers(client):
+    import app as app_module
+
+    with client.application.app_context():
+        first = app_module.SlugAllocator("k", block_size=5)
+        second = app_module.SlugAllocator("k", block_size=5)  # another worker process
+        taken = first.encode(first.permute(7))
+        app_module.db.session.add(app_module.QRCode(slug=taken, destination_url="https://example.com"))
+        app_module.db.session.commit()
+
+        slugs = first.allocate(3) + second.allocate(4) + first.allocate(10)
+        assert len(set(slugs)) == len(slugs) == 17
+        assert taken not in slugs  # pre-existing slugs are skipped
+        assert all(len(slug) == 7 and set(slug) <= set(app_module.SLUG_ALPHABET) for slug in slugs)
+        assert app_module.read_state(app_module.SLUG_COUNTER_KEY) == 5 + 5 + 8  # one reservation per refill
+
+        # Codes in workspace databases are only known to the main database through slug_routes
+        routed = {first.encode(first.permute(value)) for value in range(18, 40)}
+        app_module.db.session.add_all(app_module.SlugRoute(slug=slug, workspace="acme") for slug in routed)
+        app_module.db.session.commit()
+        assert not routed & set(second.allocate(10))
+
+        # Without SLUG_KEY every worker loads the same key, stored in app_state rather than derived from SECRET_KEY
+        client.application.config["SECRET_KEY"] = "rotated"
+        unkeyed = [app_module.SlugAllocator("", block_size=5) for _ in range(2)]
+        slugs = unkeyed[0].allocate(2) + unkeyed[1].allocate(2)
+        assert len(set(slugs)) == 4
+        assert unkeyed[0].permute(123) == unkeyed[1].permute(123) != first.permute(123)
+        assert all(app_module.db.session.get(app_module.AppState, key) for key in app_module.SLUG_KEY_STATE_KEYS)
+
+    sample = range(2000)
+    assert len({first.permute(value) for value in sample}) == len(sample)
+    assert all(value < app_module.SLUG_SPACE for value in (first.permute(v) for v in sample))
+
+
+def test_redirect_url_is_precomputed_on_write(client):
+    import app as app_module
+
+    qr = client.post(
+        "/api/qrcodes",
+        json={"destination_url": "https://example.com/landing?a=1", "utm_source": "poster", "auto_append_utm": False},
+    ).get_json()
+    assert qr["redirect_url"] == f"https://example.com/landing?a=1&qr_tid={qr['slug']}"
+
+    client.patch(f"/api/qrcodes/{qr['id']}", json={"destination_url": "https://example.com/new"})
+    client.post("/api/qrcodes/bulk_action", json={"action": "update", "ids": [qr["id"]], "data": {"auto_append_utm": "true"}})
+    expected = f"https://example.com/new?utm_source=poster&qr_tid={qr['slug']}"
+    assert client.get(f"/api/qrcodes/{qr['id']}").get_json()["redirect_url"] == expected
+
+    with client.application.app_context():
+        # The redirect only reads the stored column
+        app_module.QRCode.query.update({"redirect_url": "https://example.com/stored"})
+        app_module.db.session.commit()
+    assert client.get(f"/t/{qr['slug']}").headers["Location"] == "https://example.com/stored"
+
+    with client.application.app_context():
+        app_module.QRCode.query.update({"redirect_url": None})
+        assert app_module.backfill_redirect_urls() == 1
+        app_module.db.session.commit()
+    assert client.get(f"/t/{qr['slug']}").headers["Location"] == expected
+
+
+def test_workspaces_keep_tenant_data_in_their_own_database(client, tmp_path):
+    import sqlite3
+
+    import app as app_module
+
+    client.application.config["WORKSPACE_DATABASE_URL"] = f"sqlite:///{tmp_path}/{{workspace}}.db"
+    assert client.post("/api/workspaces", json={"key": "Bad Key"}).status_code == 400
+    assert client.post("/api/workspaces", json={"key": "acme", "name": "Acme"}).status_code == 201
+    assert client.post("/api/workspaces", json={"key": "acme"}).status_code == 409
+    assert client.get("/api/qrcodes", headers={"X-Workspace": "nope"}).status_code == 404
+
+    acme = {"X-Workspace": "acme"}
+    home = client.post("/api/qrcodes", json={"destination_url": "https://example.com/home"}).get_json()
+    tenant = client.post("/api/qrcodes", json={"destination_url": "https://example.com/acme"}, headers=acme).get_json()
+    assert [qr["slug"] for qr in client.get("/api/qrcodes").get_json()["items"]] == [home["slug"]]
+    assert [qr["slug"] for qr in client.get("/api/qrcodes", headers=acme).get_json()["items"]] == [tenant["slug"]]
+
+    # Public routes find the tenant through the global slug index
+    for _ in range(2):
+        assert client.get(f"/t/{tenant['slug']}").headers["Location"].startswith("https://example.com/acme")
+    assert client.get(f"/t/{home['slug']}").status_code == 302
+    assert client.get("/api/analytics/summary").get_json()["total_scans"] == 1
+    assert client.get("/api/analytics/summary", headers=acme).get_json()["total_scans"] == 2
+
+    with sqlite3.connect(tmp_path / "acme.db") as conn:
+        assert conn.execute("SELECT slug FROM qr_codes").fetchall() == [(tenant["slug"],)]
+        assert conn.execute("SELECT COUNT(*) FROM scan_events").fetchone() == (2,)
+        assert conn.execute("SELECT COUNT(*) FROM qr_history").fetchone() == (1,)
+    with client.application.app_context():
+        assert app_module.workspace_for_slug(tenant["slug"]) == "acme"
+        assert app_module.QRCode.query.count() == 1  # the main database only has the default workspace
+
+    assert client.put("/api/workspaces/current", json={"key": "acme"}).status_code == 200
+    assert client.get("/api/library/stats").get_json()["total"] == 1
+    deleted = client.delete(f"/api/qrcodes/{tenant['id']}").get_json()
+    assert deleted["success"]
+    assert client.get(f"/t/{tenant['slug']}").status_code == 404
+    with client.application.app_context():
+        assert app_module.db.session.get(app_module.SlugRoute, tenant["slug"]) is None
+
+
+def test_slug_routes_repair_and_workspace_databases_migrate(client, tmp_path):
+    import sqlite3
+
+    import app as app_module
+
+    client.application.config["WORKSPACE_DATABASE_URL"] = f"sqlite:///{tmp_path}/{{workspace}}.db"
+    client.post("/api/workspaces", json={"key": "acme"})
+    acme = {"X-Workspace": "acme"}
+    tenant = client.post("/api/qrcodes", json={"destination_url": "https://example.com/acme"}, headers=acme).get_json()
+
+    with client.application.app_context():
+        db = app_module.db
+        # A commit that failed halfway: the code landed without its route, and a route without its code
+        db.session.query(app_module.SlugRoute).delete()
+        db.session.add(app_module.SlugRoute(slug="ghost", workspace="acme"))
+        db.session.commit()
+
+    assert client.get(f"/t/{tenant['slug']}").headers["Location"].startswith("https://example.com/acme")
+    with client.application.app_context():
+        assert app_module.db.session.get(app_module.SlugRoute, tenant["slug"]).workspace == "acme"
+        app_module.repair_slug_routes("acme")
+        assert app_module.db.session.get(app_module.SlugRoute, "ghost") is None
+
+    # A workspace database created before a column existed gets it on open
+    with sqlite3.connect(tmp_path / "acme.db") as conn:
+        conn.execute("ALTER TABLE qr_codes DROP COLUMN redirect_url")
+    with client.application.app_context():
+        app_module.workspace_engines = app_module.WorkspaceEngines()
+        app_module.workspace_engines.get("acme")
+    with sqlite3.connect(tmp_path / "acme.db") as conn:
+        assert "redirect_url" in [row[1] for row in conn.execute("PRAGMA table_info(qr_codes)")]
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, send_file, flash, redirect, url_for, send_from_directory, jsonify
+from flask import Flask, Response, abort, render_template, request, send_file, flash, redirect, url_for, jsonify
 import yt_dlp
 import os
 import logging
@@ -6,7 +6,20 @@ import uuid
 import shutil
 import subprocess
 import threading
-import re
+import sys
+import json
+import time
+import sqlite3
+import fcntl
+import hashlib
+import mimetypes
+import tempfile
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import parse_qsl, quote, urlencode, urlsplit, urlunsplit
+from werkzeug.security import safe_join
 
 
 # Configure logging
@@ -21,27 +34,6 @@ app.secret_key = 'supersecretkey'
 DOWNLOAD_FOLDER = os.path.abspath('downloads')
 CONFIG_FOLDER = os.path.abspath('config')
 
-def clean_downloads():
-    """Cleans the downloads directory on startup."""
-    # Ensure folders exist
-    os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
-    os.makedirs(CONFIG_FOLDER, exist_ok=True)
-
-    if os.path.exists(DOWNLOAD_FOLDER):
-        logger.info(f"Cleaning downloads folder: {DOWNLOAD_FOLDER}")
-        for filename in os.listdir(DOWNLOAD_FOLDER):
-            file_path = os.path.join(DOWNLOAD_FOLDER, filename)
-            try:
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            except Exception as e:
-                logger.error(f'Failed to delete {file_path}. Reason: {e}')
-
-# Clean downloads on startup
-clean_downloads()
-
 @app.route('/cookies', methods=['POST'])
 def upload_cookies():
     if 'file' not in request.files:
@@ -57,15 +49,155 @@ def upload_cookies():
         flash('Cookies uploaded successfully!', 'success')
         return redirect(url_for('index'))
 
+# Behind nginx, point this at an internal location aliased to DOWNLOAD_FOLDER:
+#   location /_media/ { internal; alias /app/downloads/; }
+# nginx then streams the file itself (sendfile, ranges, conditionals) and the worker is free at once.
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX', '')
+MEDIA_MAX_AGE = 3600
+
+def serve_media(path, download_name=None):
+    """
+    Serve a file under DOWNLOAD_FOLDER. Without ACCEL_REDIRECT_PREFIX, Werkzeug
+    answers Range and If-None-Match/If-Modified-Since requests, and whole
+    files go out through wsgi.file_wrapper (sendfile under gunicorn).
+    """
+    if not ACCEL_REDIRECT_PREFIX:
+        return send_file(path, as_attachment=bool(download_name), download_name=download_name, conditional=True, etag=True,
+                         max_age=MEDIA_MAX_AGE)
+    relative = os.path.relpath(path, DOWNLOAD_FOLDER).replace(os.sep, '/')
+    response = Response(mimetype=mimetypes.guess_type(path)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{quote(relative)}"
+    response.headers['Cache-Control'] = f"public, max-age={MEDIA_MAX_AGE}"
+    if download_name:
+        fallback = download_name.encode('ascii', 'replace').decode().replace('"', '')
+        response.headers['Content-Disposition'] = f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name)}"
+    return response
+
 @app.route('/downloads/<path:filename>')
 def custom_static(filename):
-    return send_from_directory(DOWNLOAD_FOLDER, filename)
+    path = safe_join(DOWNLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return serve_media(path)
 
 @app.route('/')
 def index():
     cookies_present = os.path.exists(os.path.join(CONFIG_FOLDER, 'cookies.txt'))
     return render_template('index.html', cookies_present=cookies_present)
 
+def ydl_options(**overrides):
+    opts = {
+        'noplaylist': True,
+        'quiet': True,
+        'sleep_interval': 3,
+        'max_sleep_interval': 8,
+        'extractor_args': {'youtube': 'player_client=web;po_token=web'},
+        'force_generic_extractor': False,
+        'no_check_certificate': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+        }
+    }
+
+    cookie_file = os.path.join(CONFIG_FOLDER, 'cookies.txt')
+    if os.path.exists(cookie_file):
+        opts['cookiefile'] = cookie_file
+        logger.info("Using cookies.txt for authentication")
+
+    opts.update(overrides)
+    return opts
+
+def fetch_metadata(url):
+    """Extract title, duration and formats without downloading anything."""
+    with yt_dlp.YoutubeDL(ydl_options()) as ydl:
+        return ydl.extract_info(url, download=False)
+
+def summarize_formats(info):
+    formats = []
+    for f in info.get('formats') or []:
+        if f.get('vcodec') in (None, 'none') and f.get('acodec') in (None, 'none'):
+            continue  # storyboards etc.
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'filesize': f.get('filesize') or f.get('filesize_approx'),
+        })
+    return formats
+
+def requested_section(start_str, end_str, duration):
+    """(start, end) seconds for a section download, or None for the whole video."""
+    start = parse_time_str(start_str)
+    end = parse_time_str(end_str) if end_str else (duration or float('inf'))
+    if duration:
+        end = min(end, duration)
+    if end <= start or (start <= 0 and duration and end >= duration):
+        return None
+    return (start, end)
+
+def download_source(info, target_dir, section=None):
+    """
+    Download the video described by `info` (from fetch_metadata) into target_dir.
+    With a section only that time range is fetched; extractors/protocols that
+    cannot download ranges fall back to the full video. Returns the section used.
+    """
+    opts = ydl_options(
+        format=SOURCE_FORMAT,
+        merge_output_format='mp4',
+        outtmpl=os.path.join(target_dir, 'original.%(ext)s'),
+    )
+    if section:
+        # Cuts land on keyframes; the editor trims precisely afterwards
+        section_opts = dict(opts, download_ranges=yt_dlp.utils.download_range_func(None, [section]))
+        try:
+            with yt_dlp.YoutubeDL(section_opts) as ydl:
+                ydl.process_ie_result(dict(info), download=True)
+            if [f for f in os.listdir(target_dir) if not f.startswith('.')]:
+                return section
+        except Exception as e:
+            logger.warning(f"Section download failed, falling back to the full video: {e}")
+        for name in os.listdir(target_dir):
+            os.remove(os.path.join(target_dir, name))
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        # Reuses the extracted info, like --load-info-json
+        ydl.process_ie_result(dict(info), download=True)
+    return None
+
+def format_seconds(seconds):
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+@app.route('/info', methods=['POST'])
+def video_info():
+    """Metadata for the fetch form (duration for the section inputs, available formats)."""
+    url = request.form.get('url') or (request.get_json(silent=True) or {}).get('url')
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+    try:
+        info = fetch_metadata(url)
+    except Exception as e:
+        logger.error(f"Info failed: {e}")
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        'extractor': info.get('extractor_key'),
+        'id': info.get('id'),
+        'thumbnail': info.get('thumbnail'),
+        'formats': summarize_formats(info),
+    })
+
+def section_label(start, end):
+    if start is None:
+        return None
+    return f"{format_seconds(start)}–{format_seconds(end) if end != float('inf') else 'end'}"
+
 @app.route('/fetch', methods=['POST'])
 def fetch_video():
     url = request.form.get('url')
@@ -73,60 +205,465 @@ def fetch_video():
         flash('Please enter a URL.', 'error')
         return redirect(url_for('index'))
 
-    download_id = str(uuid.uuid4())
-    current_download_dir = os.path.join(DOWNLOAD_FOLDER, download_id)
-    os.makedirs(current_download_dir, exist_ok=True)
-
     try:
-        # Download the full video in best quality and merge to mp4
-        ydl_opts = {
-            'format': 'bestvideo+bestaudio/best',
-            'merge_output_format': 'mp4',
-            'outtmpl': os.path.join(current_download_dir, 'original.%(ext)s'),
-            'noplaylist': True,
-            'noplaylist': True,
-            'quiet': True,
-            'sleep_interval': 3,
-            'max_sleep_interval': 8,
-            'extractor_args': {'youtube': 'player_client=web;po_token=web'},
-            'force_generic_extractor': False,
-            'no_check_certificate': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-            }
-        }
-        
-        cookie_file = os.path.join(CONFIG_FOLDER, 'cookies.txt')
-        if os.path.exists(cookie_file):
-            ydl_opts['cookiefile'] = cookie_file
-            logger.info("Using cookies.txt for authentication")
-
         logger.info(f"Fetching video for URL: {url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            video_title = info.get('title', 'video')
+        info = fetch_metadata(url)
+        video_title = info.get('title', 'video')
+        source_duration = info.get('duration')
+        section = requested_section(request.form.get('section_start'), request.form.get('section_end'), source_duration)
+        source = cached_source(url, info, section)
+        directory, filename = source['key'], source['filename']
 
-        files = os.listdir(current_download_dir)
-        files = [f for f in files if not f.startswith('.')]
-        if not files:
-            raise Exception("No file downloaded")
-        
-        filename = files[0]
         # Pass the relative path for the frontend to load in <video> tag
-        video_url = url_for('custom_static', filename=f"{download_id}/{filename}")
+        video_url = url_for('custom_static', filename=f"{directory}/{filename}")
+        # The editor swaps to the lightweight previews once the job has made them
+        ready = preview_ready(directory)
+        preview_job_id = None if ready else queue_preview(directory, filename)
         
-        return render_template('editor.html', video_url=video_url, directory=download_id, filename=filename, video_title=video_title)
+        return render_template('editor.html', video_url=video_url, directory=directory, filename=filename, video_title=video_title,
+                               preview=preview_urls(directory), preview_ready=ready, preview_job_id=preview_job_id,
+                               source_duration=format_seconds(source_duration) if source_duration else None,
+                               section_label=section_label(source['section_start'], source['section_end']))
 
     except Exception as e:
         logger.error(f"Fetch failed: {e}")
         flash(f"Could not fetch video: {str(e)}", 'error')
-        shutil.rmtree(current_download_dir, ignore_errors=True)
         return redirect(url_for('index'))
 
-# Job store for async processing
-jobs = {}
+# Job store for async processing: shared by all gunicorn workers and kept across restarts
+JOB_DB_PATH = os.environ.get('JOB_DB_PATH', os.path.join(CONFIG_FOLDER, 'jobs.db'))
+FFMPEG_THREADS = int(os.environ.get('FFMPEG_THREADS', '2'))
+# Concurrent ffmpeg processes across all workers; default fills the cores without oversubscribing
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', '0')) or max(1, (os.cpu_count() or 2) // FFMPEG_THREADS)
+STALE_JOB_SECONDS = 60  # a processing job without a heartbeat for this long lost its worker
+
+def job_db():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_job_db():
+    os.makedirs(os.path.dirname(JOB_DB_PATH), exist_ok=True)
+    with closing(job_db()) as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                progress INTEGER NOT NULL DEFAULT 0,
+                cmd TEXT NOT NULL,
+                duration REAL NOT NULL DEFAULT 0,
+                work_dir TEXT NOT NULL,
+                output_path TEXT NOT NULL,
+                download_name TEXT NOT NULL,
+                mode TEXT,
+                error TEXT,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL,
+                stats TEXT,
+                outputs TEXT,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                last_access REAL
+            )
+        ''')
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        if 'stats' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN stats TEXT')
+        if 'outputs' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN outputs TEXT')
+        if 'size_bytes' not in columns:
+            conn.execute('ALTER TABLE jobs ADD COLUMN size_bytes INTEGER NOT NULL DEFAULT 0')
+            conn.execute('ALTER TABLE jobs ADD COLUMN last_access REAL')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS sources (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                url TEXT NOT NULL,
+                title TEXT,
+                duration REAL,
+                filename TEXT,
+                section_start REAL,
+                section_end REAL,
+                size_bytes INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+
+def create_job(cmd, duration, work_dir, output_path, download_name, mode, outputs=None):
+    """outputs lists every file of a multi-output job (format, path, download_name); output_path is the first."""
+    job_id = str(uuid.uuid4())
+    with closing(job_db()) as conn:
+        conn.execute(
+            'INSERT INTO jobs (id, status, cmd, duration, work_dir, output_path, download_name, mode, created_at, outputs) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, 'queued', json.dumps(cmd), duration, os.path.basename(work_dir), output_path, download_name, mode, time.time(),
+             json.dumps(outputs) if outputs else None),
+        )
+    return job_id
+
+def job_outputs(job):
+    if job['outputs']:
+        return json.loads(job['outputs'])
+    return [{'format': os.path.splitext(job['download_name'])[1].lstrip('.'), 'path': job['output_path'], 'download_name': job['download_name']}]
+
+def update_job(job_id, **fields):
+    assignments = ', '.join(f"{name} = ?" for name in fields)
+    with closing(job_db()) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+def get_job(job_id):
+    with closing(job_db()) as conn:
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = dict(row)
+        if job['status'] == 'queued':
+            ahead = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?", (job['created_at'],)
+            ).fetchone()[0]
+            job['queue_position'] = ahead + 1
+    return job
+
+def claim_next_job():
+    """
+    Take the oldest queued job if fewer than MAX_CONCURRENT_JOBS are running
+    (in any process). BEGIN IMMEDIATE serializes claims across workers.
+    """
+    now = time.time()
+    with closing(job_db()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs whose worker died (restart, crash) go back to the front of the queue
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', progress = 0 WHERE status = 'processing' AND heartbeat_at < ?",
+                (now - STALE_JOB_SECONDS,),
+            )
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'processing'").fetchone()[0]
+            row = None
+            if running < MAX_CONCURRENT_JOBS:
+                row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = 'processing', worker = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                    (f"{os.getpid()}/{threading.current_thread().name}", now, now, row['id']),
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return dict(row) if row else None
+
+def unfinished_job_dirs():
+    with closing(job_db()) as conn:
+        rows = conn.execute("SELECT DISTINCT work_dir FROM jobs WHERE status IN ('queued', 'processing')").fetchall()
+    return {row[0] for row in rows}
+
+# Source cache: one download per (video, format, section), shared by every user and kept across restarts
+SOURCE_FORMAT = 'bestvideo+bestaudio/best'
+SOURCE_CACHE_MAX_BYTES = int(os.environ.get('SOURCE_CACHE_MAX_BYTES', str(20 * 1024 ** 3)))
+STALE_DOWNLOAD_SECONDS = 120  # a download without progress for this long lost its worker
+TRACKING_QUERY_PARAMS = {'si', 'feature', 'pp', 'fbclid', 'gclid'}
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_QUERY_PARAMS and not k.startswith('utm_')
+    )
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+def source_cache_key(url, info, section):
+    """Extractor + video id when known (so URL variants share an entry), else the normalized URL."""
+    if info.get('extractor_key') and info.get('id'):
+        identity = f"{info['extractor_key']}:{info['id']}"
+    else:
+        identity = normalize_url(url)
+    raw = json.dumps([identity, SOURCE_FORMAT, list(section) if section else None])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def touch_source(key):
+    """Mark a source as used; False if it is not (or no longer) cached."""
+    with closing(job_db()) as conn:
+        return conn.execute('UPDATE sources SET last_access = ? WHERE key = ?', (time.time(), key)).rowcount > 0
+
+def refresh_source_size(key):
+    """Track the source file plus its previews; job outputs in the same directory are tracked by their jobs."""
+    with closing(job_db()) as conn:
+        row = conn.execute('SELECT filename FROM sources WHERE key = ?', (key,)).fetchone()
+        if not row or not row['filename']:
+            return
+        directory = os.path.join(DOWNLOAD_FOLDER, key)
+        size = directory_size(os.path.join(directory, PREVIEW_DIR))
+        try:
+            size += os.path.getsize(os.path.join(directory, row['filename']))
+        except OSError:
+            pass
+        conn.execute('UPDATE sources SET size_bytes = ? WHERE key = ?', (size, key))
+
+def claim_source(key, url, title, duration):
+    """
+    Single-flight: returns the ready row, 'download' when this caller must
+    download it, or None while another request (in any worker) is downloading.
+    """
+    now = time.time()
+    with closing(job_db()) as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT * FROM sources WHERE key = ?', (key,)).fetchone()
+            if row and row['status'] == 'ready':
+                conn.execute('UPDATE sources SET last_access = ? WHERE key = ?', (now, key))
+                result = dict(row)
+            elif row and row['last_access'] >= now - STALE_DOWNLOAD_SECONDS:
+                result = None
+            else:
+                conn.execute(
+                    'INSERT OR REPLACE INTO sources (key, status, url, title, duration, created_at, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (key, 'downloading', url, title, duration, now, now),
+                )
+                result = 'download'
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    return result
+
+def cached_source(url, info, section):
+    """Return the cache row for this video/section, downloading it unless another request already is."""
+    key = source_cache_key(url, info, section)
+    directory = os.path.join(DOWNLOAD_FOLDER, key)
+    while True:
+        claimed = claim_source(key, url, info.get('title'), info.get('duration'))
+        if isinstance(claimed, dict):
+            if os.path.isdir(directory):
+                return claimed
+            claimed = claim_source_again(key, url, info)
+        if claimed == 'download':
+            break
+        time.sleep(1)
+
+    # Each attempt downloads into its own dot-directory and is moved into place
+    # only when complete, so a takeover never deletes files still being written
+    attempt_dir = tempfile.mkdtemp(prefix=f'.{key}-', dir=DOWNLOAD_FOLDER)
+    finished = threading.Event()
+
+    def heartbeat():
+        # Keeps waiting requests (and the orphan sweep) off a slow but live
+        # download, also while yt-dlp reports no progress (merging, retries)
+        while not finished.wait(STALE_DOWNLOAD_SECONDS / 4):
+            try:
+                touch_source(key)
+                os.utime(attempt_dir)
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"Heartbeat for source {key} failed: {e}")
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    try:
+        used = download_source(info, attempt_dir, section)
+        files = [f for f in os.listdir(attempt_dir) if not f.startswith('.')]
+        if not files:
+            raise Exception("No file downloaded")
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(attempt_dir, directory)
+        now = time.time()
+        with closing(job_db()) as conn:
+            conn.execute(
+                "UPDATE sources SET status = 'ready', filename = ?, section_start = ?, section_end = ?, size_bytes = ?, last_access = ? "
+                'WHERE key = ?',
+                (files[0], used[0] if used else None, used[1] if used else None, directory_size(directory), now, key),
+            )
+            row = dict(conn.execute('SELECT * FROM sources WHERE key = ?', (key,)).fetchone())
+    except Exception:
+        with closing(job_db()) as conn:
+            conn.execute('DELETE FROM sources WHERE key = ?', (key,))
+        shutil.rmtree(attempt_dir, ignore_errors=True)
+        raise
+    finally:
+        finished.set()
+    enforce_cache_quota(keep=key)
+    return row
+
+def claim_source_again(key, url, info):
+    """The row says ready but its files are gone (deleted by hand): download again."""
+    with closing(job_db()) as conn:
+        conn.execute("DELETE FROM sources WHERE key = ? AND status = 'ready'", (key,))
+    return claim_source(key, url, info.get('title'), info.get('duration'))
+
+def cached_source_dirs():
+    with closing(job_db()) as conn:
+        return {row[0] for row in conn.execute('SELECT key FROM sources').fetchall()}
+
+def evict_source(key, last_access):
+    """
+    Delete a source with its directory and finished jobs (their outputs live
+    in it). The row is only deleted if nobody used it since last_access was
+    read; returns whether it was.
+    """
+    with closing(job_db()) as conn:
+        evicted = conn.execute('DELETE FROM sources WHERE key = ? AND last_access = ?', (key, last_access)).rowcount
+        if evicted:
+            conn.execute("DELETE FROM jobs WHERE work_dir = ? AND status IN ('completed', 'failed')", (key,))
+    if evicted:
+        shutil.rmtree(os.path.join(DOWNLOAD_FOLDER, key), ignore_errors=True)
+    return bool(evicted)
+
+def enforce_cache_quota(keep=None):
+    """
+    Evict least recently used sources until the tracked sizes (sources,
+    previews and job outputs) fit SOURCE_CACHE_MAX_BYTES. Sources with
+    unfinished jobs are never evicted.
+    """
+    with closing(job_db()) as conn:
+        rows = conn.execute(
+            "SELECT s.key, s.last_access, s.size_bytes + COALESCE(("
+            "SELECT SUM(j.size_bytes) FROM jobs j WHERE j.work_dir = s.key AND j.status = 'completed'), 0) AS total_bytes "
+            "FROM sources s WHERE s.status = 'ready' ORDER BY s.last_access"
+        ).fetchall()
+    total = sum(row['total_bytes'] for row in rows)
+    busy = unfinished_job_dirs()
+    for row in rows:
+        if total <= SOURCE_CACHE_MAX_BYTES:
+            break
+        if row['key'] == keep or row['key'] in busy:
+            continue
+        if evict_source(row['key'], row['last_access']):
+            total -= row['total_bytes']
+            logger.info(f"Evicted cached source {row['key']}")
+
+# Janitor: one process at a time (file lock) sweeps the downloads folder in small batches
+SOURCE_MAX_AGE = float(os.environ.get('SOURCE_MAX_AGE_HOURS', '72')) * 3600
+OUTPUT_MAX_AGE = float(os.environ.get('OUTPUT_MAX_AGE_HOURS', '24')) * 3600
+JANITOR_INTERVAL = 30
+JANITOR_BATCH = 20  # deletions per kind and sweep, so no sweep blocks for long
+
+def expire_job_outputs(limit=JANITOR_BATCH):
+    """Delete finished jobs (and their output files) not downloaded for OUTPUT_MAX_AGE."""
+    cutoff = time.time() - OUTPUT_MAX_AGE
+    with closing(job_db()) as conn:
+        rows = conn.execute(
+            "SELECT * FROM jobs WHERE status IN ('completed', 'failed') AND COALESCE(last_access, finished_at, created_at) < ? "
+            'ORDER BY COALESCE(last_access, finished_at, created_at) LIMIT ?', (cutoff, limit)
+        ).fetchall()
+    for row in rows:
+        with closing(job_db()) as conn:
+            # Downloaded again since we looked: keep
+            deleted = conn.execute(
+                'DELETE FROM jobs WHERE id = ? AND COALESCE(last_access, finished_at, created_at) < ?', (row['id'], cutoff)
+            ).rowcount
+        # Preview files belong to the source and go with it
+        if not deleted or row['mode'] == 'preview':
+            continue
+        for output in job_outputs(row):
+            try:
+                os.unlink(output['path'])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Failed to delete {output['path']}: {e}")
+
+def expire_sources(limit=JANITOR_BATCH):
+    """Evict sources not opened for SOURCE_MAX_AGE, unless a job still needs them."""
+    with closing(job_db()) as conn:
+        rows = conn.execute(
+            "SELECT key, last_access FROM sources WHERE status = 'ready' AND last_access < ? ORDER BY last_access LIMIT ?",
+            (time.time() - SOURCE_MAX_AGE, limit),
+        ).fetchall()
+    busy = unfinished_job_dirs()
+    for row in rows:
+        if row['key'] not in busy and evict_source(row['key'], row['last_access']):
+            logger.info(f"Expired cached source {row['key']}")
+
+def remove_orphans(limit=JANITOR_BATCH):
+    """Delete entries of the downloads folder that no source or unfinished job accounts for (crash leftovers, older versions)."""
+    known = cached_source_dirs() | unfinished_job_dirs()
+    # Grace period for a directory created between our two looks
+    cutoff = time.time() - STALE_DOWNLOAD_SECONDS
+    removed = 0
+    for name in os.listdir(DOWNLOAD_FOLDER):
+        if removed >= limit:
+            break
+        path = os.path.join(DOWNLOAD_FOLDER, name)
+        if name in known:
+            continue
+        try:
+            if os.path.getmtime(path) > cutoff:
+                continue
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+            removed += 1
+            logger.info(f"Removed untracked download {name}")
+        except OSError as e:
+            logger.error(f"Failed to delete {path}: {e}")
+
+def janitor_sweep():
+    expire_job_outputs()
+    expire_sources()
+    enforce_cache_quota()
+    remove_orphans()
+
+def janitor_loop():
+    """Started in every process; only the one holding the lock sweeps, and another takes over if it exits."""
+    lock_file = open(os.path.join(CONFIG_FOLDER, 'janitor.lock'), 'w')
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            time.sleep(JANITOR_INTERVAL)
+    while True:
+        try:
+            janitor_sweep()
+        except Exception as e:
+            logger.error(f"Janitor error: {e}")
+        time.sleep(JANITOR_INTERVAL)
+
+job_wakeup = threading.Event()
+_workers_lock = threading.Lock()
+_workers_pid = None
+
+def ensure_job_workers():
+    """Start this process's worker threads (lazily, so each gunicorn worker starts its own after the fork)."""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        for index in range(MAX_CONCURRENT_JOBS):
+            threading.Thread(target=job_worker_loop, name=f"ffmpeg-worker-{index}", daemon=True).start()
+        threading.Thread(target=janitor_loop, name='janitor', daemon=True).start()
+
+def job_worker_loop():
+    while True:
+        job = None
+        try:
+            job = claim_next_job()
+            if job:
+                run_ffmpeg_job(job)
+        except Exception as e:
+            logger.error(f"Job worker error: {e}")
+        if not job:
+            # Jobs queued by other processes are picked up on the next poll
+            job_wakeup.wait(1.0)
+            job_wakeup.clear()
 
 def parse_time_str(time_str):
     """Parses HH:MM:SS.mm into seconds"""
@@ -142,46 +679,449 @@ def parse_time_str(time_str):
     except:
         return 0.0
 
-def run_ffmpeg_job(job_id, cmd, total_duration, output_path, output_filename):
-    """Background thread to run ffmpeg and track progress"""
+# Containers that can take the source streams as-is (yt-dlp merges to mp4)
+COPY_FORMATS = ['mp4', 'mkv']
+DEFAULT_CRF = {'mp4': '23', 'mkv': '23', 'webm': '30'}
+
+def choose_trim_mode(fmt, fps, width, quality, requested='auto'):
+    """
+    'copy' cuts without decoding (-c copy): the clip starts at the keyframe
+    before start_time, so it is instant but not frame-accurate. Only possible
+    for mp4/mkv without filters or a quality change; anything else is 'encode'.
+    """
+    can_copy = fmt in COPY_FORMATS and not fps and not width and quality in (None, '', DEFAULT_CRF[fmt])
+    if requested == 'encode' or not can_copy:
+        return 'encode'
+    return 'copy'
+
+def trim_input_args(input_path, start_sec, end_sec):
+    """
+    Input-side seeking: ffmpeg jumps to start_sec instead of decoding everything
+    before it. -t goes before -i as well, so the range applies to every output
+    of the command rather than only the first one.
+    """
+    args = []
+    if start_sec > 0:
+        args.extend(['-ss', f"{start_sec:.3f}"])
+    if end_sec > start_sec:
+        args.extend(['-t', f"{end_sec - start_sec:.3f}"])
+    args.extend(['-i', input_path])
+    return args
+
+def probe_duration(path):
+    """Container duration in seconds via ffprobe (0 when unknown)."""
     try:
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-        
-        # Read stderr for progress
-        while True:
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
-                break
-            
-            if line:
-                # Debug logging to see what's happening
-                # logger.info(f"FFmpeg: {line.strip()}") 
-                
-                # Parse time=HH:MM:SS.mm
-                if "time=" in line:
-                    match = re.search(r'time=(\d{2}:\d{2}:\d{2}\.\d+)', line)
-                    if match:
-                        current_time_str = match.group(1)
-                        current_seconds = parse_time_str(current_time_str)
-                        if total_duration > 0:
-                            percent = min(99, int((current_seconds / total_duration) * 100))
-                            jobs[job_id]['progress'] = percent
-                            # logger.info(f"Job {job_id} progress: {percent}%")
+        out = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', path],
+            capture_output=True, text=True, timeout=30,
+        ).stdout.strip()
+        return float(out)
+    except (ValueError, OSError, subprocess.SubprocessError):
+        return 0.0
 
-        
-        if process.returncode == 0:
-            jobs[job_id]['progress'] = 100
-            jobs[job_id]['status'] = 'completed'
-            jobs[job_id]['result_path'] = output_path
-            jobs[job_id]['download_name'] = output_filename
+def has_audio(path):
+    """Whether the file has an audio stream, per ffprobe (assumed when ffprobe fails)."""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index', '-of', 'csv=p=0', path],
+            capture_output=True, text=True, timeout=30,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return True
+    return result.returncode != 0 or bool(result.stdout.strip())
+
+def progress_number(value, suffix=''):
+    """Numbers from ffmpeg's -progress output ('N/A', '1.5x', '1200.3kbits/s')."""
+    if value is None:
+        return None
+    try:
+        return float(value[:-len(suffix)] if suffix and value.endswith(suffix) else value)
+    except ValueError:
+        return None
+
+def progress_stats(block, total_duration):
+    """Structured progress from one key=value block written by ffmpeg -progress."""
+    out_time_us = progress_number(block.get('out_time_us') or block.get('out_time_ms'))
+    out_time = max(0.0, out_time_us / 1e6) if out_time_us is not None else None
+    speed = progress_number(block.get('speed'), 'x')
+    stats = {
+        'out_time': round(out_time, 2) if out_time is not None else None,
+        'fps': progress_number(block.get('fps')),
+        'speed': speed,
+        'bitrate_kbps': progress_number(block.get('bitrate'), 'kbits/s'),
+        'eta': None,
+    }
+    if out_time is not None and total_duration > 0 and speed:
+        stats['eta'] = round(max(0.0, total_duration - out_time) / speed, 1)
+    return stats
+
+class JobProgress:
+    """
+    Throttled writer of a job's -progress stats to the job store. A job can run
+    several ffmpeg commands (parallel animation segments, then a final pass);
+    each reports through its own part, weighted by its share of the work.
+    """
+    def __init__(self, job_id, total_duration):
+        self.job_id = job_id
+        self.total_duration = total_duration
+        self.started = time.time()
+        self.parts = {}
+        self.lock = threading.Lock()
+        self.last_write = 0.0
+
+    def reporter(self, part, weight=1.0, duration=None):
+        """on_progress callback for one command producing `duration` seconds of output"""
+        duration = self.total_duration if duration is None else duration
+        with self.lock:
+            self.parts[part] = 0.0
+
+        def on_progress(block):
+            stats = progress_stats(block, duration)
+            with self.lock:
+                if duration > 0 and stats['out_time'] is not None:
+                    self.parts[part] = min(1.0, stats['out_time'] / duration) * weight
+                if block.get('progress') != 'end' and time.time() - self.last_write < 0.5:
+                    return
+                self.last_write = time.time()
+                done = sum(self.parts.values())
+                several = len(self.parts) > 1
+            values = {'heartbeat_at': time.time()}
+            if self.total_duration > 0:
+                if several:
+                    # Per-command speed says nothing about the whole job; extrapolate from elapsed time
+                    stats['out_time'] = round(done * self.total_duration, 2)
+                    elapsed = time.time() - self.started
+                    stats['eta'] = round(elapsed * (1 - done) / done, 1) if done > 0 else None
+                if stats['out_time'] is not None:
+                    values['progress'] = min(99, int(done * 100))
+            values['stats'] = json.dumps(stats)
+            update_job(self.job_id, **values)
+
+        return on_progress
+
+def run_ffmpeg(cmd, on_progress):
+    """Run one ffmpeg command, passing each parsed -progress block to on_progress. Returns an error message or None."""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    # Drain stderr so ffmpeg never blocks on a full pipe; keep the tail for error messages
+    stderr_tail = deque(maxlen=20)
+    stderr_reader = threading.Thread(target=lambda: stderr_tail.extend(process.stderr), daemon=True)
+    stderr_reader.start()
+
+    block = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition('=')
+        block[key] = value
+        # 'progress' closes a block (continue/end)
+        if key == 'progress':
+            on_progress(block)
+            block = {}
+
+    process.wait()
+    stderr_reader.join(timeout=5)
+    if process.returncode == 0:
+        return None
+    detail = stderr_tail[-1].strip() if stderr_tail else ''
+    return f"FFmpeg process failed: {detail}".strip(': ')
+
+def run_ffmpeg_job(job):
+    """Run a claimed job's ffmpeg command (or animation pipeline) and record its progress in the job store"""
+    job_id = job['id']
+    finished = threading.Event()
+
+    def heartbeat():
+        # Steps without -progress output (filmstrip, waveform) must not look like a dead worker to claim_next_job
+        while not finished.wait(STALE_JOB_SECONDS / 4):
+            try:
+                update_job(job_id, heartbeat_at=time.time())
+            except sqlite3.Error as e:
+                logger.error(f"Job {job_id} heartbeat failed: {e}")
+
+    threading.Thread(target=heartbeat, name=f"heartbeat-{job_id[:8]}", daemon=True).start()
+    try:
+        progress = JobProgress(job_id, job['duration'])
+        plan = json.loads(job['cmd'])
+        if isinstance(plan, dict):
+            pipelines = {'animation': run_animation_pipeline, 'preview': run_preview_pipeline}
+            error = pipelines[plan['pipeline']](plan, progress)
+        else:
+            error = run_ffmpeg(plan, progress.reporter('main'))
+        if error is None:
+            if job['mode'] == 'preview':
+                size = 0
+                refresh_source_size(job['work_dir'])
+            else:
+                size = sum(os.path.getsize(o['path']) for o in job_outputs(job) if os.path.exists(o['path']))
+            update_job(job_id, status='completed', progress=100, finished_at=time.time(), last_access=time.time(), size_bytes=size)
         else:
-            jobs[job_id]['status'] = 'failed'
-            jobs[job_id]['error'] = "FFmpeg process failed"
+            update_job(job_id, status='failed', error=error, finished_at=time.time())
             
     except Exception as e:
-        jobs[job_id]['status'] = 'failed'
-        jobs[job_id]['error'] = str(e)
+        update_job(job_id, status='failed', error=str(e), finished_at=time.time())
         logger.error(f"Job {job_id} failed: {e}")
+    finally:
+        finished.set()
+
+ANIMATED_FORMATS = ['gif', 'webp']
+# Ranges longer than two segments are split and the segments decoded in parallel
+ANIMATION_SEGMENT_SECONDS = float(os.environ.get('ANIMATION_SEGMENT_SECONDS', '10'))
+ANIMATION_SEGMENT_SHARE = 0.8  # share of the progress bar for the segment phase
+# palettegen/paletteuse pairs: one palette for the whole clip, or a fresh one per frame
+GIF_PALETTES = {
+    'global': ('palettegen=stats_mode=diff', 'paletteuse=dither=sierra2_4a:diff_mode=rectangle'),
+    'frame': ('palettegen=stats_mode=single', 'paletteuse=new=1:dither=sierra2_4a'),
+}
+WEBP_ARGS = ['-c:v', 'libwebp', '-lossless', '0', '-compression_level', '4', '-q:v', '75', '-loop', '0']
+
+def video_filters(fmt, fps, width):
+    filters = []
+    if fps: filters.append(f"fps={fps}")
+    if width or fmt == 'gif': filters.append(f"scale={width or 480}:-1:flags=lanczos")
+    return filters
+
+def animation_output_args(fmt, palette, filters):
+    """
+    Encoder arguments for the final animation pass. GIFs get a palette built
+    from the clip itself (palettegen), applied in the same filter graph
+    (paletteuse) instead of ffmpeg's fixed default palette.
+    """
+    if fmt == 'gif':
+        palettegen, paletteuse = GIF_PALETTES.get(palette, GIF_PALETTES['global'])
+        chain = ','.join(filters + ['split'])
+        return ['-filter_complex', f"[0:v]{chain}[a][b];[a]{palettegen}[p];[b][p]{paletteuse}", '-loop', '0', '-an']
+    args = ['-vf', ','.join(filters)] if filters else []
+    return args + WEBP_ARGS + ['-an']
+
+def animation_segments(start_sec, end_sec):
+    """(start, end) pairs of equal length, none longer than ANIMATION_SEGMENT_SECONDS"""
+    duration = end_sec - start_sec
+    if duration < 2 * ANIMATION_SEGMENT_SECONDS:
+        return [(start_sec, end_sec)]
+    count = int(-(-duration // ANIMATION_SEGMENT_SECONDS))
+    length = duration / count
+    bounds = [start_sec + index * length for index in range(count)] + [end_sec]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def animation_commands(plan, segment_dir):
+    """
+    ffmpeg commands for an animation plan: the parallel segment commands
+    (empty for short ranges) and the final command writing the output.
+    Segments are decoded, resampled and scaled into lossless FFV1 files; the
+    final pass concatenates them and does the palette work once, so the
+    palette covers the whole clip.
+    """
+    progress_args = ['ffmpeg', '-y', '-nostats', '-progress', 'pipe:1']
+    filters = video_filters(plan['format'], plan.get('fps'), plan.get('width'))
+    segments = animation_segments(plan['start'], plan['end'])
+    if len(segments) == 1:
+        cmd = progress_args + trim_input_args(plan['input'], plan['start'], plan['end'])
+        cmd += animation_output_args(plan['format'], plan.get('palette'), filters)
+        return [], cmd + ['-threads', str(FFMPEG_THREADS), plan['output']]
+
+    segment_cmds = []
+    for index, (start, end) in enumerate(segments):
+        cmd = progress_args + trim_input_args(plan['input'], start, end) + ['-an']
+        if filters: cmd.extend(['-vf', ','.join(filters)])
+        # One thread each: the pool supplies the parallelism
+        segment_cmds.append(cmd + ['-c:v', 'ffv1', '-threads', '1', os.path.join(segment_dir, f"segment{index:04d}.mkv")])
+    concat = progress_args + ['-f', 'concat', '-safe', '0', '-i', os.path.join(segment_dir, 'segments.txt')]
+    concat += animation_output_args(plan['format'], plan.get('palette'), [])
+    return segment_cmds, concat + ['-threads', str(FFMPEG_THREADS), plan['output']]
+
+def run_animation_pipeline(plan, progress):
+    """Encode the segments FFMPEG_THREADS at a time, then concatenate them into the output. Returns an error message or None."""
+    segment_dir = tempfile.mkdtemp(prefix='.segments-', dir=os.path.dirname(plan['output']))
+    try:
+        segment_cmds, final_cmd = animation_commands(plan, segment_dir)
+        if not segment_cmds:
+            return run_ffmpeg(final_cmd, progress.reporter('final'))
+
+        segments = animation_segments(plan['start'], plan['end'])
+        total = plan['end'] - plan['start']
+        with open(os.path.join(segment_dir, 'segments.txt'), 'w') as f:
+            f.writelines(f"file '{os.path.basename(cmd[-1])}'\n" for cmd in segment_cmds)
+        reporters = [
+            progress.reporter(index, ANIMATION_SEGMENT_SHARE * (end - start) / total, end - start)
+            for index, (start, end) in enumerate(segments)
+        ]
+        final_reporter = progress.reporter('final', 1 - ANIMATION_SEGMENT_SHARE)
+        # The work happens in the ffmpeg processes; threads only wait on them
+        with ThreadPoolExecutor(max_workers=FFMPEG_THREADS) as pool:
+            errors = [error for error in pool.map(run_ffmpeg, segment_cmds, reporters) if error]
+        if errors:
+            return errors[0]
+        return run_ffmpeg(final_cmd, final_reporter)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+# Editor previews, written to <source>/.preview/ in the background after a fetch
+PREVIEW_DIR = '.preview'
+PREVIEW_FILES = {'proxy': 'proxy.mp4', 'filmstrip': 'filmstrip.jpg', 'waveform': 'waveform.json'}
+PROXY_HEIGHT = 480
+FILMSTRIP_TILES = 40
+FILMSTRIP_TILE_SIZE = (160, 90)
+WAVEFORM_POINTS = 1000
+WAVEFORM_RATE = 8000  # Hz; plenty for an amplitude envelope
+
+def preview_urls(directory):
+    return {name: url_for('custom_static', filename=f"{directory}/{PREVIEW_DIR}/{filename}") for name, filename in PREVIEW_FILES.items()}
+
+def preview_ready(directory):
+    path = os.path.join(DOWNLOAD_FOLDER, directory, PREVIEW_DIR)
+    return all(os.path.exists(os.path.join(path, filename)) for filename in PREVIEW_FILES.values())
+
+def queue_preview(directory, filename):
+    """Queue the preview job for a cached source unless one is already pending; returns the job id."""
+    with closing(job_db()) as conn:
+        row = conn.execute(
+            "SELECT id FROM jobs WHERE work_dir = ? AND mode = 'preview' AND status IN ('queued', 'processing')", (directory,)
+        ).fetchone()
+    if row:
+        return row['id']
+    work_dir = os.path.join(DOWNLOAD_FOLDER, directory)
+    input_path = os.path.join(work_dir, filename)
+    output_dir = os.path.join(work_dir, PREVIEW_DIR)
+    plan = {'pipeline': 'preview', 'input': input_path, 'output_dir': output_dir}
+    job_id = create_job(plan, probe_duration(input_path), work_dir, os.path.join(output_dir, PREVIEW_FILES['proxy']), PREVIEW_FILES['proxy'], 'preview')
+    ensure_job_workers()
+    job_wakeup.set()
+    return job_id
+
+def waveform_peaks(path, duration):
+    """Peak amplitude (0-1) of WAVEFORM_POINTS equal slices of the first audio track; empty without audio."""
+    per_point = max(1, int(duration * WAVEFORM_RATE / WAVEFORM_POINTS))
+    process = subprocess.Popen(
+        ['ffmpeg', '-v', 'error', '-i', path, '-map', '0:a:0', '-ac', '1', '-ar', str(WAVEFORM_RATE), '-f', 's16le', 'pipe:1'],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    peaks = []
+    with process.stdout:
+        # One read per slice keeps memory flat however long the source is
+        while True:
+            data = process.stdout.read(per_point * 2)
+            samples = array('h', data[:len(data) - len(data) % 2])
+            if not samples:
+                break
+            if sys.byteorder == 'big':
+                samples.byteswap()
+            peaks.append(round(max(max(samples), -min(samples)) / 32768, 3))
+    process.wait()
+    return peaks if process.returncode == 0 else []
+
+def run_preview_pipeline(plan, progress):
+    """
+    Proxy for scrubbing, then filmstrip and waveform decoded from the proxy
+    (cheaper than the original). Each file is renamed into place when
+    complete, so preview_ready never sees a partial file. Returns an error
+    message or None.
+    """
+    output_dir = plan['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    proxy = os.path.join(output_dir, PREVIEW_FILES['proxy'])
+    error = run_ffmpeg(
+        ['ffmpeg', '-y', '-nostats', '-progress', 'pipe:1', '-i', plan['input'], '-map', '0:v:0', '-map', '0:a:0?',
+         '-vf', f"scale=-2:'min({PROXY_HEIGHT},ih)'",
+         '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '30', '-maxrate', '1M', '-bufsize', '2M', '-pix_fmt', 'yuv420p',
+         # A keyframe every half second, so seeking never decodes far
+         '-force_key_frames', 'expr:gte(t,n_forced*0.5)',
+         '-c:a', 'aac', '-b:a', '64k', '-ac', '2', '-movflags', '+faststart',
+         '-threads', str(FFMPEG_THREADS), '-f', 'mp4', proxy + '.part'],
+        progress.reporter('proxy', 0.8),
+    )
+    if error:
+        return error
+    os.replace(proxy + '.part', proxy)
+
+    duration = probe_duration(proxy)
+    if duration <= 0:
+        return 'Could not read the proxy duration'
+    width, height = FILMSTRIP_TILE_SIZE
+    filmstrip = os.path.join(output_dir, PREVIEW_FILES['filmstrip'])
+    result = subprocess.run(
+        ['ffmpeg', '-y', '-v', 'error', '-i', proxy, '-an', '-vf',
+         f"fps={FILMSTRIP_TILES}/{duration:.3f},scale={width}:{height}:force_original_aspect_ratio=decrease,"
+         f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,tile={FILMSTRIP_TILES}x1",
+         '-frames:v', '1', '-q:v', '5', '-f', 'image2', filmstrip + '.part'],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        return f"Filmstrip failed: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else ''}".strip(': ')
+    os.replace(filmstrip + '.part', filmstrip)
+
+    waveform = os.path.join(output_dir, PREVIEW_FILES['waveform'])
+    with open(waveform + '.part', 'w') as f:
+        json.dump({'duration': duration, 'peaks': waveform_peaks(proxy, duration)}, f)
+    os.replace(waveform + '.part', waveform)
+    return None
+
+OUTPUT_FORMATS = ['mp4', 'mkv', 'webm', 'mp3', 'wav', 'gif', 'webp']
+AUDIO_FORMATS = ['mp3', 'wav']
+
+def output_spec(values):
+    """Validated settings for one output, from the form or one entry of its 'outputs' list."""
+    fmt = values.get('format') or 'mp4'
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    spec = {'format': fmt, 'palette': values.get('palette') or 'global'}
+    # These end up inside filter graphs, so only plain numbers get through
+    for name, parse in (('fps', lambda v: f"{float(v):g}"), ('width', lambda v: str(int(v))), ('quality', lambda v: str(int(v)))):
+        value = values.get(name)
+        spec[name] = parse(value) if value not in (None, '') else None
+    # Force join fps for non-animated formats to prevent accidental downsampling
+    if fmt not in ANIMATED_FORMATS:
+        spec['fps'] = None
+    spec['mode'] = choose_trim_mode(fmt, spec['fps'], spec['width'], spec['quality'], values.get('trim_mode') or 'auto')
+    return spec
+
+def encoder_args(fmt, mode, quality):
+    """Codec and muxer options of one output, after its filters"""
+    if fmt == 'mp3':
+        return ['-acodec', 'libmp3lame', '-q:a', '2']
+    if fmt in ('wav', 'gif'):
+        return []
+    if fmt == 'webp':
+        return WEBP_ARGS + ['-an']
+    if fmt == 'webm':
+        return ['-c:v', 'libvpx-vp9', '-b:v', '0', '-crf', quality or DEFAULT_CRF['webm'], '-cpu-used', '4', '-row-mt', '1', '-c:a', 'libopus']
+    if mode == 'copy':
+        # Instant cut: no decode, timestamps shifted to start at zero
+        args = ['-map', '0:v?', '-map', '0:a?', '-c', 'copy', '-avoid_negative_ts', 'make_zero']
+        return args + (['-movflags', '+faststart'] if fmt == 'mp4' else [])
+    # MP4/MKV
+    return ['-c:v', 'libx264', '-preset', 'fast', '-crf', quality or DEFAULT_CRF[fmt], '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-c:a', 'aac']
+
+def multi_output_command(input_path, start_sec, end_sec, outputs):
+    """
+    One ffmpeg command writing several outputs of the same range. The range
+    is decoded once; the filter graph splits the frames into one chain per
+    encoded output. Audio and stream-copy outputs map the input directly.
+    """
+    cmd = ['ffmpeg', '-y', '-nostats', '-progress', 'pipe:1'] + trim_input_args(input_path, start_sec, end_sec)
+    encoded = [o for o in outputs if o['format'] not in AUDIO_FORMATS and o['mode'] != 'copy']
+    graph = []
+    if encoded:
+        graph.append(f"[0:v]split={len(encoded)}" + ''.join(f"[v{index}]" for index in range(len(encoded))))
+    output_args = []
+    index = 0
+    for output in outputs:
+        fmt = output['format']
+        if fmt in AUDIO_FORMATS:
+            args = ['-map', '0:a?']
+        elif output['mode'] == 'copy':
+            args = []
+        else:
+            chain = video_filters(fmt, output['fps'], output['width'])
+            if fmt == 'gif':
+                palettegen, paletteuse = GIF_PALETTES.get(output['palette'], GIF_PALETTES['global'])
+                graph.append(f"[v{index}]{','.join(chain + ['split'])}[g{index}][h{index}];"
+                             f"[g{index}]{palettegen}[p{index}];[h{index}][p{index}]{paletteuse}[out{index}]")
+            else:
+                graph.append(f"[v{index}]{','.join(chain) or 'null'}[out{index}]")
+            args = ['-map', f"[out{index}]"] + ([] if fmt in ANIMATED_FORMATS else ['-map', '0:a?'])
+            index += 1
+        output_args += args + encoder_args(fmt, output['mode'], output['quality']) + ['-threads', str(FFMPEG_THREADS), output['path']]
+    if graph:
+        cmd.extend(['-filter_complex', ';'.join(graph)])
+    return cmd + output_args
 
 @app.route('/process', methods=['POST'])
 def process_video():
@@ -190,92 +1130,162 @@ def process_video():
     video_title = request.form.get('video_title', 'video')
     start_time = request.form.get('start_time')
     end_time = request.form.get('end_time')
-    fmt = request.form.get('format', 'mp4')
-    
-    # Advanced settings
-    fps = request.form.get('fps')
-    width = request.form.get('width')
-    quality = request.form.get('quality')
-    
-    # Force join fps for non-animated formats to prevent accidental downsampling
-    if fmt not in ['gif', 'webp']:
-        fps = None
-
 
     if not directory or not filename:
          return jsonify({'error': 'Missing parameters'}), 400
 
+    # Either one output from the form fields or a JSON list of output settings
+    try:
+        specs = json.loads(request.form['outputs']) if request.form.get('outputs') else [request.form]
+        outputs = [output_spec(values) for values in specs]
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'error': f"Invalid output settings: {e}"}), 400
+    if not outputs:
+        return jsonify({'error': 'No outputs requested'}), 400
+
     work_dir = os.path.join(DOWNLOAD_FOLDER, directory)
     input_path = os.path.join(work_dir, filename)
+    # Touching also keeps the janitor from evicting the source under the new job
+    if not os.path.exists(input_path) or not touch_source(directory):
+        return jsonify({'error': 'Source expired, please fetch the video again'}), 410
+    if any(o['format'] in AUDIO_FORMATS for o in outputs) and not has_audio(input_path):
+        return jsonify({'error': 'This video has no audio track to extract'}), 400
     
     # Calculate total duration for progress
     start_sec = parse_time_str(start_time)
     end_sec = parse_time_str(end_time)
+    if end_sec <= start_sec:
+        # Open-ended range: the rest of the file, per ffprobe
+        end_sec = probe_duration(input_path)
     duration = end_sec - start_sec if end_sec > start_sec else 0
 
-    # Output filename
+    # Output filenames
     from datetime import datetime
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_title = "".join([c for c in video_title if c.isalnum() or c in (' ', '-', '_')]).strip().replace(' ', '_') or "video"
-    output_filename = f"{safe_title}_{timestamp}.{fmt}"
-    output_path = os.path.join(work_dir, output_filename)
+    for index, output in enumerate(outputs):
+        suffix = f"_{index + 1}" if len(outputs) > 1 else ''
+        output['download_name'] = f"{safe_title}_{timestamp}{suffix}.{output['format']}"
+        output['path'] = os.path.join(work_dir, output['download_name'])
+
+    if len(outputs) > 1:
+        # One decode for all of them
+        cmd = multi_output_command(input_path, start_sec, end_sec, outputs)
+        mode = 'copy' if all(o['mode'] == 'copy' for o in outputs) else 'encode'
+        files = [{'format': o['format'], 'path': o['path'], 'download_name': o['download_name']} for o in outputs]
+        return queue_job(cmd, duration, work_dir, files[0]['path'], files[0]['download_name'], mode, outputs=files)
+
+    output = outputs[0]
+    fmt, mode = output['format'], output['mode']
+    if fmt in ANIMATED_FORMATS:
+        # Palette-based pipeline, split into parallel segments for long ranges (run_animation_pipeline)
+        plan = {
+            'pipeline': 'animation', 'input': input_path, 'output': output['path'], 'format': fmt,
+            'start': start_sec, 'end': end_sec, 'fps': output['fps'], 'width': output['width'], 'palette': output['palette'],
+        }
+        return queue_job(plan, duration, work_dir, output['path'], output['download_name'], mode)
 
     # Build Command
-    cmd = ['ffmpeg', '-y', '-i', input_path]
-    if start_time: cmd.extend(['-ss', start_time])
-    if end_time: cmd.extend(['-to', end_time])
-    
-    filters = []
-    if fps: filters.append(f"fps={fps}")
-    if width: filters.append(f"scale={width}:-1:flags=lanczos")
-    
-    if fmt in ['mp3', 'wav']:
+    # Machine-readable progress on stdout instead of the stderr status line
+    cmd = ['ffmpeg', '-y', '-nostats', '-progress', 'pipe:1'] + trim_input_args(input_path, start_sec, end_sec)
+    filters = video_filters(fmt, output['fps'], output['width'])
+    if fmt in AUDIO_FORMATS:
         cmd.extend(['-vn'])
-        if fmt == 'mp3': cmd.extend(['-acodec', 'libmp3lame', '-q:a', '2'])
-    
-    elif fmt == 'gif':
-        if not width: filters.append("scale=480:-1:flags=lanczos")
-        if filters: cmd.extend(['-vf', ','.join(filters)])
-    
-    elif fmt == 'webp':
-        if filters: cmd.extend(['-vf', ','.join(filters)])
-        cmd.extend(['-c:v', 'libwebp', '-lossless', '0', '-compression_level', '4', '-q:v', '75', '-loop', '0', '-an'])
+    elif filters:
+        cmd.extend(['-vf', ','.join(filters)])
+    cmd.extend(encoder_args(fmt, mode, output['quality']))
+    cmd.extend(['-threads', str(FFMPEG_THREADS), output['path']])
+    return queue_job(cmd, duration, work_dir, output['path'], output['download_name'], mode)
 
-    elif fmt == 'webm':
-         if filters: cmd.extend(['-vf', ','.join(filters)])
-         crf_val = quality if quality else '30'
-         cmd.extend(['-c:v', 'libvpx-vp9', '-b:v', '0', '-crf', crf_val, '-cpu-used', '4', '-row-mt', '1', '-c:a', 'libopus'])
+def queue_job(cmd, duration, work_dir, output_path, download_name, mode, outputs=None):
+    job_id = create_job(cmd, duration, work_dir, output_path, download_name, mode, outputs)
+    ensure_job_workers()
+    job_wakeup.set()
     
-    else: # MP4/MKV
-        if filters: cmd.extend(['-vf', ','.join(filters)])
-        crf_val = quality if quality else '23'
-        cmd.extend(['-c:v', 'libx264', '-preset', 'fast', '-crf', crf_val, '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-c:a', 'aac'])
+    job = get_job(job_id)
+    return jsonify({'job_id': job_id, 'mode': mode, 'status': job['status'], 'queue_position': job.get('queue_position')})
 
-    cmd.append(output_path)
-    
-    # Start Job
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {'status': 'processing', 'progress': 0}
-    
-    thread = threading.Thread(target=run_ffmpeg_job, args=(job_id, cmd, duration, output_path, output_filename))
-    thread.start()
-    
-    return jsonify({'job_id': job_id})
+@app.before_request
+def start_job_workers():
+    # Also resumes jobs left queued or interrupted by a restart
+    ensure_job_workers()
+
+def job_status(job):
+    status = {
+        'status': job['status'],
+        'progress': job['progress'],
+        'queue_position': job.get('queue_position'),
+        'mode': job['mode'],
+        'error': job['error'],
+    }
+    status.update(json.loads(job['stats']) if job['stats'] else {})
+    if job['outputs']:
+        # Per-file state of a multi-output job; each has its own /download_file/<job_id>/<index>.
+        # All outputs come from one ffmpeg run over the same range, so they advance with the job
+        # and only differ once it ends (an output missing after success failed on its own).
+        status['outputs'] = []
+        for output in job_outputs(job):
+            exists = os.path.exists(output['path'])
+            if job['status'] == 'completed':
+                output_status, output_progress = ('completed', 100) if exists else ('failed', 0)
+            else:
+                output_status, output_progress = job['status'], job['progress']
+            status['outputs'].append({
+                'format': output['format'],
+                'download_name': output['download_name'],
+                'size_bytes': os.path.getsize(output['path']) if exists else 0,
+                'status': output_status,
+                'progress': output_progress,
+            })
+    return status
 
 @app.route('/progress/<job_id>')
 def get_progress(job_id):
-    job = jobs.get(job_id)
+    job = get_job(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
-    return jsonify(job)
+    return jsonify(job_status(job))
+
+@app.route('/events/<job_id>')
+def job_events(job_id):
+    """Server-sent events with the job status; one connection per client instead of polling /progress."""
+    if not get_job(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+
+    def stream():
+        last_payload, last_sent = None, 0.0
+        while True:
+            job = get_job(job_id)
+            if not job:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+            payload = json.dumps(job_status(job))
+            if payload != last_payload:
+                yield f"data: {payload}\n\n"
+                last_payload, last_sent = payload, time.time()
+            elif time.time() - last_sent >= 15:
+                yield ': keepalive\n\n'
+                last_sent = time.time()
+            if job['status'] in ('completed', 'failed'):
+                return
+            time.sleep(0.5)
+
+    # The job store is shared, so any worker can stream any job
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/download_file/<job_id>')
-def download_file(job_id):
-    job = jobs.get(job_id)
-    if not job or job['status'] != 'completed':
+@app.route('/download_file/<job_id>/<int:index>')
+def download_file(job_id, index=0):
+    job = get_job(job_id)
+    outputs = job_outputs(job) if job else []
+    if not job or job['status'] != 'completed' or index >= len(outputs) or not os.path.exists(outputs[index]['path']):
         flash('File not ready or expired.', 'error')
         return redirect(url_for('index'))
-    return send_file(job['result_path'], as_attachment=True, download_name=job['download_name'])
+    update_job(job_id, last_access=time.time())
+    return serve_media(outputs[index]['path'], download_name=outputs[index]['download_name'])
+
+os.makedirs(DOWNLOAD_FOLDER, exist_ok=True)
+init_job_db()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+GIF/WebP benchmark: the former one-pass ffmpeg command (fps/scale filters
+only) vs the palette pipeline, run whole and split into parallel segments.
+The source is a synthetic clip from ffmpeg's lavfi testsrc2; pass --source
+to use a real video instead. Requires ffmpeg on PATH.
+
+    python benchmarks/bench_animation.py --duration 60
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench-animation-")
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Importing the app creates downloads/ and config/ under the cwd
+os.environ["JOB_DB_PATH"] = os.path.join(WORK_DIR, "jobs.db")
+os.chdir(WORK_DIR)
+sys.path.insert(0, APP_DIR)
+
+import app as vd_app  # noqa: E402
+
+
+class NullProgress:
+    def reporter(self, *args, **kwargs):
+        return lambda block: None
+
+
+def legacy_command(source, fmt, start, end, fps, width):
+    """The gif/webp branch of process_video before the palette pipeline."""
+    filters = [f"fps={fps}"]
+    if width:
+        filters.append(f"scale={width}:-1:flags=lanczos")
+    elif fmt == "gif":
+        filters.append("scale=480:-1:flags=lanczos")
+    cmd = ["ffmpeg", "-y", "-v", "error"] + vd_app.trim_input_args(source, start, end) + ["-vf", ",".join(filters)]
+    if fmt == "webp":
+        cmd.extend(["-c:v", "libwebp", "-lossless", "0", "-compression_level", "4", "-q:v", "75", "-loop", "0", "-an"])
+    return cmd + ["-threads", str(vd_app.FFMPEG_THREADS)]
+
+
+def run(label, func, output):
+    started = time.perf_counter()
+    error = func()
+    elapsed = time.perf_counter() - started
+    if error:
+        print(f"{label:<28} failed: {error}")
+        return
+    size = os.path.getsize(output) / 1024 ** 2
+    print(f"{label:<28} {elapsed:8.1f} s  {size:8.2f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="video file (default: generated testsrc2 clip)")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to encode")
+    parser.add_argument("--fps", default="15")
+    parser.add_argument("--width", default="")
+    parser.add_argument("--formats", default="gif,webp")
+    args = parser.parse_args()
+
+    try:
+        source = args.source
+        if not source:
+            source = os.path.join(WORK_DIR, "source.mp4")
+            subprocess.run(
+                ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size=1280x720:rate=30:duration={args.duration}",
+                 "-c:v", "libx264", "-preset", "veryfast", "-g", "60", source],
+                check=True,
+            )
+        end = args.duration
+        segment_seconds = vd_app.ANIMATION_SEGMENT_SECONDS
+
+        for fmt in args.formats.split(","):
+            output = os.path.join(WORK_DIR, f"out.{fmt}")
+            plan = {
+                "pipeline": "animation", "input": source, "output": output, "format": fmt,
+                "start": 0.0, "end": end, "fps": args.fps, "width": args.width, "palette": "global",
+            }
+
+            def legacy():
+                result = subprocess.run(legacy_command(source, fmt, 0.0, end, args.fps, args.width) + [output], capture_output=True, text=True)
+                return result.stderr.strip() if result.returncode else None
+
+            def pipeline(segment_seconds, **overrides):
+                def encode():
+                    vd_app.ANIMATION_SEGMENT_SECONDS = segment_seconds
+                    return vd_app.run_animation_pipeline(dict(plan, **overrides), NullProgress())
+                return encode
+
+            run(f"{fmt} one-pass (legacy)", legacy, output)
+            run(f"{fmt} pipeline, whole", pipeline(float("inf")), output)
+            run(f"{fmt} pipeline, segmented", pipeline(segment_seconds), output)
+            if fmt == "gif":
+                run(f"{fmt} frame palettes, segmented", pipeline(segment_seconds, palette="frame"), output)
+    finally:
+        os.chdir(APP_DIR)
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
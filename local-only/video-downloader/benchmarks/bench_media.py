@@ -0,0 +1,125 @@
+"""
+Media serving benchmark: whole-file throughput, random byte ranges (what a
+seeking <video> asks for) and conditional revalidation against
+/downloads/<path>. Runs an in-process threaded server unless --base-url
+points at a deployment (e.g. behind nginx with ACCEL_REDIRECT_PREFIX set),
+in which case --path names a file that exists there.
+
+    python benchmarks/bench_media.py --size-mb 512 --ranges 200
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+WORK_DIR = tempfile.mkdtemp(prefix="bench-media-")
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Importing the app creates downloads/ and config/ under the cwd
+os.environ["JOB_DB_PATH"] = os.path.join(WORK_DIR, "jobs.db")
+os.chdir(WORK_DIR)
+sys.path.insert(0, APP_DIR)
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as vd_app  # noqa: E402
+
+# The test file is untracked, so the janitor would remove it mid-run
+vd_app.janitor_loop = lambda: None
+
+CHUNK = 1024 * 1024
+
+
+def fetch(url, headers=None):
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            size = 0
+            while True:
+                data = response.read(CHUNK)
+                if not data:
+                    break
+                size += len(data)
+            return response.status, size, dict(response.headers)
+    except urllib.error.HTTPError as e:
+        return e.code, 0, dict(e.headers)
+
+
+def whole_file(url, repeat):
+    started = time.perf_counter()
+    total = 0
+    for _ in range(repeat):
+        status, size, _ = fetch(url)
+        assert status == 200, status
+        total += size
+    elapsed = time.perf_counter() - started
+    print(f"{'whole file':<22} {total / CHUNK / elapsed:9.0f} MiB/s  ({repeat} x {size / CHUNK:.0f} MiB)")
+
+
+def ranges(url, file_size, count, length):
+    offsets = [random.randrange(0, max(1, file_size - length)) for _ in range(count)]
+    started = time.perf_counter()
+    for offset in offsets:
+        status, size, _ = fetch(url, {"Range": f"bytes={offset}-{offset + length - 1}"})
+        assert status == 206 and size == length, (status, size)
+    elapsed = time.perf_counter() - started
+    print(f"{'random ranges':<22} {elapsed / count * 1000:9.2f} ms/request  ({count} x {length // 1024} KiB)")
+
+
+def revalidation(url, count):
+    _, _, headers = fetch(url, {"Range": "bytes=0-0"})
+    etag = headers.get("ETag")
+    if not etag:
+        print(f"{'revalidation':<22} skipped: no ETag")
+        return
+    started = time.perf_counter()
+    for _ in range(count):
+        status, _, _ = fetch(url, {"If-None-Match": etag})
+        assert status == 304, status
+    elapsed = time.perf_counter() - started
+    print(f"{'revalidation (304)':<22} {elapsed / count * 1000:9.2f} ms/request  ({count} requests)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", help="benchmark a running instance instead of an in-process server")
+    parser.add_argument("--path", default="bench/media.bin", help="file under downloads/ to request")
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ranges", type=int, default=200)
+    parser.add_argument("--range-kb", type=int, default=1024)
+    args = parser.parse_args()
+
+    server = None
+    try:
+        base_url = args.base_url
+        if not base_url:
+            path = os.path.join(vd_app.DOWNLOAD_FOLDER, args.path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for _ in range(args.size_mb):
+                    f.write(os.urandom(CHUNK))
+            server = make_server("127.0.0.1", 0, vd_app.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+
+        url = f"{base_url.rstrip('/')}/downloads/{args.path}"
+        _, _, headers = fetch(url, {"Range": "bytes=0-0"})
+        file_size = int(headers["Content-Range"].rsplit("/", 1)[1])
+        whole_file(url, args.repeat)
+        ranges(url, file_size, args.ranges, args.range_kb * 1024)
+        revalidation(url, args.ranges)
+    finally:
+        if server:
+            server.shutdown()
+        os.chdir(APP_DIR)
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture()
+def app_module(tmp_path, monkeypatch):
+    # The app keeps its downloads and job store next to the working directory
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module("app")
+    return importlib.reload(module)
+
+
+def test_multi_output_command_trims_every_output(app_module):
+    outputs = [
+        dict(app_module.output_spec({"format": fmt}), path=f"out.{fmt}")
+        for fmt in ("mp4", "gif", "mp3")
+    ]
+    cmd = app_module.multi_output_command("in.mp4", 5, 15, outputs)
+
+    # Input options: the range applies to the input, so to all outputs at once
+    input_index = cmd.index("-i")
+    assert cmd[input_index + 1] == "in.mp4"
+    assert cmd[cmd.index("-ss") + 1] == "5.000" and cmd.index("-ss") < input_index
+    assert cmd[cmd.index("-t") + 1] == "10.000" and cmd.index("-t") < input_index
+    assert cmd.count("-t") == 1
+
+    assert [arg for arg in cmd if arg.startswith("out.")] == ["out.mp4", "out.gif", "out.mp3"]
+    # Audio outputs map the audio stream optionally, so silent sources do not fail the run
+    mp3_args = cmd[cmd.index("out.gif") + 1 : cmd.index("out.mp3")]
+    assert mp3_args[:2] == ["-map", "0:a?"]